@@ -1,17 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response, g
 from flask_cors import CORS
 import os
-import uuid
+import re
+import time
 import json
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 import torch
 import ssl
 import platform
 from dotenv import load_dotenv
 from model import PlantDiseaseModel
+from inference_service import create_predictor
 from database import db, MongoJSONEncoder
-from auth import generate_token, token_required, admin_required
+from auth import token_required, admin_required
+from tokens import generate_token
 from logger import logger, log_prediction, log_api_request, log_error
+from metrics import render_metrics, current_endpoint, stage_timer, observe_request, PREDICTIONS
+from tracing import start_trace, finish_trace
+import profiling
+from disease_info import get_disease_info
+from uploads import UPLOAD_FOLDER, MAX_CONTENT_LENGTH, allowed_file, store_upload, ValidatingFileStream
 
 # Load environment variables
 load_dotenv()
@@ -20,7 +28,14 @@ load_dotenv()
 if platform.system() == 'Darwin':
     ssl._create_default_https_context = ssl._create_unverified_context
 
+class UploadRequest(Request):
+    """Request whose uploaded files are validated while the body is parsed"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return ValidatingFileStream()
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.json_encoder = MongoJSONEncoder  # Use custom JSON encoder for MongoDB
 
 # Configure CORS to be permissive during development
@@ -28,10 +43,9 @@ CORS(app, origins=["*"], supports_credentials=True, allow_headers=["Content-Type
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 
 # Configure upload folder
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Bodies over the limit are refused from Content-Length, or as soon as the limit is crossed
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
 # Initialize model with error handling
 try:
@@ -40,7 +54,7 @@ try:
     logger.info(f"Loading model from path: {model_path}")
     
     if os.path.exists(model_path):
-        model = PlantDiseaseModel(model_path=model_path)
+        model = create_predictor(model_path)
         logger.info(f"Successfully loaded model from {model_path}")
     else:
         logger.warning(f"Model file not found at {model_path}, initializing without weights")
@@ -51,17 +65,38 @@ try:
             os.makedirs(models_dir)
             logger.info(f"Created models directory: {models_dir}")
         
-        model = PlantDiseaseModel()
+        model = create_predictor(None)
         logger.info("Initialized model without pretrained weights")
 except Exception as e:
     logger.error(f"Error initializing model: {e}")
     logger.info("Initializing model without pretrained weights...")
     model = PlantDiseaseModel()
 
-def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+@app.before_request
+def start_request_timer():
+    """Label this request's metrics with its route, start the clock and open a trace"""
+    # The route rule rather than the path, so analysis ids do not become labels
+    current_endpoint.set(request.url_rule.rule if request.url_rule else 'unmatched')
+    g.request_started = time.perf_counter()
+    # One ID per request, shared by its log events, trace and stored analysis
+    g.trace = start_trace(request.headers.get('X-Request-ID'))
+    # Starting a profile or polling for its report is not part of the workload
+    if not request.path.startswith('/api/admin/profile'):
+        profiling.request_started()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record total request time and error responses, and close the request's trace"""
+    started = g.get('request_started')
+    if started is not None:
+        observe_request(current_endpoint.get(), request.method, response.status_code,
+                        time.perf_counter() - started)
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['X-Request-ID'] = trace.request_id
+        finish_trace(current_endpoint.get(), request.method, response.status_code)
+    profiling.request_finished()
+    return response
 
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
@@ -69,9 +104,17 @@ def health_check():
     """API health check endpoint"""
     return jsonify({
         'status': 'ok',
-        'message': 'Plant disease detection API is running'
+        'message': 'Plant disease detection API is running',
+        'database': db.health()
     })
 
+# Metrics endpoint
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics endpoint"""
+    data, content_type = render_metrics()
+    return Response(data, mimetype=content_type)
+
 # Authentication endpoints
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -129,27 +172,37 @@ def get_user_profile(current_user):
 @app.route('/api/detect', methods=['POST'])
 def detect_disease():
     """Public endpoint for plant disease detection without authentication"""
-    if 'file' not in request.files:
+    try:
+        # Size, magic bytes and dimensions are checked while the body is read
+        with stage_timer('upload_read'):
+            files = request.files
+    except HTTPException as e:
+        log_error(f'Upload rejected: {e.description}', context={'endpoint': '/api/detect'})
+        return jsonify({'error': e.description}), e.code
+    if 'file' not in files:
         log_error('No file part in the request', context={'endpoint': '/api/detect'})
         return jsonify({'error': 'No file part in the request'}), 400
     
-    file = request.files['file']
+    file = files['file']
     
     if file.filename == '':
         log_error('No file selected', context={'endpoint': '/api/detect'})
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
-        # Generate a unique filename
-        filename = str(uuid.uuid4()) + os.path.splitext(secure_filename(file.filename))[1]
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Save the file
-        file.save(file_path)
+        try:
+            # Stored once per distinct image under its content hash; this
+            # request holds a reference to it until it finishes
+            with stage_timer('disk_save'):
+                filename, file_path = store_upload(file, db.acquire_upload, app.config['UPLOAD_FOLDER'])
+        except HTTPException as e:
+            return jsonify({'error': e.description}), e.code
         
         try:
             # Run prediction
             result = model.predict(file_path)
+            if 'disease' in result:
+                PREDICTIONS.labels(result['disease']).inc()
             
             # Add metadata
             result['image_id'] = filename
@@ -174,9 +227,9 @@ def detect_disease():
             log_error(error_msg, context={'endpoint': '/api/detect', 'image': filename})
             return jsonify({'error': error_msg}), 500
         finally:
-            # Optionally clean up the file after prediction
-            # os.remove(file_path)
-            pass
+            # Nothing keeps an anonymous upload, so this deletes it unless
+            # a saved analysis shares the same image
+            db.release_upload(filename)
     
     log_error('Invalid file format', context={'endpoint': '/api/detect', 'filename': file.filename})
     return jsonify({'error': 'Invalid file format. Allowed formats: png, jpg, jpeg'}), 400
@@ -185,27 +238,38 @@ def detect_disease():
 @token_required
 def detect_disease_authenticated(current_user):
     """Authenticated endpoint for plant disease detection"""
-    if 'file' not in request.files:
+    try:
+        # Size, magic bytes and dimensions are checked while the body is read
+        with stage_timer('upload_read'):
+            files = request.files
+    except HTTPException as e:
+        log_error(f'Upload rejected: {e.description}', current_user['_id'], {'endpoint': '/api/user/detect'})
+        return jsonify({'error': e.description}), e.code
+    if 'file' not in files:
         log_error('No file part in the request', current_user['_id'], {'endpoint': '/api/user/detect'})
         return jsonify({'error': 'No file part in the request'}), 400
     
-    file = request.files['file']
+    file = files['file']
     
     if file.filename == '':
         log_error('No file selected', current_user['_id'], {'endpoint': '/api/user/detect'})
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
-        # Generate a unique filename
-        filename = str(uuid.uuid4()) + os.path.splitext(secure_filename(file.filename))[1]
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Save the file
-        file.save(file_path)
+        try:
+            # Stored once per distinct image under its content hash; this
+            # request holds a reference to it until it finishes
+            with stage_timer('disk_save'):
+                filename, file_path = store_upload(file, db.acquire_upload, app.config['UPLOAD_FOLDER'])
+        except HTTPException as e:
+            return jsonify({'error': e.description}), e.code
         
+        analysis = None
         try:
             # Run prediction
             result = model.predict(file_path)
+            if 'disease' in result:
+                PREDICTIONS.labels(result['disease']).inc()
             
             # Add metadata
             result['image_id'] = filename
@@ -245,9 +309,9 @@ def detect_disease_authenticated(current_user):
             log_error(error_msg, current_user['_id'], {'endpoint': '/api/user/detect', 'image': filename})
             return jsonify({'error': error_msg}), 500
         finally:
-            # Optionally clean up the file after prediction
-            # os.remove(file_path)
-            pass
+            # A saved analysis keeps the request's reference; otherwise drop it
+            if analysis is None:
+                db.release_upload(filename)
     
     log_error('Invalid file format', current_user['_id'], {'endpoint': '/api/user/detect', 'filename': file.filename})
     return jsonify({'error': 'Invalid file format. Allowed formats: png, jpg, jpeg'}), 400
@@ -302,72 +366,61 @@ def get_all_users(current_user):
     users = list(db.get_user_collection().find({}, {'password': 0}))
     return jsonify(users)
 
-# Disease info helper
-def get_disease_info(disease_name):
-    """Get additional information about the disease"""
-    # This would ideally come from a database
-    # For now, we're providing sample data for a few diseases
-    disease_info = {
-        "Apple___Apple_scab": {
-            "description": "Apple scab is a fungal disease caused by Venturia inaequalis that affects apple trees, causing dark, scabby lesions on leaves and fruit.",
-            "symptoms": [
-                "Dark, olive-green spots on leaves",
-                "Dark, scab-like lesions on fruit",
-                "Severely infected leaves may turn yellow and drop early",
-                "Misshapen fruit if infected when young"
-            ],
-            "treatments": [
-                "Remove and destroy fallen leaves and infected fruit",
-                "Prune trees to improve air circulation",
-                "Apply fungicides early in the growing season",
-                "Plant scab-resistant apple varieties",
-                "Apply protective fungicide before rainy periods"
-            ]
-        },
-        "Tomato___Late_blight": {
-            "description": "Late blight is a devastating disease caused by the fungus-like oomycete pathogen Phytophthora infestans. It can rapidly destroy tomato plants, especially in cool, wet conditions.",
-            "symptoms": [
-                "Dark, water-soaked spots on leaves",
-                "White, fuzzy growth on the undersides of leaves",
-                "Brown lesions on stems",
-                "Firm, dark, greasy-looking spots on fruits"
-            ],
-            "treatments": [
-                "Remove and destroy affected plant parts",
-                "Apply copper-based fungicide as a preventative measure",
-                "Ensure good air circulation around plants",
-                "Water at the base of plants, avoiding wet foliage",
-                "Rotate crops yearly"
-            ]
-        },
-        "Tomato___Early_blight": {
-            "description": "Early blight is a common fungal disease caused by Alternaria solani. It typically affects older leaves first and can spread to stems and fruit.",
-            "symptoms": [
-                "Brown to black spots with concentric rings",
-                "Yellowing around the spots",
-                "Spots may merge, causing leaves to die",
-                "Dark lesions on stems",
-                "Dark, sunken spots on fruit"
-            ],
-            "treatments": [
-                "Remove infected leaves promptly",
-                "Apply fungicides labeled for early blight",
-                "Mulch around plants to prevent spores from splashing",
-                "Rotate crops every 3-4 years",
-                "Ensure adequate plant spacing for airflow"
-            ]
-        }
-    }
-    
-    # Return default info if the specific disease info is not available
-    if disease_name not in disease_info:
-        return {
-            "description": "Information about this plant disease is being updated.",
-            "symptoms": [],
-            "treatments": ["Consult a local agricultural extension service for specific treatment options."]
-        }
-    
-    return disease_info[disease_name]
+@app.route('/api/admin/profile', methods=['POST'])
+@token_required
+@admin_required
+def profile_worker(current_user):
+    """Admin endpoint to start profiling this worker for a number of seconds or requests"""
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = float(data['seconds']) if data.get('seconds') is not None else None
+        requests_limit = int(data['requests']) if data.get('requests') is not None else None
+        interval_ms = float(data.get('interval_ms', profiling.PROFILE_INTERVAL_MS))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'seconds, requests and interval_ms must be numbers'}), 400
+    if seconds is None and requests_limit is None:
+        seconds = 10.0
+    if (seconds is not None and seconds <= 0) or (requests_limit is not None and requests_limit <= 0):
+        return jsonify({'error': 'seconds and requests must be positive'}), 400
+
+    try:
+        session = profiling.start_session(seconds=seconds, requests=requests_limit, interval_ms=interval_ms,
+                                          operators=bool(data.get('operators', True)),
+                                          all_threads=bool(data.get('all_threads', False)))
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+
+    logger.info(f"Profiling {session.id} started by {current_user['email']}: "
+                f"seconds={seconds}, requests={requests_limit}")
+    # The session runs in the background: holding this request open would
+    # block a sync worker's only thread, so nothing else could be profiled
+    return jsonify({
+        'id': session.id,
+        'pid': os.getpid(),
+        'seconds': session.seconds,
+        'requests': requests_limit,
+        'report': f"/api/admin/profile/{session.id}"
+    }), 202
+
+@app.route('/api/admin/profile/<session_id>', methods=['GET'])
+@token_required
+@admin_required
+def get_profile_report(current_user, session_id):
+    """Admin endpoint to fetch the report of a profiling session"""
+    if not re.fullmatch(r'[0-9a-f]{32}', session_id):
+        return jsonify({'error': 'Invalid profiling session id'}), 400
+    report = profiling.load_report(session_id)
+    if report is None:
+        active = profiling.session
+        if active is not None and active.id == session_id:
+            return jsonify({'id': session_id, 'status': 'running'}), 202
+        # Possibly still running in another worker
+        return jsonify({'error': 'Profiling report not found or not finished yet'}), 404
+
+    # ?format=folded returns just the collapsed stacks, ready for flamegraph.pl
+    if request.args.get('format') == 'folded':
+        return Response(report['folded'] + '\n', mimetype='text/plain')
+    return jsonify(report)
 
 @app.route('/api/diseases', methods=['GET'])
 def get_diseases():
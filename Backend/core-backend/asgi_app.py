@@ -0,0 +1,467 @@
+import os
+import re
+import time
+import asyncio
+import contextvars
+import datetime
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+import jwt
+from bson import ObjectId
+from quart import Quart, request, jsonify, Response, g
+from quart.wrappers import Request
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+from werkzeug.exceptions import HTTPException
+from dotenv import load_dotenv
+from inference_service import create_predictor
+from async_database import async_db
+from tokens import generate_token, JWT_SECRET
+from logger import (logger, async_log_prediction, async_log_api_request, async_log_error,
+                    close_async_es_client)
+from metrics import render_metrics, current_endpoint, stage_timer, observe_request, PREDICTIONS
+from tracing import start_trace, finish_trace, span
+from disease_info import get_disease_info
+from uploads import (UPLOAD_FOLDER, MAX_CONTENT_LENGTH, FORMAT_EXTENSIONS, allowed_file, check_upload,
+                     spool_upload, commit_upload, ValidatingFileStream)
+
+# Load environment variables
+load_dotenv()
+
+# Threads dedicated to model inference, kept separate from the default
+# executor so slow predictions cannot starve other blocking work
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes MongoDB ObjectIds and dates"""
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        if isinstance(obj, datetime.datetime):
+            return obj.isoformat()
+        return DefaultJSONProvider.default(obj)
+
+class UploadRequest(Request):
+    """Request whose uploaded files are validated while the body streams in, as in app.py"""
+
+    def make_form_data_parser(self):
+        return self.form_data_parser_class(
+            max_content_length=self.max_content_length,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.parameter_storage_class,
+            stream_factory=lambda *args, **kwargs: ValidatingFileStream()
+        )
+
+app = Quart(__name__)
+app.request_class = UploadRequest
+app.json = MongoJSONProvider(app)  # Use custom JSON provider for MongoDB
+
+# Configure CORS to be permissive during development. quart-cors refuses a
+# "*" origin with credentials, so any origin is matched and echoed back instead
+app = cors(app, allow_origin=re.compile(r".*"), allow_credentials=True, allow_headers=["Content-Type", "Authorization"],
+           allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+
+model_path = os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth'))
+logger.info(f"Loading model from path: {model_path}")
+model = create_predictor(model_path)
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+
+@app.before_serving
+async def startup():
+    """Open the async MongoDB client on the serving event loop"""
+    await async_db.connect()
+
+@app.after_serving
+async def shutdown():
+    """Release clients and the inference threads"""
+    async_db.close()
+    await close_async_es_client()
+    inference_executor.shutdown(wait=True)
+
+async def run_inference(file_path):
+    """Run model.predict on the inference executor"""
+    loop = asyncio.get_running_loop()
+    # run_in_executor does not carry context variables over, so pass the
+    # request's context along for the stage metrics
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(inference_executor, context.run, model.predict, file_path)
+
+def token_required(f):
+    """Async counterpart of auth.token_required"""
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        token = None
+
+        auth_header = request.headers.get("Authorization")
+        if auth_header and auth_header.startswith("Bearer "):
+            token = auth_header.split(" ")[1]
+
+        if not token:
+            return jsonify({"error": "Authentication token is missing"}), 401
+
+        try:
+            with span("auth.token_required"):
+                data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+                current_user = await async_db.get_user_by_id(data["sub"])
+
+            if not current_user:
+                return jsonify({"error": "User not found"}), 401
+
+        except jwt.ExpiredSignatureError:
+            return jsonify({"error": "Token expired"}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Invalid token"}), 401
+
+        kwargs["current_user"] = current_user
+        return await f(*args, **kwargs)
+
+    return decorated
+
+def admin_required(f):
+    """Async counterpart of auth.admin_required"""
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        current_user = kwargs.get("current_user")
+
+        if not current_user or current_user.get("role") != "admin":
+            return jsonify({"error": "Admin privileges required"}), 403
+
+        return await f(*args, **kwargs)
+
+    return decorated
+
+async def save_upload(file, image_format):
+    """Store an upload under its content hash, holding one reference; returns (image_id, path)"""
+    root = app.config['UPLOAD_FOLDER']
+    loop = asyncio.get_running_loop()
+    with stage_timer('disk_save'):
+        image_id, temp_path = await loop.run_in_executor(
+            None, spool_upload, file.stream, root, FORMAT_EXTENSIONS[image_format])
+        # The reference is taken before the blob is put in place, as in uploads.store_upload
+        try:
+            await async_db.acquire_upload(image_id)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        # Off the event loop too: commit_upload waits for the blob's lock
+        return image_id, await loop.run_in_executor(None, commit_upload, temp_path, image_id, root)
+
+@app.before_request
+async def start_request_timer():
+    """Label this request's metrics with its route, start the clock and open a trace"""
+    current_endpoint.set(request.url_rule.rule if request.url_rule else 'unmatched')
+    g.request_started = time.perf_counter()
+    # One ID per request, shared by its log events, trace and stored analysis
+    g.trace = start_trace(request.headers.get('X-Request-ID'))
+
+@app.after_request
+async def record_request_metrics(response):
+    """Record total request time and error responses, and close the request's trace"""
+    started = g.get('request_started')
+    if started is not None:
+        observe_request(current_endpoint.get(), request.method, response.status_code,
+                        time.perf_counter() - started)
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['X-Request-ID'] = trace.request_id
+        finish_trace(current_endpoint.get(), request.method, response.status_code)
+    return response
+
+# Health check endpoint
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """API health check endpoint"""
+    return jsonify({
+        'status': 'ok',
+        'message': 'Plant disease detection API is running',
+        'database': await async_db.health()
+    })
+
+# Metrics endpoint
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus metrics endpoint"""
+    data, content_type = render_metrics()
+    return Response(data, mimetype=content_type)
+
+# Authentication endpoints
+@app.route('/api/auth/register', methods=['POST'])
+async def register():
+    """Register a new user"""
+    data = await request.get_json()
+
+    if not data or not data.get('email') or not data.get('password') or not data.get('name'):
+        return jsonify({'error': 'Name, email and password are required'}), 400
+
+    user, error = await async_db.register_user(data['name'], data['email'], data['password'])
+
+    if error:
+        return jsonify({'error': error}), 400
+
+    token = generate_token(user['_id'], user['email'], user['name'], user['role'])
+
+    return jsonify({
+        'token': token,
+        'user': user
+    })
+
+@app.route('/api/auth/login', methods=['POST'])
+async def login():
+    """Login a user"""
+    data = await request.get_json()
+
+    if not data or not data.get('email') or not data.get('password'):
+        return jsonify({'error': 'Email and password are required'}), 400
+
+    user, error = await async_db.login_user(data['email'], data['password'])
+
+    if error:
+        return jsonify({'error': error}), 401
+
+    token = generate_token(user['_id'], user['email'], user['name'], user['role'])
+
+    return jsonify({
+        'token': token,
+        'user': user
+    })
+
+@app.route('/api/auth/me', methods=['GET'])
+@token_required
+async def get_user_profile(current_user):
+    """Get current user profile"""
+    return jsonify(current_user)
+
+# Disease detection endpoints
+@app.route('/api/detect', methods=['POST'])
+async def detect_disease():
+    """Public endpoint for plant disease detection without authentication"""
+    try:
+        with stage_timer('upload_read'):
+            files = await request.files
+    except HTTPException as e:
+        await async_log_error(f'Upload rejected: {e.description}', context={'endpoint': '/api/detect'})
+        return jsonify({'error': e.description}), e.code
+    if 'file' not in files:
+        await async_log_error('No file part in the request', context={'endpoint': '/api/detect'})
+        return jsonify({'error': 'No file part in the request'}), 400
+
+    file = files['file']
+
+    if file.filename == '':
+        await async_log_error('No file selected', context={'endpoint': '/api/detect'})
+        return jsonify({'error': 'No file selected'}), 400
+
+    if file and allowed_file(file.filename):
+        try:
+            # Already validated as it streamed in; this returns the detected format
+            image_format = check_upload(file)[0]
+        except HTTPException as e:
+            return jsonify({'error': e.description}), e.code
+
+        filename, file_path = await save_upload(file, image_format)
+
+        try:
+            result = await run_inference(file_path)
+            if 'disease' in result:
+                PREDICTIONS.labels(result['disease']).inc()
+
+            result['image_id'] = filename
+            result.update(get_disease_info(result['disease']))
+
+            await async_log_prediction(
+                user_id='anonymous',
+                disease=result['disease'],
+                confidence=result['confidence'],
+                image_filename=filename
+            )
+
+            await async_log_api_request('/api/detect', 'POST', 'anonymous', 200)
+
+            return jsonify(result)
+        except Exception as e:
+            error_msg = str(e)
+            await async_log_error(error_msg, context={'endpoint': '/api/detect', 'image': filename})
+            return jsonify({'error': error_msg}), 500
+        finally:
+            # Nothing keeps an anonymous upload; released unless an analysis shares the image
+            await async_db.release_upload(filename)
+
+    await async_log_error('Invalid file format', context={'endpoint': '/api/detect', 'filename': file.filename})
+    return jsonify({'error': 'Invalid file format. Allowed formats: png, jpg, jpeg'}), 400
+
+@app.route('/api/user/detect', methods=['POST'])
+@token_required
+async def detect_disease_authenticated(current_user):
+    """Authenticated endpoint for plant disease detection"""
+    try:
+        with stage_timer('upload_read'):
+            files = await request.files
+    except HTTPException as e:
+        await async_log_error(f'Upload rejected: {e.description}', current_user['_id'], {'endpoint': '/api/user/detect'})
+        return jsonify({'error': e.description}), e.code
+    if 'file' not in files:
+        await async_log_error('No file part in the request', current_user['_id'], {'endpoint': '/api/user/detect'})
+        return jsonify({'error': 'No file part in the request'}), 400
+
+    file = files['file']
+
+    if file.filename == '':
+        await async_log_error('No file selected', current_user['_id'], {'endpoint': '/api/user/detect'})
+        return jsonify({'error': 'No file selected'}), 400
+
+    if file and allowed_file(file.filename):
+        try:
+            # Already validated as it streamed in; this returns the detected format
+            image_format = check_upload(file)[0]
+        except HTTPException as e:
+            return jsonify({'error': e.description}), e.code
+
+        filename, file_path = await save_upload(file, image_format)
+
+        analysis = None
+        try:
+            result = await run_inference(file_path)
+            if 'disease' in result:
+                PREDICTIONS.labels(result['disease']).inc()
+
+            result['image_id'] = filename
+            info = get_disease_info(result['disease'])
+
+            analysis = await async_db.save_analysis(
+                current_user['_id'],
+                filename,
+                result['disease'],
+                result['confidence'],
+                result['top_predictions'],
+                info['symptoms'],
+                info['treatments'],
+                info['description']
+            )
+
+            result.update(info)
+            result['_id'] = analysis['_id']
+
+            await async_log_prediction(
+                user_id=current_user['_id'],
+                disease=result['disease'],
+                confidence=result['confidence'],
+                image_filename=filename
+            )
+
+            await async_log_api_request('/api/user/detect', 'POST', current_user['_id'], 200)
+
+            return jsonify(result)
+        except Exception as e:
+            error_msg = str(e)
+            await async_log_error(error_msg, current_user['_id'], {'endpoint': '/api/user/detect', 'image': filename})
+            return jsonify({'error': error_msg}), 500
+        finally:
+            # A saved analysis keeps the request's reference; otherwise drop it
+            if analysis is None:
+                await async_db.release_upload(filename)
+
+    await async_log_error('Invalid file format', current_user['_id'], {'endpoint': '/api/user/detect', 'filename': file.filename})
+    return jsonify({'error': 'Invalid file format. Allowed formats: png, jpg, jpeg'}), 400
+
+# History endpoints
+@app.route('/api/user/analyses', methods=['GET'])
+@token_required
+async def get_user_analyses(current_user):
+    """Get all analyses for the authenticated user"""
+    limit = int(request.args.get('limit', 10))
+    skip = int(request.args.get('skip', 0))
+
+    analyses = await async_db.get_user_analyses(current_user['_id'], limit, skip)
+
+    return jsonify(analyses)
+
+@app.route('/api/user/analyses/<analysis_id>', methods=['GET'])
+@token_required
+async def get_analysis(current_user, analysis_id):
+    """Get a specific analysis"""
+    analysis = await async_db.get_analysis_by_id(analysis_id, current_user['_id'])
+
+    if not analysis:
+        return jsonify({'error': 'Analysis not found'}), 404
+
+    return jsonify(analysis)
+
+@app.route('/api/user/analyses/<analysis_id>', methods=['DELETE'])
+@token_required
+async def delete_analysis(current_user, analysis_id):
+    """Delete a specific analysis"""
+    success = await async_db.delete_analysis(analysis_id, current_user['_id'])
+
+    if not success:
+        return jsonify({'error': 'Analysis not found or you do not have permission to delete it'}), 404
+
+    return jsonify({'message': 'Analysis deleted successfully'})
+
+@app.route('/api/user/statistics', methods=['GET'])
+@token_required
+async def get_user_statistics(current_user):
+    """Get statistics for the authenticated user"""
+    statistics = await async_db.get_statistics(current_user['_id'])
+    return jsonify(statistics)
+
+# Admin endpoints
+@app.route('/api/admin/users', methods=['GET'])
+@token_required
+@admin_required
+async def get_all_users(current_user):
+    """Admin endpoint to get all users"""
+    users = await async_db.get_all_users()
+    return jsonify(users)
+
+@app.route('/api/diseases', methods=['GET'])
+async def get_diseases():
+    """Get the list of detectable diseases"""
+    return jsonify({
+        'diseases': list(model.class_labels.values())
+    })
+
+# Endpoint for frontend logs
+@app.route('/api/logs', methods=['POST'])
+async def receive_logs():
+    """Endpoint to receive logs from frontend"""
+    try:
+        log_data = await request.get_json()
+
+        if not log_data:
+            return jsonify({'error': 'No log data provided'}), 400
+
+        level = log_data.get('level', 'info')
+        message = log_data.get('message', 'No message provided')
+        user_id = log_data.get('userId', 'anonymous')
+        context = log_data.get('context', {})
+
+        context['source'] = 'frontend'
+        context['userAgent'] = log_data.get('userAgent')
+
+        if level == 'error':
+            await async_log_error(message, user_id, context)
+        else:
+            await async_log_api_request(
+                endpoint=context.get('endpoint', 'unknown'),
+                method=context.get('method', 'unknown'),
+                user_id=user_id,
+                status_code=context.get('status', 200),
+                request_data=context
+            )
+
+        return jsonify({'success': True}), 200
+    except Exception as e:
+        await async_log_error(f"Error processing frontend log: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+if __name__ == "__main__":
+    # Development server; in production run under hypercorn:
+    #   hypercorn asgi_app:app --bind 0.0.0.0:5002
+    app.run(host='0.0.0.0', port=5002)
@@ -0,0 +1,293 @@
+import time
+import asyncio
+import datetime
+import bcrypt
+import pymongo
+from pymongo import ReturnDocument
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from mongo_config import (MONGODB_URI, MONGODB_DB, MONGODB_HEALTH_TIMEOUT_MS, CommandLatencyListener,
+                          PoolMetricsListener, get_client_options, stats_key, stats_disease)
+from tracing import traced, current_request_id
+from uploads import UploadLock, delete_blob
+
+class AsyncDatabase:
+    """Motor-backed counterpart of Database for the ASGI app"""
+
+    def __init__(self):
+        self.client = None
+        self.db = None
+
+    async def connect(self):
+        """Connect to MongoDB; must be called from the serving event loop"""
+        try:
+            if self.client is None:
+                self.client = AsyncIOMotorClient(
+                    MONGODB_URI,
+                    event_listeners=[CommandLatencyListener(), PoolMetricsListener()],
+                    **get_client_options()
+                )
+                self.db = self.client[MONGODB_DB]
+                print(f"Connected to database: {self.db.name}")
+
+                # Create indexes for better performance
+                await self.db.users.create_index([("email", pymongo.ASCENDING)], unique=True)
+                await self.db.analyses.create_index([("user_id", pymongo.ASCENDING)])
+                await self.db.analyses.create_index([("created_at", pymongo.DESCENDING)])
+                await self.db.user_stats.create_index([("user_id", pymongo.ASCENDING)], unique=True)
+
+            return True
+        except Exception as e:
+            print(f"Error connecting to MongoDB: {e}")
+            return False
+
+    async def health(self):
+        """Ping the server and report the effective pool configuration"""
+        status = {
+            "connected": False,
+            "max_pool_size": self.client.options.pool_options.max_pool_size if self.client else None,
+            "read_preference": self.client.read_preference.mongos_mode if self.client else None,
+        }
+        if self.client is None:
+            return status
+
+        try:
+            started = time.perf_counter()
+            with pymongo.timeout(MONGODB_HEALTH_TIMEOUT_MS / 1000):
+                await self.client.admin.command("ping")
+            status["connected"] = True
+            status["ping_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        except Exception as e:
+            status["error"] = str(e)
+        return status
+
+    def get_user_collection(self):
+        """Get users collection"""
+        return self.db.users
+
+    def get_analyses_collection(self):
+        """Get analyses collection"""
+        return self.db.analyses
+
+    def get_user_stats_collection(self):
+        """Get per-user statistics collection"""
+        return self.db.user_stats
+
+    def get_upload_collection(self):
+        """Get stored-upload reference count collection"""
+        return self.db.uploads
+
+    # Stored upload operations, see Database
+    async def acquire_upload(self, image_id):
+        """Add a reference to a stored upload"""
+        await self.get_upload_collection().update_one(
+            {"_id": image_id},
+            {"$inc": {"refs": 1}, "$setOnInsert": {"created_at": datetime.datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def release_upload(self, image_id):
+        """Drop a reference to a stored upload, deleting the file when none are left"""
+        uploads = self.get_upload_collection()
+        record = await uploads.find_one_and_update(
+            {"_id": image_id},
+            {"$inc": {"refs": -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if record is None or record["refs"] > 0:
+            return False
+        # Same protocol as uploads.remove_upload. The lock is taken on an
+        # executor thread, since waiting for it would stall the event loop
+        lock = UploadLock(image_id)
+        await asyncio.get_running_loop().run_in_executor(None, lock.acquire)
+        try:
+            result = await uploads.delete_one({"_id": image_id, "refs": {"$lte": 0}})
+            if result.deleted_count != 1:
+                return False
+            delete_blob(image_id)
+            return True
+        finally:
+            lock.release()
+
+    # User operations
+    @traced('db.register_user')
+    async def register_user(self, name, email, password):
+        """Register a new user"""
+        users = self.get_user_collection()
+
+        # Check if user already exists
+        if await users.find_one({"email": email}):
+            return None, "User with this email already exists"
+
+        # bcrypt is deliberately slow, keep it off the event loop
+        hashed_password = await asyncio.to_thread(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt())
+
+        user = {
+            "name": name,
+            "email": email,
+            "password": hashed_password,
+            "role": "user",
+            "created_at": datetime.datetime.utcnow()
+        }
+
+        result = await users.insert_one(user)
+
+        user_data = {
+            "_id": str(result.inserted_id),
+            "name": name,
+            "email": email,
+            "role": "user",
+            "created_at": user["created_at"].isoformat()
+        }
+
+        return user_data, None
+
+    @traced('db.login_user')
+    async def login_user(self, email, password):
+        """Log in a user"""
+        users = self.get_user_collection()
+        user = await users.find_one({"email": email})
+
+        if not user:
+            return None, "User not found"
+
+        if await asyncio.to_thread(bcrypt.checkpw, password.encode('utf-8'), user["password"]):
+            user_data = {
+                "_id": str(user["_id"]),
+                "name": user["name"],
+                "email": user["email"],
+                "role": user["role"],
+                "created_at": user["created_at"].isoformat() if "created_at" in user else None
+            }
+            return user_data, None
+        else:
+            return None, "Invalid password"
+
+    @traced('db.get_user_by_id')
+    async def get_user_by_id(self, user_id):
+        """Get user by ID"""
+        users = self.get_user_collection()
+        try:
+            user = await users.find_one({"_id": ObjectId(user_id)})
+            if user:
+                return {
+                    "_id": str(user["_id"]),
+                    "name": user["name"],
+                    "email": user["email"],
+                    "role": user["role"],
+                    "created_at": user["created_at"].isoformat() if "created_at" in user else None
+                }
+            return None
+        except:
+            return None
+
+    async def get_all_users(self):
+        """Get all users without their password hashes"""
+        return await self.get_user_collection().find({}, {'password': 0}).to_list(length=None)
+
+    # Analysis operations
+    @traced('db.save_analysis')
+    async def save_analysis(self, user_id, image_id, disease, confidence, top_predictions, symptoms, treatments, description):
+        """Save analysis result"""
+        analyses = self.get_analyses_collection()
+
+        analysis = {
+            "user_id": ObjectId(user_id),
+            "image_id": image_id,
+            "disease": disease,
+            "confidence": confidence,
+            "top_predictions": top_predictions,
+            "symptoms": symptoms,
+            "treatments": treatments,
+            "description": description,
+            "request_id": current_request_id(),
+            "created_at": datetime.datetime.utcnow()
+        }
+
+        result = await analyses.insert_one(analysis)
+        analysis["_id"] = result.inserted_id
+        await self._update_user_stats(analysis["user_id"], disease, 1)
+        return analysis
+
+    @traced('db.get_user_analyses')
+    async def get_user_analyses(self, user_id, limit=10, skip=0):
+        """Get analyses for a user"""
+        analyses = self.get_analyses_collection()
+        cursor = analyses.find({"user_id": ObjectId(user_id)}) \
+                         .sort("created_at", pymongo.DESCENDING) \
+                         .skip(skip) \
+                         .limit(limit)
+
+        return await cursor.to_list(length=limit)
+
+    @traced('db.get_analysis_by_id')
+    async def get_analysis_by_id(self, analysis_id, user_id=None):
+        """Get analysis by ID, optionally filtered by user_id for security"""
+        query = {"_id": ObjectId(analysis_id)}
+
+        if user_id:
+            query["user_id"] = ObjectId(user_id)
+
+        return await self.get_analyses_collection().find_one(query)
+
+    @traced('db.delete_analysis')
+    async def delete_analysis(self, analysis_id, user_id):
+        """Delete analysis by ID (only if it belongs to the user)"""
+        deleted = await self.get_analyses_collection().find_one_and_delete({
+            "_id": ObjectId(analysis_id),
+            "user_id": ObjectId(user_id)
+        }, projection={"disease": 1, "image_id": 1})
+        if deleted is None:
+            return False
+
+        await self._update_user_stats(ObjectId(user_id), deleted.get("disease"), -1)
+        if deleted.get("image_id"):
+            await self.release_upload(deleted["image_id"])
+        return True
+
+    # Statistics operations
+    async def _update_user_stats(self, user_id, disease, delta):
+        """Atomically adjust a user's running totals by delta"""
+        await self.get_user_stats_collection().update_one(
+            {"user_id": user_id},
+            {
+                "$inc": {
+                    "total_analyses": delta,
+                    f"disease_counts.{stats_key(disease)}": delta
+                },
+                "$set": {"updated_at": datetime.datetime.utcnow()}
+            },
+            upsert=True
+        )
+
+    @traced('db.get_statistics')
+    async def get_statistics(self, user_id):
+        """Get statistics for a user"""
+        stats = await self.get_user_stats_collection().find_one({"user_id": ObjectId(user_id)})
+
+        total_analyses = 0
+        unique_diseases = 0
+        most_common_disease = None
+
+        if stats:
+            total_analyses = stats.get("total_analyses", 0)
+            counts = {stats_disease(k): v for k, v in stats.get("disease_counts", {}).items() if v > 0}
+            unique_diseases = len(counts)
+            if counts:
+                most_common_disease = max(counts, key=counts.get)
+
+        return {
+            "total_analyses": total_analyses,
+            "unique_diseases": unique_diseases,
+            "most_common_disease": most_common_disease
+        }
+
+    def close(self):
+        """Close MongoDB connection"""
+        if self.client:
+            self.client.close()
+            self.client = None
+            self.db = None
+
+# Create a global async database instance; connect() runs at server startup
+async_db = AsyncDatabase()
@@ -1,31 +1,9 @@
-import os
 import jwt
-import datetime
 from functools import wraps
 from flask import request, jsonify
-from dotenv import load_dotenv
 from database import db
-
-# Load environment variables
-load_dotenv()
-
-# JWT settings
-JWT_SECRET = os.getenv("JWT_SECRET", "plantg_secret_key_do_not_share")
-JWT_EXPIRATION = 24 * 60 * 60  # 24 hours in seconds
-
-def generate_token(user_id, email, name, role="user"):
-    """Generate JWT token for authenticated user"""
-    payload = {
-        "sub": str(user_id),
-        "email": email,
-        "name": name,
-        "role": role,
-        "iat": datetime.datetime.utcnow(),
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=JWT_EXPIRATION)
-    }
-    
-    token = jwt.encode(payload, JWT_SECRET, algorithm="HS256")
-    return token
+from tokens import JWT_SECRET
+from tracing import span
 
 def token_required(f):
     """Decorator to protect routes that require authentication"""
@@ -42,11 +20,12 @@ def token_required(f):
             return jsonify({"error": "Authentication token is missing"}), 401
         
         try:
-            # Verify token
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            
-            # Get user from database
-            current_user = db.get_user_by_id(data["sub"])
+            with span("auth.token_required"):
+                # Verify token
+                data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+                
+                # Get user from database
+                current_user = db.get_user_by_id(data["sub"])
             
             if not current_user:
                 return jsonify({"error": "User not found"}), 401
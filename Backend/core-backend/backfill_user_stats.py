@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import os
+import datetime
+from pymongo import ReplaceOne
+from database import db, stats_key
+
+# Number of user_stats documents written per bulk_write call
+BATCH_SIZE = int(os.getenv("STATS_BACKFILL_BATCH_SIZE", "500"))
+
+def build_user_stats(analyses):
+    """Yield one user_stats document per user from the analyses collection"""
+    # Group on (user, disease) first, then fold the diseases of each user
+    # into a single document so the server does all of the counting
+    pipeline = [
+        {"$group": {
+            "_id": {"user_id": "$user_id", "disease": "$disease"},
+            "count": {"$sum": 1}
+        }},
+        {"$group": {
+            "_id": "$_id.user_id",
+            "total_analyses": {"$sum": "$count"},
+            "diseases": {"$push": {"disease": "$_id.disease", "count": "$count"}}
+        }}
+    ]
+
+    now = datetime.datetime.utcnow()
+    for row in analyses.aggregate(pipeline, allowDiskUse=True):
+        yield {
+            "user_id": row["_id"],
+            "total_analyses": row["total_analyses"],
+            "disease_counts": {stats_key(d["disease"]): d["count"] for d in row["diseases"]},
+            "updated_at": now
+        }
+
+def backfill_user_stats():
+    """Rebuild the user_stats collection from existing analyses"""
+    user_stats = db.get_user_stats_collection()
+
+    operations = []
+    users = 0
+    for stats in build_user_stats(db.get_analyses_collection()):
+        operations.append(ReplaceOne({"user_id": stats["user_id"]}, stats, upsert=True))
+        users += 1
+
+        if len(operations) >= BATCH_SIZE:
+            user_stats.bulk_write(operations, ordered=False)
+            print(f"Wrote statistics for {users} users...")
+            operations = []
+
+    if operations:
+        user_stats.bulk_write(operations, ordered=False)
+
+    print(f"Backfill complete: statistics rebuilt for {users} users")
+    return users
+
+if __name__ == "__main__":
+    backfill_user_stats()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import os
+import time
+import json
+import argparse
+from torch.utils.data import DataLoader
+from torchvision.datasets import ImageFolder
+from dataset_cache import DATASET_CACHE_DIR, CachedImageDataset, cache_exists
+from dataset_shards import DATASET_SHARD_DIR, ShardedImageDataset, shards_exist
+from train_model import get_train_transforms, get_val_transforms, BATCH_SIZE
+
+def measure(name, dataset, args, shuffle):
+    """Images/sec of one full pass (or --max-images) through a DataLoader"""
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=shuffle, num_workers=args.workers)
+    images = 0
+    started = time.perf_counter()
+    first_batch = None
+    for inputs, _ in loader:
+        if first_batch is None:
+            first_batch = time.perf_counter() - started
+        images += inputs.size(0)
+        if args.max_images and images >= args.max_images:
+            break
+    elapsed = time.perf_counter() - started
+    row = {
+        'loader': name,
+        'images': images,
+        'seconds': round(elapsed, 2),
+        'images_per_sec': round(images / elapsed, 1) if elapsed else 0.0,
+        'first_batch_sec': round(first_batch or 0.0, 2),
+    }
+    print(f"  {name:<12} {row['images_per_sec']:>9} img/s  ({images} images in {row['seconds']} s, "
+          f"first batch after {row['first_batch_sec']} s)")
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare data loading throughput of ImageFolder, tar shards and the decoded cache')
+    parser.add_argument('--dataset', default=os.getenv("KAGGLE_DATASET_PATH", "./plant_disease_dataset"))
+    parser.add_argument('--split', default='train', choices=['train', 'val'])
+    parser.add_argument('--workers', type=int, default=4, help='DataLoader worker processes')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--max-images', type=int, default=0, help='Stop each run after this many images (0 = full pass)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    train = args.split == 'train'
+    transform_factory = get_train_transforms if train else get_val_transforms
+
+    print(f"Loading the {args.split} split with {args.workers} worker(s), batch size {args.batch_size}")
+    rows = [measure('imagefolder', ImageFolder(os.path.join(args.dataset, args.split), transform=transform_factory()),
+                    args, shuffle=train)]
+    if shards_exist(DATASET_SHARD_DIR, args.split):
+        rows.append(measure('shards', ShardedImageDataset(DATASET_SHARD_DIR, args.split, transform=transform_factory(),
+                                                          shuffle=train), args, shuffle=False))
+    else:
+        print(f"  shards       skipped, none in {DATASET_SHARD_DIR} (run dataset_shards.py)")
+    if cache_exists(DATASET_CACHE_DIR, args.split):
+        rows.append(measure('cache', CachedImageDataset(DATASET_CACHE_DIR, args.split,
+                                                        transform=transform_factory(cached=True)), args, shuffle=train))
+    else:
+        print(f"  cache        skipped, none in {DATASET_CACHE_DIR} (run dataset_cache.py)")
+
+    baseline = rows[0]['images_per_sec']
+    if baseline:
+        for row in rows[1:]:
+            print(f"{row['loader']} is {row['images_per_sec'] / baseline:.2f}x ImageFolder")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'split': args.split, 'workers': args.workers, 'results': rows}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
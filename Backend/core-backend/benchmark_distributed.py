@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import os
+import time
+import json
+import socket
+import argparse
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler
+from torchvision import models
+from cpu_policy import get_thread_policy, apply_thread_policy, available_cores
+from train_model import create_dataset
+
+def free_port():
+    """An unused local TCP port for the rendezvous"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def synthetic_batches(batch_size, num_classes):
+    """Endless random batches, so the run measures compute and gradient sync only"""
+    inputs = torch.randn(batch_size, 3, 299, 299)
+    labels = torch.randint(0, num_classes, (batch_size,))
+    while True:
+        yield inputs, labels
+
+def real_batches(rank, world_size, batch_size, loader_workers):
+    """Endless batches from this rank's DistributedSampler shard of the training split"""
+    dataset = create_dataset("train", train=True, streaming=False)
+    sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True)
+    loader = DataLoader(dataset, batch_size=batch_size, sampler=sampler, num_workers=loader_workers)
+    epoch = 0
+    while True:
+        sampler.set_epoch(epoch)
+        for batch in loader:
+            yield batch
+        epoch += 1
+
+def run_rank(rank, world_size, port, threads, args, results):
+    """One training process: DDP Inception V3 steps, timed after warm-up"""
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group(backend="gloo", rank=rank, world_size=world_size)
+    apply_thread_policy(get_thread_policy(num_workers=world_size, worker_index=rank, intra_op_threads=threads,
+                                          inter_op_threads=1, pin_cores=args.pin))
+
+    # Random init: the benchmark only needs the compute shape of the real model
+    model = models.inception_v3(weights=None, aux_logits=False, init_weights=False)
+    model.fc = nn.Linear(model.fc.in_features, args.num_classes)
+    ddp_model = DistributedDataParallel(model)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(ddp_model.parameters(), lr=1e-4)
+    ddp_model.train()
+
+    batches = real_batches(rank, world_size, args.batch_size, args.loader_workers) if args.real \
+        else synthetic_batches(args.batch_size, args.num_classes)
+
+    def step():
+        inputs, labels = next(batches)
+        optimizer.zero_grad()
+        criterion(ddp_model(inputs), labels).backward()
+        optimizer.step()
+        return inputs.size(0)
+
+    for _ in range(args.warmup):
+        step()
+    dist.barrier()
+    started = time.perf_counter()
+    images = sum(step() for _ in range(args.steps))
+    dist.barrier()
+    elapsed = time.perf_counter() - started
+
+    total_images = torch.tensor([images], dtype=torch.float64)
+    dist.all_reduce(total_images)
+    if rank == 0:
+        results.put((total_images.item(), elapsed))
+    dist.destroy_process_group()
+
+def run_configuration(world_size, args):
+    """Train with world_size processes on this host and return images/sec"""
+    threads = args.threads or max(1, len(available_cores()) // world_size)
+    ctx = mp.get_context("spawn")
+    results = ctx.SimpleQueue()
+    port = free_port()
+    processes = [ctx.Process(target=run_rank, args=(rank, world_size, port, threads, args, results))
+                 for rank in range(world_size)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    if any(process.exitcode != 0 for process in processes) or results.empty():
+        raise RuntimeError(f"Benchmark with {world_size} process(es) failed")
+
+    images, elapsed = results.get()
+    return {
+        'processes': world_size,
+        'threads_per_process': threads,
+        'global_batch': world_size * args.batch_size,
+        'images_per_sec': round(images / elapsed, 2),
+    }
+
+def main():
+    cores = len(available_cores())
+    parser = argparse.ArgumentParser(description='Measure DistributedDataParallel CPU training throughput vs process count')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads', type=int, help='Intra-op threads per process (default: cores / processes)')
+    parser.add_argument('--batch-size', type=int, default=32, help='Per-process batch size')
+    parser.add_argument('--steps', type=int, default=20, help='Timed optimizer steps per configuration')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed optimizer steps per configuration')
+    parser.add_argument('--num-classes', type=int, default=38)
+    parser.add_argument('--real', action='store_true', help='Load the training split instead of synthetic batches')
+    parser.add_argument('--loader-workers', type=int, default=2, help='DataLoader workers per process with --real')
+    parser.add_argument('--pin', action='store_true', help='Pin each process to its own block of cores')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    print(f"DDP scaling on {cores} cores, per-process batch {args.batch_size}, "
+          f"{'real' if args.real else 'synthetic'} data")
+    rows = []
+    for world_size in args.processes:
+        row = run_configuration(world_size, args)
+        baseline = rows[0]['images_per_sec'] / rows[0]['processes'] if rows else row['images_per_sec'] / world_size
+        row['scaling_efficiency'] = round(row['images_per_sec'] / (baseline * world_size), 3)
+        rows.append(row)
+        print(f"  processes={world_size:<3} threads={row['threads_per_process']:<3} "
+              f"{row['images_per_sec']:>8} img/s  efficiency={row['scaling_efficiency']:.0%}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cores': cores, 'results': rows}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import numpy as np
+import torch
+from PIL import Image
+from model import PlantDiseaseModel
+from model_optimization import cpu_supports_bf16
+from cpu_policy import get_thread_policy, available_cores
+
+SYNTHETIC_IMAGE_SIZE = 256  # PlantVillage photos are 256x256
+# Metrics compared against the baseline; lower is better for all of them
+COMPARED_METRICS = ['preprocess_ms', 'forward_ms_p50', 'per_image_ms', 'postprocess_ms']
+
+def synthetic_images(count, seed=0):
+    """In-memory JPEGs of random pixels, so runs need no dataset"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (SYNTHETIC_IMAGE_SIZE, SYNTHETIC_IMAGE_SIZE, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+def real_images(image_dir, count):
+    """Encoded bytes of up to count images from a directory"""
+    files = sorted(f for f in os.listdir(image_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))[:count]
+    images = []
+    for name in files:
+        with open(os.path.join(image_dir, name), 'rb') as f:
+            images.append(f.read())
+    return images
+
+def timed(fn, iterations, warmup):
+    """Run fn warmup + iterations times; return the timed durations in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def measure_preprocess(model, images, iterations):
+    """Mean milliseconds to decode and transform one image (the same path as predict)"""
+    index = [0]
+
+    def preprocess():
+        data = images[index[0] % len(images)]
+        index[0] += 1
+        with Image.open(io.BytesIO(data)) as img:
+            model.transform(img.convert('RGB'))
+
+    return statistics.mean(timed(preprocess, iterations, warmup=2))
+
+def measure_config(model, images, batch_size, args):
+    """Forward and postprocess latency of one model at one batch size"""
+    with Image.open(io.BytesIO(images[0])) as img:
+        one = model.transform(img.convert('RGB')).unsqueeze(0)
+    batch = one.repeat(batch_size, 1, 1, 1)
+
+    forward = timed(lambda: model.forward_logits(batch), args.iterations, args.warmup)
+    logits = model.forward_logits(one)[0]
+    postprocess = timed(lambda: model.postprocess(logits), args.iterations, warmup=2)
+
+    forward_p50 = percentile(forward, 50)
+    return {
+        'batch_size': batch_size,
+        'forward_ms_p50': round(forward_p50, 3),
+        'forward_ms_p90': round(percentile(forward, 90), 3),
+        'per_image_ms': round(forward_p50 / batch_size, 3),
+        'images_per_sec': round(batch_size * 1000 / forward_p50, 2),
+        'postprocess_ms': round(statistics.mean(postprocess), 4),
+    }
+
+def config_key(row):
+    return f"{row['backend']}/{row['precision']}/t{row['threads']}/b{row['batch_size']}/{row['images']}"
+
+def compare(results, baseline, tolerance):
+    """Print per-config changes against the baseline; return the regressions"""
+    previous = {config_key(row): row for row in baseline['results']}
+    regressions = []
+    print(f"\n=== Comparison with baseline (tolerance {tolerance:.0%}) ===")
+    for row in results:
+        old = previous.get(config_key(row))
+        if old is None:
+            continue
+        changes = []
+        for metric in COMPARED_METRICS:
+            if not old.get(metric):
+                continue
+            ratio = row[metric] / old[metric]
+            changes.append(f"{metric} {ratio - 1:+.1%}")
+            if ratio > 1 + tolerance:
+                regressions.append({'config': config_key(row), 'metric': metric,
+                                    'baseline': old[metric], 'current': row[metric]})
+        print(f"  {config_key(row):<36} " + ", ".join(changes))
+    if regressions:
+        print("\nRegressions:")
+        for r in regressions:
+            print(f"  {r['config']} {r['metric']}: {r['baseline']} -> {r['current']}")
+    else:
+        print("\nNo regressions")
+    return regressions
+
+def main():
+    cores = len(available_cores())
+    parser = argparse.ArgumentParser(description='Benchmark PlantDiseaseModel preprocess, forward and postprocess latency')
+    parser.add_argument('--model-path', default=os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth')))
+    parser.add_argument('--images', help='Directory of real images (default: synthetic JPEGs)')
+    parser.add_argument('--image-count', type=int, default=32)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument('--threads', type=int, nargs='+', help='Intra-op thread counts (default: 1, 2, 4, ... up to cores)')
+    parser.add_argument('--backends', nargs='+', default=['eager', 'fused'], choices=['eager', 'fused'])
+    parser.add_argument('--precisions', nargs='+', default=['fp32', 'bf16'], choices=['fp32', 'bf16'],
+                        help='bf16 is skipped on CPUs without native support')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed runs per measurement')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed runs per measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help='Machine-readable results')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed slowdown before a metric counts as a regression')
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    threads = args.threads or [t for t in (1, 2, 4, 8, 16, 32, 64) if t <= cores]
+    images = real_images(args.images, args.image_count) if args.images else synthetic_images(args.image_count, args.seed)
+    if not images:
+        parser.error(f"No images found in {args.images}")
+    image_kind = 'real' if args.images else 'synthetic'
+    precisions = [p for p in args.precisions if p == 'fp32' or cpu_supports_bf16()]
+
+    results = []
+    for backend in args.backends:
+        for precision in precisions:
+            model = PlantDiseaseModel(model_path=args.model_path, backend=backend, precision=precision,
+                                      thread_policy=get_thread_policy(num_workers=1, intra_op_threads=max(threads),
+                                                                      inter_op_threads=1, pin_cores=False))
+            if model.backend != backend or model.precision != precision:
+                print(f"Skipping {backend}/{precision}: not available on this machine")
+                continue
+            for num_threads in threads:
+                torch.set_num_threads(num_threads)
+                preprocess_ms = measure_preprocess(model, images, args.iterations)
+                for batch_size in args.batch_sizes:
+                    row = {'backend': backend, 'precision': precision, 'threads': num_threads, 'images': image_kind,
+                           'preprocess_ms': round(preprocess_ms, 3), **measure_config(model, images, batch_size, args)}
+                    results.append(row)
+                    print(f"  {config_key(row):<36} preprocess {row['preprocess_ms']:>7.2f} ms  "
+                          f"forward p50 {row['forward_ms_p50']:>8.2f} ms ({row['per_image_ms']:>7.2f} ms/img)  "
+                          f"postprocess {row['postprocess_ms']:>6.3f} ms")
+
+    report = {
+        'environment': {
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cores': cores,
+            'bf16': cpu_supports_bf16(),
+        },
+        'results': results
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import os
+import time
+import json
+import argparse
+import torch
+import torch.multiprocessing as mp
+from model import PlantDiseaseModel, IMAGE_SIZE
+from cpu_policy import get_thread_policy, available_cores
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def run_worker(worker_index, num_workers, threads, pin, model_path, image, iterations, warmup, barrier, results):
+    """Benchmark process: one model, its own thread policy, timed predictions"""
+    policy = get_thread_policy(num_workers=num_workers, worker_index=worker_index,
+                               intra_op_threads=threads, pin_cores=pin)
+    model = PlantDiseaseModel(model_path=model_path, thread_policy=policy)
+
+    if image:
+        predict = lambda: model.predict(image)
+    else:
+        inputs = torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE)
+        predict = lambda: model.predict_tensor(inputs)
+
+    for _ in range(warmup):
+        predict()
+
+    # Start every worker together so they contend for the CPU as in serving
+    barrier.wait()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        predict()
+        latencies.append(time.perf_counter() - t0)
+    results.put((started, time.perf_counter(), latencies))
+
+def run_configuration(num_workers, threads, args):
+    """Run one workers x threads cell of the matrix"""
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(num_workers)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=run_worker, args=(i, num_workers, threads, args.pin, args.model_path, args.image,
+                                             args.iterations, args.warmup, barrier, results))
+        for i in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    runs = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    wall = max(end for _, end, _ in runs) - min(start for start, _, _ in runs)
+    latencies = [latency for _, _, run in runs for latency in run]
+    return {
+        'workers': num_workers,
+        'threads': threads,
+        'pinned': args.pin,
+        'images': len(latencies),
+        'throughput_ips': round(len(latencies) / wall, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+    }
+
+def main():
+    cores = len(available_cores())
+    parser = argparse.ArgumentParser(description='Benchmark inference throughput over workers x intra-op threads')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Worker process counts')
+    parser.add_argument('--threads', type=int, nargs='+', help='Intra-op thread counts (default: 1, 2, 4, ... up to cores)')
+    parser.add_argument('--iterations', type=int, default=50, help='Timed predictions per worker')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed predictions per worker')
+    parser.add_argument('--pin', action='store_true', help='Pin each worker to its own block of cores')
+    parser.add_argument('--image', help='Real image to run through predict() instead of a synthetic tensor')
+    parser.add_argument('--model-path', default=os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth')))
+    parser.add_argument('--output', help='Write the matrix to this JSON file')
+    args = parser.parse_args()
+
+    threads = args.threads or [t for t in (1, 2, 4, 8, 16, 32, 64) if t <= cores]
+
+    print(f"Benchmarking on {cores} cores: workers={args.workers} threads={threads} pinned={args.pin}")
+    rows = []
+    for num_workers in args.workers:
+        for num_threads in threads:
+            if num_workers * num_threads > cores * 2:
+                # Heavily oversubscribed cells only measure thrashing
+                continue
+            row = run_configuration(num_workers, num_threads, args)
+            rows.append(row)
+            print(f"  workers={row['workers']:<3} threads={row['threads']:<3} "
+                  f"{row['throughput_ips']:>8} img/s  p50={row['p50_ms']:>7} ms  p99={row['p99_ms']:>7} ms")
+
+    best = max(rows, key=lambda r: r['throughput_ips']) if rows else None
+    if best:
+        print(f"\nBest throughput: {best['workers']} worker(s) x {best['threads']} thread(s) "
+              f"= {best['throughput_ips']} img/s (p99 {best['p99_ms']} ms)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cores': cores, 'results': rows}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import os
+import csv
+import json
+import time
+import argparse
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+from model import PlantDiseaseModel, IMAGE_SIZE, build_inference_transform
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+CSV_FIELDS = ['path', 'disease', 'confidence', 'top_predictions', 'error']
+
+def iter_image_paths(input_path):
+    """Image paths under a directory (walked lazily) or listed one per line in a file"""
+    if os.path.isdir(input_path):
+        for root, dirs, files in os.walk(input_path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+    else:
+        with open(input_path) as f:
+            for line in f:
+                path = line.strip()
+                if path:
+                    yield path
+
+class ImageStream(IterableDataset):
+    """Decodes and preprocesses images in DataLoader workers, each taking every Nth path"""
+
+    def __init__(self, input_path, skip=None):
+        self.input_path = input_path
+        self.skip = skip or set()
+        self.transform = build_inference_transform()
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker else (0, 1)
+        for i, path in enumerate(iter_image_paths(self.input_path)):
+            if i % num_workers != worker_id or path in self.skip:
+                continue
+            try:
+                with Image.open(path) as img:
+                    tensor = self.transform(img.convert('RGB'))
+                yield tensor, path, ""
+            except Exception as e:
+                # Keep the batch shape; the row is reported as an error
+                yield torch.zeros(3, IMAGE_SIZE, IMAGE_SIZE), path, str(e) or type(e).__name__
+
+def _single_decode_thread(_):
+    torch.set_num_threads(1)
+
+def output_format(path, requested):
+    if requested:
+        return requested
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def load_scored(path, fmt):
+    """Paths already in the output file; drops a torn last line left by a crash"""
+    scored = set()
+    if not os.path.exists(path):
+        return scored
+
+    with open(path, 'rb+') as f:
+        data = f.read()
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            f.truncate(complete)
+
+    with open(path, newline='') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                scored.add(row['path'])
+        else:
+            for line in f:
+                try:
+                    scored.add(json.loads(line)['path'])
+                except (ValueError, KeyError):
+                    continue
+    return scored
+
+class ResultWriter:
+    """Appends result rows to CSV or JSONL and flushes after every batch"""
+
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='')
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == 'csv':
+                self.writer.writerow({**row, 'top_predictions': json.dumps(row.get('top_predictions', []))})
+            else:
+                self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a directory or file list of images offline with batched inference')
+    parser.add_argument('input', help='Image directory (searched recursively) or a text file with one path per line')
+    parser.add_argument('--output', required=True, help='Results file, .csv or .jsonl')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='Output format (default: from the extension)')
+    parser.add_argument('--model-path', default=os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth')))
+    parser.add_argument('--backend', choices=['eager', 'fused'])
+    parser.add_argument('--precision', choices=['fp32', 'bf16'])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2), help='Decode processes')
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='Batches each decode worker may hold; with the batch size this bounds memory')
+    parser.add_argument('--report-every', type=float, default=10.0, help='Seconds between progress lines')
+    args = parser.parse_args()
+
+    fmt = output_format(args.output, args.format)
+    scored = load_scored(args.output, fmt)
+    if scored:
+        print(f"Resuming: {len(scored)} image(s) already scored in {args.output}")
+
+    model = PlantDiseaseModel(model_path=args.model_path, backend=args.backend, precision=args.precision)
+    loader = DataLoader(ImageStream(args.input, skip=scored), batch_size=args.batch_size,
+                        num_workers=args.workers, prefetch_factor=args.prefetch if args.workers else None,
+                        worker_init_fn=_single_decode_thread)
+    writer = ResultWriter(args.output, fmt)
+
+    images = 0
+    errors = 0
+    started = time.perf_counter()
+    last_report = started
+    try:
+        for inputs, paths, decode_errors in loader:
+            logits = model.forward_logits(inputs)
+            rows = []
+            for row_logits, path, error in zip(logits, paths, decode_errors):
+                if error:
+                    rows.append({'path': path, 'error': error})
+                    errors += 1
+                else:
+                    rows.append({'path': path, **model.postprocess(row_logits)})
+            writer.write(rows)
+            images += len(rows)
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_every:
+                print(f"  {images} images, {images / (now - started):.1f} img/s, {errors} error(s)")
+                last_report = now
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Scored {images} image(s) in {elapsed:.1f} s ({images / elapsed if elapsed else 0:.1f} img/s), "
+          f"{errors} error(s); results in {args.output}")
+
+if __name__ == "__main__":
+    main()
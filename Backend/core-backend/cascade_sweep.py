@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os
+import time
+import json
+import argparse
+import torch
+from tqdm import tqdm
+from model import PlantDiseaseModel, CASCADE_FIRST_STAGE_PATH
+from model_optimization import count_flops
+from train_model import create_val_loader, BATCH_SIZE
+
+def run_stage(model, inputs):
+    """Top-1 confidence (percent), prediction and wall time of one stage on a batch"""
+    started = time.perf_counter()
+    probabilities = torch.softmax(model.forward_logits(inputs).cpu(), dim=1)
+    elapsed = time.perf_counter() - started
+    confidence, predicted = probabilities.max(dim=1)
+    return confidence * 100, predicted, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep the cascade confidence threshold against accuracy and compute')
+    parser.add_argument('--model-path', default=os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth')))
+    parser.add_argument('--first-stage-path', default=CASCADE_FIRST_STAGE_PATH or None, required=not CASCADE_FIRST_STAGE_PATH,
+                        help='Cheap first-stage checkpoint, e.g. a pruned model from prune_model.py')
+    parser.add_argument('--thresholds', type=float, nargs='+',
+                        default=[0, 50, 60, 70, 80, 85, 90, 95, 97.5, 99, 99.5, 100],
+                        help='Confidence thresholds (percent) below which images escalate')
+    parser.add_argument('--backend', default=None, choices=['eager', 'fused'], help='Inference backend for both stages')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--output', help='Write the sweep to this JSON file')
+    args = parser.parse_args()
+
+    first = PlantDiseaseModel(model_path=args.first_stage_path, backend=args.backend)
+    full = PlantDiseaseModel(model_path=args.model_path, backend=args.backend)
+    first_gflops = count_flops(first.model) / 1e9
+    full_gflops = count_flops(full.model) / 1e9
+
+    # Both stages run on every image once; each threshold is then evaluated offline
+    val_loader = create_val_loader(batch_size=args.batch_size)
+    labels_all, first_conf, first_pred, full_pred = [], [], [], []
+    first_time = 0.0
+    full_time = 0.0
+    for inputs, labels in tqdm(val_loader, desc="Scoring both stages"):
+        confidence, predicted, elapsed = run_stage(first, inputs)
+        first_conf.append(confidence)
+        first_pred.append(predicted)
+        first_time += elapsed
+        _, predicted, elapsed = run_stage(full, inputs)
+        full_pred.append(predicted)
+        full_time += elapsed
+        labels_all.append(labels)
+
+    labels_all = torch.cat(labels_all)
+    first_conf = torch.cat(first_conf)
+    first_pred = torch.cat(first_pred)
+    full_pred = torch.cat(full_pred)
+    total = labels_all.size(0)
+    first_ms = first_time / total * 1000
+    full_ms = full_time / total * 1000
+
+    rows = []
+    for threshold in sorted(args.thresholds):
+        escalated = first_conf < threshold
+        predicted = torch.where(escalated, full_pred, first_pred)
+        rate = escalated.float().mean().item()
+        rows.append({
+            'threshold': threshold,
+            'accuracy': (predicted == labels_all).float().mean().item(),
+            'escalation_rate': rate,
+            'mean_gflops': first_gflops + rate * full_gflops,
+            'mean_ms': first_ms + rate * full_ms,
+        })
+
+    full_accuracy = (full_pred == labels_all).float().mean().item()
+    print(f"\n=== Cascade threshold sweep ({total} validation images) ===")
+    print(f"First stage: {first_gflops:.2f} GFLOPs, {first_ms:.2f} ms/img, "
+          f"accuracy {(first_pred == labels_all).float().mean().item():.4f}")
+    print(f"Full model:  {full_gflops:.2f} GFLOPs, {full_ms:.2f} ms/img, accuracy {full_accuracy:.4f}")
+    print(f"\n{'threshold':>9} {'accuracy':>9} {'escalated':>10} {'GFLOPs/img':>11} {'ms/img':>8} {'vs full':>8}")
+    for row in rows:
+        print(f"{row['threshold']:>9} {row['accuracy']:>9.4f} {row['escalation_rate']:>9.1%} "
+              f"{row['mean_gflops']:>11.2f} {row['mean_ms']:>8.2f} {row['mean_gflops'] / full_gflops:>7.1%}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'images': total,
+                'first_stage': {'path': args.first_stage_path, 'gflops': first_gflops, 'ms_per_image': first_ms},
+                'full_model': {'path': args.model_path, 'gflops': full_gflops, 'ms_per_image': full_ms,
+                               'accuracy': full_accuracy},
+                'sweep': rows
+            }, f, indent=2)
+        print(f"\nSweep written to {args.output}")
+
+if __name__ == "__main__":
+    main()
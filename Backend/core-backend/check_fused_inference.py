@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+from collections import OrderedDict
+import torch
+from model import PlantDiseaseModel, IMAGE_SIZE
+from model_optimization import fold_batchnorm
+
+def load_inputs(image_dir, count, preprocess):
+    """Preprocessed real images from image_dir, or random tensors"""
+    if image_dir:
+        files = sorted(f for f in os.listdir(image_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))[:count]
+        inputs = [preprocess(os.path.join(image_dir, f)) for f in files]
+        return [t.cpu() for t in inputs if t is not None]
+    torch.manual_seed(0)
+    return [torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE) for _ in range(count)]
+
+def check_parity(eager, fused, inputs, atol):
+    """Compare logits, probabilities and top-k between the two paths"""
+    max_logit_diff = 0.0
+    max_prob_diff = 0.0
+    top1_agree = 0
+    top5_agree = 0
+
+    with torch.no_grad():
+        for x in inputs:
+            a = eager.inference_model(x.to(eager.device))
+            b = fused.inference_model(x.to(fused.device, memory_format=fused.memory_format)).float()
+            pa = torch.softmax(a, dim=1)
+            pb = torch.softmax(b, dim=1)
+            max_logit_diff = max(max_logit_diff, (a - b).abs().max().item())
+            max_prob_diff = max(max_prob_diff, (pa - pb).abs().max().item())
+            top1_agree += int(a.argmax(1).item() == b.argmax(1).item())
+            top5_agree += int(set(a.topk(5).indices[0].tolist()) == set(b.topk(5).indices[0].tolist()))
+
+    n = len(inputs)
+    print("\n=== Parity (eager vs fused) ===")
+    print(f"Inputs:                 {n}")
+    print(f"Max |logit diff|:       {max_logit_diff:.6f}")
+    print(f"Max |probability diff|: {max_prob_diff:.6f} (tolerance {atol})")
+    print(f"Top-1 agreement:        {top1_agree}/{n}")
+    print(f"Top-5 set agreement:    {top5_agree}/{n}")
+    return max_prob_diff <= atol and top1_agree == n
+
+def time_layers(module, x, iterations):
+    """Mean milliseconds per top-level child module, measured with forward hooks"""
+    timings = OrderedDict()
+    starts = {}
+    handles = []
+
+    for name, child in module.named_children():
+        def pre_hook(_, __, name=name):
+            starts[name] = time.perf_counter()
+
+        def post_hook(_, __, ___, name=name):
+            timings[name] = timings.get(name, 0.0) + (time.perf_counter() - starts[name])
+
+        handles.append(child.register_forward_pre_hook(pre_hook))
+        handles.append(child.register_forward_hook(post_hook))
+
+    with torch.no_grad():
+        module(x)  # warm-up, discarded
+        timings.clear()
+        for _ in range(iterations):
+            module(x)
+
+    for handle in handles:
+        handle.remove()
+    return OrderedDict((name, total / iterations * 1000) for name, total in timings.items())
+
+def time_forward(module, x, iterations):
+    """Mean end-to-end forward milliseconds"""
+    with torch.no_grad():
+        module(x)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            module(x)
+    return (time.perf_counter() - started) / iterations * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the fused CPU inference path against eager inference')
+    parser.add_argument('--model-path', default=os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth')))
+    parser.add_argument('--images', help='Directory of real images to compare on (default: random tensors)')
+    parser.add_argument('--count', type=int, default=32, help='Number of inputs for the parity check')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed forward passes per layer table')
+    parser.add_argument('--atol', type=float, default=1e-3, help='Maximum allowed probability difference')
+    args = parser.parse_args()
+
+    eager = PlantDiseaseModel(model_path=args.model_path, backend="eager")
+    fused = PlantDiseaseModel(model_path=args.model_path, backend="fused")
+    print(f"Fused path: {fused.optimization_info}")
+
+    inputs = load_inputs(args.images, args.count, eager.preprocess_image)
+    passed = check_parity(eager, fused, inputs, args.atol)
+
+    # Per-layer view: eager NCHW against BatchNorm-folded channels_last. The
+    # oneDNN-fused TorchScript graph has no module boundaries, so it only
+    # gets an end-to-end number
+    folded = PlantDiseaseModel(model_path=args.model_path, backend="eager").model
+    fold_batchnorm(folded)
+    folded = folded.to(memory_format=torch.channels_last)
+
+    x = inputs[0].to(eager.device)
+    x_cl = x.to(memory_format=torch.channels_last)
+    eager_layers = time_layers(eager.model, x, args.iterations)
+    folded_layers = time_layers(folded, x_cl, args.iterations)
+
+    print("\n=== Per-layer latency (ms) ===")
+    print(f"{'layer':<16} {'eager':>9} {'folded+CL':>10} {'speedup':>8}")
+    for name, eager_ms in eager_layers.items():
+        folded_ms = folded_layers.get(name)
+        if folded_ms is None:
+            continue
+        speedup = eager_ms / folded_ms if folded_ms else 0.0
+        print(f"{name:<16} {eager_ms:>9.3f} {folded_ms:>10.3f} {speedup:>7.2f}x")
+
+    eager_total = time_forward(eager.inference_model, x, args.iterations)
+    folded_total = time_forward(folded, x_cl, args.iterations)
+    fused_total = time_forward(fused.inference_model, x_cl, args.iterations)
+    print("\n=== End-to-end forward (ms) ===")
+    print(f"eager:                {eager_total:.3f}")
+    print(f"folded+channels_last: {folded_total:.3f} ({eager_total / folded_total:.2f}x)")
+    print(f"fused ({'oneDNN' if fused.optimization_info['onednn_fusion'] else 'no oneDNN'}): "
+          f"{fused_total:.3f} ({eager_total / fused_total:.2f}x)")
+
+    print(f"\nParity check {'PASSED' if passed else 'FAILED'}")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
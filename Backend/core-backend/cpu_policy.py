@@ -0,0 +1,112 @@
+import os
+import tempfile
+import logging
+import torch
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Explicit overrides; when unset the policy is derived from cores / workers
+INFERENCE_INTRA_OP_THREADS = os.getenv("INFERENCE_INTRA_OP_THREADS")
+INFERENCE_INTER_OP_THREADS = os.getenv("INFERENCE_INTER_OP_THREADS")
+# Number of processes sharing this box; gunicorn also reads WEB_CONCURRENCY
+INFERENCE_WORKER_COUNT = os.getenv("INFERENCE_WORKER_COUNT", os.getenv("WEB_CONCURRENCY", "1"))
+# Pin each worker to its own block of cores
+INFERENCE_PIN_CORES = os.getenv("INFERENCE_PIN_CORES", "false").lower() in ("1", "true", "yes")
+
+# Lock files that hold this process's worker slot for its lifetime
+_slot_locks = []
+# torch only accepts set_num_interop_threads once per process
+_interop_configured = False
+
+def available_cores():
+    """CPU ids this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def claim_worker_slot(num_workers):
+    """Claim a free worker index in [0, num_workers) using per-slot lock files.
+
+    gunicorn does not tell a worker its index, so each worker takes the
+    first slot whose lock is free and keeps it until the process exits.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return os.getpid() % num_workers
+
+    for index in range(num_workers):
+        path = os.path.join(tempfile.gettempdir(), f"plantg-cpu-slot-{index}.lock")
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            continue
+        _slot_locks.append(fd)
+        return index
+
+    # More processes than slots (e.g. during a graceful reload)
+    return os.getpid() % num_workers
+
+def get_thread_policy(num_workers=None, worker_index=None, intra_op_threads=None,
+                      inter_op_threads=None, pin_cores=None):
+    """Work out intra-op threads, inter-op threads and core pinning for one worker"""
+    cores = available_cores()
+    num_workers = max(1, int(num_workers or INFERENCE_WORKER_COUNT))
+
+    if intra_op_threads is None:
+        intra_op_threads = int(INFERENCE_INTRA_OP_THREADS) if INFERENCE_INTRA_OP_THREADS \
+            else max(1, len(cores) // num_workers)
+    if inter_op_threads is None:
+        inter_op_threads = int(INFERENCE_INTER_OP_THREADS) if INFERENCE_INTER_OP_THREADS else 1
+    if pin_cores is None:
+        pin_cores = INFERENCE_PIN_CORES
+
+    policy = {
+        "num_workers": num_workers,
+        "worker_index": worker_index,
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        "cores": None
+    }
+
+    if pin_cores:
+        if worker_index is None:
+            worker_index = claim_worker_slot(num_workers)
+        policy["worker_index"] = worker_index
+        # Give each worker a contiguous block, wrapping if oversubscribed
+        start = (worker_index * intra_op_threads) % len(cores)
+        policy["cores"] = [cores[(start + i) % len(cores)] for i in range(min(intra_op_threads, len(cores)))]
+
+    return policy
+
+def apply_thread_policy(policy):
+    """Apply a policy from get_thread_policy to torch and the OS scheduler"""
+    global _interop_configured
+
+    torch.set_num_threads(policy["intra_op_threads"])
+
+    if not _interop_configured:
+        try:
+            torch.set_num_interop_threads(policy["inter_op_threads"])
+        except RuntimeError as e:
+            # Raised once any inter-op work has already run in this process
+            logger.warning(f"Could not set inter-op threads: {e}")
+        _interop_configured = True
+
+    if policy["cores"] and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, policy["cores"])
+        except OSError as e:
+            logger.warning(f"Could not pin to cores {policy['cores']}: {e}")
+
+    logger.info(
+        f"Inference threads: intra-op={policy['intra_op_threads']} inter-op={policy['inter_op_threads']} "
+        f"worker={policy['worker_index']}/{policy['num_workers']} cores={policy['cores'] or 'all'}"
+    )
+    return policy
@@ -1,18 +1,30 @@
 import os
+import time
+import atexit
+import threading
 import pymongo
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 import bcrypt
 import datetime
 import json
+from collections import OrderedDict
 from bson import ObjectId
+from mongo_config import (MONGODB_URI, MONGODB_DB, MONGODB_HEALTH_TIMEOUT_MS, CommandLatencyListener,
+                          PoolMetricsListener, get_client_options, stats_key, stats_disease)
+from tracing import traced, current_request_id
+from uploads import remove_upload
 
 # Load environment variables
 load_dotenv()
 
-# MongoDB connection string and database name
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-MONGODB_DB = os.getenv("MONGODB_DB", "plantg")
+# Write-behind settings for analysis inserts (disabled by default)
+ANALYSIS_WRITE_BEHIND = os.getenv("ANALYSIS_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+ANALYSIS_BUFFER_SIZE = int(os.getenv("ANALYSIS_BUFFER_SIZE", "1000"))
+ANALYSIS_FLUSH_BATCH = int(os.getenv("ANALYSIS_FLUSH_BATCH", "100"))
+ANALYSIS_FLUSH_INTERVAL = float(os.getenv("ANALYSIS_FLUSH_INTERVAL", "1.0"))
+ANALYSIS_BUFFER_TIMEOUT = float(os.getenv("ANALYSIS_BUFFER_TIMEOUT", "30"))
 
 # Custom JSON encoder to handle MongoDB ObjectId and dates
 class MongoJSONEncoder(json.JSONEncoder):
@@ -23,18 +35,160 @@ class MongoJSONEncoder(json.JSONEncoder):
             return obj.isoformat()
         return super(MongoJSONEncoder, self).default(obj)
 
+class AnalysisWriteBuffer:
+    """Bounded write-behind buffer that batches analysis inserts on a background thread"""
+    
+    def __init__(self, database, max_size=ANALYSIS_BUFFER_SIZE, batch_size=ANALYSIS_FLUSH_BATCH,
+                 flush_interval=ANALYSIS_FLUSH_INTERVAL, add_timeout=ANALYSIS_BUFFER_TIMEOUT):
+        self.database = database
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.add_timeout = add_timeout
+        
+        # Documents stay in pending until insert_many has acknowledged them,
+        # so reads can be served from here while a batch is in flight
+        self.pending = OrderedDict()
+        self.cond = threading.Condition()
+        # Held for the whole of a flush so discard() never races an insert
+        self.flush_lock = threading.Lock()
+        self.closed = False
+        self.thread = None
+        self.pid = None
+    
+    def _ensure_thread(self):
+        """Start the flush thread, restarting it in a forked worker"""
+        if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name="analysis-write-behind", daemon=True)
+            self.thread.start()
+    
+    def add(self, document):
+        """Queue a document with a client-assigned _id, blocking up to add_timeout while full"""
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("Analysis write buffer is closed")
+            self._ensure_thread()
+            if len(self.pending) >= self.max_size:
+                self.cond.notify_all()
+                if not self.cond.wait_for(lambda: len(self.pending) < self.max_size, self.add_timeout):
+                    raise RuntimeError("Analysis write buffer is full")
+            self.pending[document["_id"]] = document
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify_all()
+    
+    def get(self, analysis_id, user_id=None):
+        """Return a not-yet-flushed document, or None"""
+        with self.cond:
+            document = self.pending.get(analysis_id)
+        if document is None or (user_id is not None and document["user_id"] != user_id):
+            return None
+        return document
+    
+    def discard(self, analysis_id, user_id):
+        """Drop a not-yet-flushed document, returning the removed document or None"""
+        with self.flush_lock:
+            with self.cond:
+                document = self.pending.get(analysis_id)
+                if document is None or document["user_id"] != user_id:
+                    return None
+                del self.pending[analysis_id]
+                self.cond.notify_all()
+                return document
+    
+    def _run(self):
+        """Flush loop: wake on interval, full batch or shutdown"""
+        retry = False
+        while True:
+            with self.cond:
+                # After a failed flush, back off for an interval rather than
+                # spinning on a full buffer
+                if not self.closed and (retry or len(self.pending) < self.batch_size):
+                    self.cond.wait(self.flush_interval)
+                closed = self.closed
+            retry = not self.flush()
+            if closed:
+                return
+    
+    def flush(self):
+        """Insert everything currently pending in batches; False if some inserts failed"""
+        with self.flush_lock:
+            while True:
+                with self.cond:
+                    batch = list(self.pending.values())[:self.batch_size]
+                if not batch:
+                    return True
+                
+                inserted = self._insert_batch(batch)
+                
+                with self.cond:
+                    for document in inserted:
+                        self.pending.pop(document["_id"], None)
+                    self.cond.notify_all()
+                
+                if len(inserted) < len(batch):
+                    # Leave the failures pending and retry on the next interval
+                    return False
+    
+    def _insert_batch(self, batch):
+        """insert_many a batch and return the documents that are now stored"""
+        failed = set()
+        try:
+            self.database.get_analyses_collection().insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                # A duplicate key means an earlier attempt already stored it
+                if error.get("code") != 11000:
+                    failed.add(error["index"])
+            print(f"Error flushing analyses: {len(failed)} of {len(batch)} failed")
+        except Exception as e:
+            print(f"Error flushing analyses: {e}")
+            return []
+        
+        inserted = [document for i, document in enumerate(batch) if i not in failed]
+        if inserted:
+            try:
+                self.database._bulk_update_user_stats(inserted)
+            except Exception as e:
+                print(f"Error updating user statistics: {e}")
+        return inserted
+    
+    def close(self, timeout=None):
+        """Stop accepting writes and flush what is left"""
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            self.thread.join(timeout)
+        if self.pending:
+            self.flush()
+
 class Database:
     def __init__(self):
         self.client = None
         self.db = None
+        self.client_options = {}
+        self.write_buffer = None
         self.connect()
+        
+        if ANALYSIS_WRITE_BEHIND:
+            self.write_buffer = AnalysisWriteBuffer(self)
+            # Flush buffered analyses when the worker exits normally
+            atexit.register(self.write_buffer.close)
     
     def connect(self):
         """Connect to MongoDB"""
         try:
             # Only create a new connection if one doesn't exist
             if self.client is None:
-                self.client = MongoClient(MONGODB_URI)
+                self.client_options = get_client_options()
+                self.client = MongoClient(
+                    MONGODB_URI,
+                    event_listeners=[CommandLatencyListener(), PoolMetricsListener()],
+                    **self.client_options
+                )
                 self.db = self.client[MONGODB_DB]
                 print(f"Connected to database: {self.db.name}")
                 
@@ -42,12 +196,33 @@ class Database:
                 self.db.users.create_index([("email", pymongo.ASCENDING)], unique=True)
                 self.db.analyses.create_index([("user_id", pymongo.ASCENDING)])
                 self.db.analyses.create_index([("created_at", pymongo.DESCENDING)])
+                self.db.user_stats.create_index([("user_id", pymongo.ASCENDING)], unique=True)
             
             return True
         except Exception as e:
             print(f"Error connecting to MongoDB: {e}")
             return False
     
+    def health(self):
+        """Ping the server and report the effective pool configuration"""
+        status = {
+            "connected": False,
+            "max_pool_size": self.client.options.pool_options.max_pool_size if self.client else None,
+            "read_preference": self.client.read_preference.mongos_mode if self.client else None,
+        }
+        if self.client is None:
+            return status
+        
+        try:
+            started = time.perf_counter()
+            with pymongo.timeout(MONGODB_HEALTH_TIMEOUT_MS / 1000):
+                self.client.admin.command("ping")
+            status["connected"] = True
+            status["ping_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        except Exception as e:
+            status["error"] = str(e)
+        return status
+    
     def get_user_collection(self):
         """Get users collection"""
         return self.db.users
@@ -56,7 +231,43 @@ class Database:
         """Get analyses collection"""
         return self.db.analyses
     
+    def get_user_stats_collection(self):
+        """Get per-user statistics collection"""
+        return self.db.user_stats
+    
+    def get_upload_collection(self):
+        """Get stored-upload reference count collection"""
+        return self.db.uploads
+    
+    # Stored upload operations. An upload's reference is taken by the request
+    # that stored it and then either handed to the analysis saved from it or
+    # released when the request ends
+    def acquire_upload(self, image_id):
+        """Add a reference to a stored upload"""
+        self.get_upload_collection().update_one(
+            {"_id": image_id},
+            {"$inc": {"refs": 1}, "$setOnInsert": {"created_at": datetime.datetime.utcnow()}},
+            upsert=True
+        )
+    
+    def release_upload(self, image_id):
+        """Drop a reference to a stored upload, deleting the file when none are left"""
+        uploads = self.get_upload_collection()
+        record = uploads.find_one_and_update(
+            {"_id": image_id},
+            {"$inc": {"refs": -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        # No record: an upload stored before content addressing, left alone
+        if record is None or record["refs"] > 0:
+            return False
+        return remove_upload(
+            image_id,
+            lambda: uploads.delete_one({"_id": image_id, "refs": {"$lte": 0}}).deleted_count == 1
+        )
+    
     # User operations
+    @traced('db.register_user')
     def register_user(self, name, email, password):
         """Register a new user"""
         users = self.get_user_collection()
@@ -90,6 +301,7 @@ class Database:
         
         return user_data, None
     
+    @traced('db.login_user')
     def login_user(self, email, password):
         """Log in a user"""
         users = self.get_user_collection()
@@ -112,6 +324,7 @@ class Database:
         else:
             return None, "Invalid password"
     
+    @traced('db.get_user_by_id')
     def get_user_by_id(self, user_id):
         """Get user by ID"""
         users = self.get_user_collection()
@@ -132,6 +345,7 @@ class Database:
             return None
     
     # Analysis operations
+    @traced('db.save_analysis')
     def save_analysis(self, user_id, image_id, disease, confidence, top_predictions, symptoms, treatments, description):
         """Save analysis result"""
         analyses = self.get_analyses_collection()
@@ -145,13 +359,24 @@ class Database:
             "symptoms": symptoms,
             "treatments": treatments,
             "description": description,
+            # Links the stored analysis back to the request's logs and trace
+            "request_id": current_request_id(),
             "created_at": datetime.datetime.utcnow()
         }
         
+        if self.write_buffer is not None:
+            # Assign the ObjectId here so the caller gets it back immediately;
+            # the insert and the statistics update happen on flush
+            analysis["_id"] = ObjectId()
+            self.write_buffer.add(analysis)
+            return analysis
+        
         result = analyses.insert_one(analysis)
         analysis["_id"] = result.inserted_id
+        self._update_user_stats(analysis["user_id"], disease, 1)
         return analysis
     
+    @traced('db.get_user_analyses')
     def get_user_analyses(self, user_id, limit=10, skip=0):
         """Get analyses for a user"""
         analyses = self.get_analyses_collection()
@@ -162,6 +387,7 @@ class Database:
         
         return list(cursor)
     
+    @traced('db.get_analysis_by_id')
     def get_analysis_by_id(self, analysis_id, user_id=None):
         """Get analysis by ID, optionally filtered by user_id for security"""
         analyses = self.get_analyses_collection()
@@ -169,43 +395,89 @@ class Database:
         
         if user_id:
             query["user_id"] = ObjectId(user_id)
+        
+        if self.write_buffer is not None:
+            pending = self.write_buffer.get(query["_id"], query.get("user_id"))
+            if pending is not None:
+                return pending
             
         return analyses.find_one(query)
     
+    @traced('db.delete_analysis')
     def delete_analysis(self, analysis_id, user_id):
         """Delete analysis by ID (only if it belongs to the user)"""
         analyses = self.get_analyses_collection()
-        result = analyses.delete_one({
+        
+        # A buffered analysis has not reached the collection or the
+        # statistics yet, so dropping it from the buffer is enough
+        if self.write_buffer is not None:
+            discarded = self.write_buffer.discard(ObjectId(analysis_id), ObjectId(user_id))
+            if discarded is not None:
+                self.release_upload(discarded["image_id"])
+                return True
+        
+        # find_one_and_delete hands back the removed document so the
+        # per-disease counter can be decremented and the upload released
+        # without a second read
+        deleted = analyses.find_one_and_delete({
             "_id": ObjectId(analysis_id),
             "user_id": ObjectId(user_id)
-        })
-        return result.deleted_count > 0
+        }, projection={"disease": 1, "image_id": 1})
+        if deleted is None:
+            return False
+        
+        self._update_user_stats(ObjectId(user_id), deleted.get("disease"), -1)
+        if deleted.get("image_id"):
+            self.release_upload(deleted["image_id"])
+        return True
+    
+    # Statistics operations
+    def _update_user_stats(self, user_id, disease, delta):
+        """Atomically adjust a user's running totals by delta"""
+        self.get_user_stats_collection().update_one(
+            {"user_id": user_id},
+            {
+                "$inc": {
+                    "total_analyses": delta,
+                    f"disease_counts.{stats_key(disease)}": delta
+                },
+                "$set": {"updated_at": datetime.datetime.utcnow()}
+            },
+            upsert=True
+        )
+    
+    def _bulk_update_user_stats(self, analyses):
+        """Apply the statistics for a batch of new analyses, one $inc per user"""
+        increments = {}
+        for analysis in analyses:
+            inc = increments.setdefault(analysis["user_id"], {"total_analyses": 0})
+            inc["total_analyses"] += 1
+            key = f"disease_counts.{stats_key(analysis['disease'])}"
+            inc[key] = inc.get(key, 0) + 1
+        
+        now = datetime.datetime.utcnow()
+        operations = [
+            UpdateOne({"user_id": user_id}, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True)
+            for user_id, inc in increments.items()
+        ]
+        self.get_user_stats_collection().bulk_write(operations, ordered=False)
     
+    @traced('db.get_statistics')
     def get_statistics(self, user_id):
         """Get statistics for a user"""
-        analyses = self.get_analyses_collection()
+        stats = self.get_user_stats_collection().find_one({"user_id": ObjectId(user_id)})
         
-        # Total number of analyses
-        total_analyses = analyses.count_documents({"user_id": ObjectId(user_id)})
+        total_analyses = 0
+        unique_diseases = 0
+        most_common_disease = None
         
-        # Get unique diseases detected
-        pipeline = [
-            {"$match": {"user_id": ObjectId(user_id)}},
-            {"$group": {"_id": "$disease"}},
-            {"$count": "count"}
-        ]
-        unique_diseases_result = list(analyses.aggregate(pipeline))
-        unique_diseases = unique_diseases_result[0]["count"] if unique_diseases_result else 0
-        
-        # Get most common disease
-        pipeline = [
-            {"$match": {"user_id": ObjectId(user_id)}},
-            {"$group": {"_id": "$disease", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 1}
-        ]
-        most_common_result = list(analyses.aggregate(pipeline))
-        most_common_disease = most_common_result[0]["_id"] if most_common_result else None
+        if stats:
+            total_analyses = stats.get("total_analyses", 0)
+            # Counters decremented back to zero stay in the map, so skip them
+            counts = {stats_disease(k): v for k, v in stats.get("disease_counts", {}).items() if v > 0}
+            unique_diseases = len(counts)
+            if counts:
+                most_common_disease = max(counts, key=counts.get)
         
         return {
             "total_analyses": total_analyses,
@@ -218,6 +490,8 @@ class Database:
         # In a Flask application, it's better not to close the connection
         # after each request. Only close when shutting down the application.
         # This method is kept for compatibility but should rarely be used.
+        if self.write_buffer is not None:
+            self.write_buffer.close()
         if self.client:
             print("Warning: Closing MongoDB connection. This should only happen during application shutdown.")
             self.client.close()
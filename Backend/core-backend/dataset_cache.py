@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision.datasets import ImageFolder
+from tqdm import tqdm
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Directory holding <split>.u8 image arrays and <split>.index.npz indexes
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", "./dataset_cache")
+
+def cache_paths(cache_dir, split):
+    """Data and index file paths of one cached split"""
+    return os.path.join(cache_dir, f"{split}.u8"), os.path.join(cache_dir, f"{split}.index.npz")
+
+def cache_exists(cache_dir, split):
+    """Whether a complete cache of the split exists (the index is written last)"""
+    return all(os.path.exists(path) for path in cache_paths(cache_dir, split))
+
+def _decode_resized(job):
+    """Decode one image and resize it to an (size, size, 3) uint8 array"""
+    path, size = job
+    with Image.open(path) as img:
+        # Same bilinear resize as transforms.Resize((size, size))
+        img = img.convert('RGB').resize((size, size), Image.BILINEAR)
+        return np.asarray(img, dtype=np.uint8)
+
+def build_cache(image_dir, cache_dir, split, size=299, workers=4):
+    """Decode and resize an ImageFolder split into a packed uint8 memory-mapped file.
+
+    Images are stored back to back as (size, size, 3) HWC arrays; the index
+    records each image's byte offset and label plus the class names, in
+    ImageFolder order so labels match the uncached loaders.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path, index_path = cache_paths(cache_dir, split)
+    folder = ImageFolder(image_dir)
+    samples = folder.samples
+    image_bytes = size * size * 3
+
+    data = np.memmap(data_path, dtype=np.uint8, mode='w+', shape=(max(1, len(samples)), size, size, 3))
+    with Pool(workers) as pool:
+        jobs = ((path, size) for path, _ in samples)
+        for i, array in enumerate(tqdm(pool.imap(_decode_resized, jobs, chunksize=32),
+                                       total=len(samples), desc=f"Caching {split}")):
+            data[i] = array
+    data.flush()
+    del data
+
+    # Write the index last and atomically, so a half-built cache is never used
+    tmp_path = index_path + ".tmp.npz"
+    np.savez(tmp_path,
+             labels=np.array([label for _, label in samples], dtype=np.int64),
+             offsets=np.arange(len(samples), dtype=np.int64) * image_bytes,
+             classes=np.array(folder.classes),
+             image_size=np.array(size))
+    os.replace(tmp_path, index_path)
+    print(f"Cached {len(samples)} {split} images ({len(samples) * image_bytes / 1e9:.2f} GB) to {data_path}")
+
+class CachedImageDataset(Dataset):
+    """Dataset over a packed uint8 cache built by build_cache.
+
+    Items are uint8 (3, H, W) tensors that view the memory-mapped file
+    without copying, so transforms must work on tensors (no PIL steps).
+    The file is opened lazily so each DataLoader worker maps it itself.
+    """
+
+    def __init__(self, cache_dir, split, transform=None):
+        self.data_path, index_path = cache_paths(cache_dir, split)
+        index = np.load(index_path)
+        self.targets = index["labels"].tolist()
+        self.offsets = index["offsets"]
+        self.classes = index["classes"].tolist()
+        self.class_to_idx = {name: idx for idx, name in enumerate(self.classes)}
+        self.image_size = int(index["image_size"])
+        self.transform = transform
+        self._data = None
+
+    def __len__(self):
+        return len(self.targets)
+
+    def _array(self):
+        if self._data is None:
+            # Copy-on-write mapping: slices are writable views, the file is never modified
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode='c')
+        return self._data
+
+    def __getitem__(self, idx):
+        start = int(self.offsets[idx])
+        size = self.image_size
+        array = self._array()[start:start + size * size * 3].reshape(size, size, 3)
+        image = torch.from_numpy(array).permute(2, 0, 1)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, self.targets[idx]
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-decode and resize the dataset into a memory-mapped cache')
+    parser.add_argument('--dataset', default=os.getenv("KAGGLE_DATASET_PATH", "./plant_disease_dataset"),
+                        help='Dataset root containing train/ and val/')
+    parser.add_argument('--output', default=DATASET_CACHE_DIR, help='Cache directory')
+    parser.add_argument('--splits', nargs='+', default=['train', 'val'])
+    parser.add_argument('--size', type=int, default=299, help='Side length of the cached images')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Decode processes')
+    args = parser.parse_args()
+
+    for split in args.splits:
+        build_cache(os.path.join(args.dataset, split), args.output, split, size=args.size, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
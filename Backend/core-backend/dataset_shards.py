@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import os
+import io
+import json
+import random
+import tarfile
+import argparse
+import logging
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision.datasets import ImageFolder
+from tqdm import tqdm
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Directory holding <split>-NNNNN.tar shards and <split>.json indexes
+DATASET_SHARD_DIR = os.getenv("DATASET_SHARD_DIR", "./dataset_shards")
+
+def shard_index_path(shard_dir, split):
+    return os.path.join(shard_dir, f"{split}.json")
+
+def shards_exist(shard_dir, split):
+    """Whether a complete shard set exists (the index is written last)"""
+    return os.path.exists(shard_index_path(shard_dir, split))
+
+def write_shards(image_dir, shard_dir, split, shard_size_mb=256, seed=0):
+    """Pack an ImageFolder split into sequential tar shards.
+
+    Each sample is stored as <key>.jpg (the original encoded bytes, not
+    re-encoded) followed by <key>.cls (the label). Samples are shuffled
+    once before packing so every shard mixes classes.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    folder = ImageFolder(image_dir)
+    samples = list(folder.samples)
+    random.Random(seed).shuffle(samples)
+
+    shards = []
+    tar = None
+    shard_bytes = 0
+    limit = shard_size_mb * 1024 * 1024
+
+    def close_shard():
+        if tar is not None:
+            tar.close()
+
+    for i, (path, label) in enumerate(tqdm(samples, desc=f"Sharding {split}")):
+        if tar is None or shard_bytes >= limit:
+            close_shard()
+            name = f"{split}-{len(shards):05d}.tar"
+            tar = tarfile.open(os.path.join(shard_dir, name), "w")
+            shards.append({"name": name, "count": 0})
+            shard_bytes = 0
+
+        with open(path, "rb") as f:
+            data = f.read()
+        key = f"{i:08d}"
+        ext = os.path.splitext(path)[1].lower().lstrip(".") or "jpg"
+        for member_name, payload in ((f"{key}.{ext}", data), (f"{key}.cls", str(label).encode())):
+            info = tarfile.TarInfo(member_name)
+            info.size = len(payload)
+            tar.addfile(info, io.BytesIO(payload))
+        shards[-1]["count"] += 1
+        shard_bytes += len(data) + 1024  # tar headers
+    close_shard()
+
+    with open(shard_index_path(shard_dir, split), "w") as f:
+        json.dump({"classes": folder.classes, "total": len(samples), "shards": shards}, f, indent=2)
+    print(f"Packed {len(samples)} {split} images into {len(shards)} shard(s) in {shard_dir}")
+
+def iter_shard(path):
+    """Yield (encoded image bytes, label) pairs from one tar shard, reading it sequentially"""
+    image = None
+    with tarfile.open(path, "r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            payload = tar.extractfile(member).read()
+            if member.name.endswith(".cls"):
+                if image is not None:
+                    yield image, int(payload)
+                image = None
+            else:
+                image = payload
+
+class ShardedImageDataset(IterableDataset):
+    """Streaming dataset over tar shards written by write_shards.
+
+    Shards are shuffled per epoch and split across DataLoader workers, then
+    samples pass through a shuffle buffer. Use with shuffle=False on the
+    DataLoader and call set_epoch() each epoch for a new order.
+    """
+
+    def __init__(self, shard_dir, split, transform=None, shuffle=False, buffer_size=1000, seed=0):
+        with open(shard_index_path(shard_dir, split)) as f:
+            index = json.load(f)
+        self.shard_paths = [os.path.join(shard_dir, shard["name"]) for shard in index["shards"]]
+        self.classes = index["classes"]
+        self.class_to_idx = {name: idx for idx, name in enumerate(self.classes)}
+        self.total = index["total"]
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return self.total
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _worker_shards(self):
+        shards = list(self.shard_paths)
+        if self.shuffle:
+            # Same seed in every worker, so the split below is a partition
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        worker = get_worker_info()
+        if worker is None:
+            return shards, random.Random(self.seed + self.epoch)
+        if worker.num_workers > len(shards):
+            logger.warning(f"{worker.num_workers} loader workers but only {len(shards)} shards; some workers stay idle")
+        return shards[worker.id::worker.num_workers], random.Random(self.seed + self.epoch * 1000 + worker.id)
+
+    def _decode(self, data, label):
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, label
+
+    def __iter__(self):
+        shards, rng = self._worker_shards()
+        buffer = []
+        for path in shards:
+            for data, label in iter_shard(path):
+                if not self.shuffle:
+                    yield self._decode(data, label)
+                    continue
+                # Buffer encoded bytes, not decoded images, to keep the buffer small
+                if len(buffer) < self.buffer_size:
+                    buffer.append((data, label))
+                    continue
+                slot = rng.randrange(len(buffer))
+                buffer[slot], (data, label) = (data, label), buffer[slot]
+                yield self._decode(data, label)
+        rng.shuffle(buffer)
+        for data, label in buffer:
+            yield self._decode(data, label)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack the dataset into sequential tar shards')
+    parser.add_argument('--dataset', default=os.getenv("KAGGLE_DATASET_PATH", "./plant_disease_dataset"),
+                        help='Dataset root containing train/ and val/')
+    parser.add_argument('--output', default=DATASET_SHARD_DIR, help='Shard directory')
+    parser.add_argument('--splits', nargs='+', default=['train', 'val'])
+    parser.add_argument('--shard-size-mb', type=int, default=256, help='Target size of each shard')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the packing order')
+    args = parser.parse_args()
+
+    for split in args.splits:
+        write_shards(os.path.join(args.dataset, split), args.output, split,
+                     shard_size_mb=args.shard_size_mb, seed=args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+def get_disease_info(disease_name):
+    """Get additional information about the disease"""
+    # This would ideally come from a database
+    # For now, we're providing sample data for a few diseases
+    disease_info = {
+        "Apple___Apple_scab": {
+            "description": "Apple scab is a fungal disease caused by Venturia inaequalis that affects apple trees, causing dark, scabby lesions on leaves and fruit.",
+            "symptoms": [
+                "Dark, olive-green spots on leaves",
+                "Dark, scab-like lesions on fruit",
+                "Severely infected leaves may turn yellow and drop early",
+                "Misshapen fruit if infected when young"
+            ],
+            "treatments": [
+                "Remove and destroy fallen leaves and infected fruit",
+                "Prune trees to improve air circulation",
+                "Apply fungicides early in the growing season",
+                "Plant scab-resistant apple varieties",
+                "Apply protective fungicide before rainy periods"
+            ]
+        },
+        "Tomato___Late_blight": {
+            "description": "Late blight is a devastating disease caused by the fungus-like oomycete pathogen Phytophthora infestans. It can rapidly destroy tomato plants, especially in cool, wet conditions.",
+            "symptoms": [
+                "Dark, water-soaked spots on leaves",
+                "White, fuzzy growth on the undersides of leaves",
+                "Brown lesions on stems",
+                "Firm, dark, greasy-looking spots on fruits"
+            ],
+            "treatments": [
+                "Remove and destroy affected plant parts",
+                "Apply copper-based fungicide as a preventative measure",
+                "Ensure good air circulation around plants",
+                "Water at the base of plants, avoiding wet foliage",
+                "Rotate crops yearly"
+            ]
+        },
+        "Tomato___Early_blight": {
+            "description": "Early blight is a common fungal disease caused by Alternaria solani. It typically affects older leaves first and can spread to stems and fruit.",
+            "symptoms": [
+                "Brown to black spots with concentric rings",
+                "Yellowing around the spots",
+                "Spots may merge, causing leaves to die",
+                "Dark lesions on stems",
+                "Dark, sunken spots on fruit"
+            ],
+            "treatments": [
+                "Remove infected leaves promptly",
+                "Apply fungicides labeled for early blight",
+                "Mulch around plants to prevent spores from splashing",
+                "Rotate crops every 3-4 years",
+                "Ensure adequate plant spacing for airflow"
+            ]
+        }
+    }
+    
+    # Return default info if the specific disease info is not available
+    if disease_name not in disease_info:
+        return {
+            "description": "Information about this plant disease is being updated.",
+            "symptoms": [],
+            "treatments": ["Consult a local agricultural extension service for specific treatment options."]
+        }
+    
+    return disease_info[disease_name]
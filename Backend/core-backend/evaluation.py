@@ -0,0 +1,46 @@
+import torch
+
+class ConfusionMatrix:
+    """Streaming classification metrics accumulated on-tensor, batch by batch.
+
+    Holds a (classes x classes) count matrix plus top-k hits, so memory stays
+    O(classes^2) regardless of dataset size and nothing syncs to Python per
+    batch. Rows are true classes, columns predictions.
+    """
+
+    def __init__(self, num_classes, device=None, top_k=5):
+        self.num_classes = num_classes
+        self.top_k = min(top_k, num_classes)
+        self.matrix = torch.zeros(num_classes, num_classes, dtype=torch.long, device=device)
+        self.top_k_correct = torch.zeros((), dtype=torch.long, device=device)
+
+    def update(self, logits, labels):
+        """Add a batch of (N, classes) logits and (N,) labels"""
+        logits = logits.detach()
+        predictions = logits.argmax(dim=1)
+        # Each (true, predicted) pair becomes one flat bin of the matrix
+        bins = labels * self.num_classes + predictions
+        self.matrix += torch.bincount(bins, minlength=self.num_classes ** 2).view(self.num_classes, self.num_classes)
+        top_k = logits.topk(self.top_k, dim=1).indices
+        self.top_k_correct += (top_k == labels[:, None]).any(dim=1).sum()
+
+    def compute(self):
+        """Accuracy, top-k accuracy and per-class precision / recall from the matrix"""
+        matrix = self.matrix.double()
+        total = matrix.sum()
+        true_positives = matrix.diag()
+        predicted = matrix.sum(dim=0)
+        support = matrix.sum(dim=1)
+        # Classes never predicted (or absent) get 0 instead of NaN
+        precision = torch.where(predicted > 0, true_positives / predicted.clamp(min=1), torch.zeros_like(predicted))
+        recall = torch.where(support > 0, true_positives / support.clamp(min=1), torch.zeros_like(support))
+        total_count = max(1, int(total.item()))
+        return {
+            'accuracy': true_positives.sum().item() / total_count,
+            'top_k': self.top_k,
+            'top_k_accuracy': self.top_k_correct.item() / total_count,
+            'precision': precision.cpu().tolist(),
+            'recall': recall.cpu().tolist(),
+            'support': support.long().cpu().tolist(),
+            'confusion_matrix': self.matrix.cpu().tolist()
+        }
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+from model import PlantDiseaseModel
+from train_model import create_dataset, device, BATCH_SIZE
+
+FEATURE_DIM = 2048  # Inception V3 pooled features
+
+def feature_paths(cache_dir, split):
+    return (os.path.join(cache_dir, f"{split}.features.f32"),
+            os.path.join(cache_dir, f"{split}.labels.npy"),
+            os.path.join(cache_dir, f"{split}.json"))
+
+def backbone_fingerprint(model_path):
+    """Identifies the backbone weights, so features from other weights are not reused"""
+    stat = os.stat(model_path)
+    return {'model_path': os.path.abspath(model_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def extract_features(backbone, split, cache_dir, fingerprint, batch_size, workers, refresh=False):
+    """Run the frozen backbone once over a split into a memory-mapped (N, 2048) float32 array"""
+    data_path, labels_path, meta_path = feature_paths(cache_dir, split)
+    if not refresh and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['backbone'] == fingerprint:
+            print(f"Reusing cached {split} features from {data_path}")
+            return meta['classes']
+
+    # Deterministic transforms for both splits: the features are computed once
+    dataset = create_dataset(split)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=workers)
+    features = np.memmap(data_path, dtype=np.float32, mode='w+', shape=(max(1, len(dataset)), FEATURE_DIM))
+    labels = np.zeros(len(dataset), dtype=np.int64)
+
+    offset = 0
+    with torch.no_grad():
+        for inputs, targets in tqdm(loader, desc=f"Extracting {split} features"):
+            batch = backbone(inputs.to(device)).cpu().numpy()
+            features[offset:offset + len(batch)] = batch
+            labels[offset:offset + len(batch)] = targets.numpy()
+            offset += len(batch)
+    features.flush()
+    del features
+    np.save(labels_path, labels[:offset])
+
+    # Metadata last: its presence marks a complete cache
+    with open(meta_path, 'w') as f:
+        json.dump({'backbone': fingerprint, 'count': offset, 'classes': list(dataset.classes)}, f)
+    return list(dataset.classes)
+
+def load_features(cache_dir, split):
+    """Zero-copy tensors over the cached features and their labels"""
+    data_path, labels_path, _ = feature_paths(cache_dir, split)
+    labels = torch.from_numpy(np.load(labels_path))
+    features = np.memmap(data_path, dtype=np.float32, mode='c', shape=(max(1, len(labels)), FEATURE_DIM))
+    return torch.from_numpy(features[:len(labels)]), labels
+
+def evaluate_head(head, features, labels, batch_size=4096):
+    head.eval()
+    correct = 0
+    with torch.no_grad():
+        for start in range(0, len(labels), batch_size):
+            logits = head(features[start:start + batch_size])
+            correct += (logits.argmax(dim=1) == labels[start:start + batch_size]).sum().item()
+    return correct / max(1, len(labels))
+
+def train_head(train_x, train_y, val_x, val_y, num_classes, args):
+    """Train only the linear classifier on cached features; returns the best head and its accuracy"""
+    torch.manual_seed(args.seed)
+    head = nn.Linear(FEATURE_DIM, num_classes)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.AdamW(head.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+
+    best_accuracy, best_state = -1.0, None
+    for epoch in range(args.epochs):
+        head.train()
+        order = torch.randperm(len(train_y))
+        total_loss = 0.0
+        for start in range(0, len(order), args.batch_size):
+            idx = order[start:start + args.batch_size]
+            optimizer.zero_grad()
+            loss = criterion(head(train_x[idx]), train_y[idx])
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(idx)
+        scheduler.step()
+
+        accuracy = evaluate_head(head, val_x, val_y)
+        if accuracy > best_accuracy:
+            best_accuracy = accuracy
+            best_state = {k: v.clone() for k, v in head.state_dict().items()}
+        if (epoch + 1) % 10 == 0 or epoch == args.epochs - 1:
+            print(f"Epoch {epoch+1}/{args.epochs}: loss {total_loss / len(train_y):.4f}, val accuracy {accuracy:.4f}")
+
+    head.load_state_dict(best_state)
+    return head, best_accuracy
+
+def main():
+    parser = argparse.ArgumentParser(description='Fine-tune only the classifier head on cached frozen-backbone features')
+    parser.add_argument('--model-path', default=os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth')),
+                        help='Checkpoint providing the frozen backbone')
+    parser.add_argument('--output', default=os.path.join('models', 'inception_v3_finetuned_head.pth'))
+    parser.add_argument('--cache-dir', default=os.getenv("FEATURE_CACHE_DIR", "./feature_cache"))
+    parser.add_argument('--refresh', action='store_true', help='Re-extract features even if the cache matches')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--weight-decay', type=float, default=1e-4)
+    parser.add_argument('--batch-size', type=int, default=256, help='Head training batch size')
+    parser.add_argument('--extract-batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=4, help='DataLoader workers for feature extraction')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model_path):
+        parser.error(f"Backbone checkpoint not found: {args.model_path}")
+    os.makedirs(args.cache_dir, exist_ok=True)
+
+    base = PlantDiseaseModel(model_path=args.model_path, backend='eager', precision='fp32')
+    model = base.model
+    # Frozen backbone: everything up to the pooled 2048-d features
+    original_head = model.fc
+    model.fc = nn.Identity()
+    model.eval()
+
+    fingerprint = backbone_fingerprint(args.model_path)
+    started = time.perf_counter()
+    classes = extract_features(model, 'train', args.cache_dir, fingerprint, args.extract_batch_size,
+                               args.workers, args.refresh)
+    val_classes = extract_features(model, 'val', args.cache_dir, fingerprint, args.extract_batch_size,
+                                   args.workers, args.refresh)
+    if val_classes != classes:
+        parser.error("train and val splits have different classes")
+    print(f"Features ready in {time.perf_counter() - started:.1f} s")
+
+    train_x, train_y = load_features(args.cache_dir, 'train')
+    val_x, val_y = load_features(args.cache_dir, 'val')
+    started = time.perf_counter()
+    head, accuracy = train_head(train_x, train_y, val_x, val_y, len(classes), args)
+    print(f"Head trained in {time.perf_counter() - started:.1f} s, best val accuracy {accuracy:.4f}")
+
+    # Reattach the head; the checkpoint loads straight into PlantDiseaseModel
+    model.fc = head.to(original_head.weight.device)
+    checkpoint = {
+        'model_state_dict': model.state_dict(),
+        'class_labels': {idx: name for idx, name in enumerate(classes)},
+        'accuracy': accuracy
+    }
+    source = torch.load(args.model_path, map_location='cpu', mmap=True)
+    if isinstance(source, dict) and source.get('channel_config'):
+        checkpoint['channel_config'] = source['channel_config']
+    torch.save(checkpoint, args.output)
+    print(f"Model saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import glob
+
+# gunicorn loads this file automatically when started from this directory
+
+def on_starting(server):
+    """Clear samples left in PROMETHEUS_MULTIPROC_DIR by a previous run"""
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+
+def child_exit(server, worker):
+    """Stop counting a dead worker's live gauges"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Imported here rather than via metrics.py so the master does not
+        # create metric files of its own
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,227 @@
+import os
+import time
+import atexit
+import queue
+import itertools
+import threading
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import torch
+import torch.multiprocessing as mp
+from PIL import Image
+from dotenv import load_dotenv
+from model import load_model, checkpoint_class_labels, IMAGE_SIZE, build_inference_transform
+from cpu_policy import get_thread_policy
+from metrics import current_endpoint, stage_timer
+from tracing import start_trace, current_trace, merge_spans, current_request_id, traced
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Number of model-holding worker processes; 0 keeps inference in the web process
+INFERENCE_PROCESSES = int(os.getenv("INFERENCE_PROCESSES", "0"))
+# Intra-op threads per worker process
+INFERENCE_PROCESS_THREADS = int(os.getenv("INFERENCE_PROCESS_THREADS", "1"))
+# Shared-memory input slots, i.e. the maximum number of queued jobs
+INFERENCE_QUEUE_SLOTS = int(os.getenv("INFERENCE_QUEUE_SLOTS", str(max(1, INFERENCE_PROCESSES) * 4)))
+# Seconds a request waits for a result before giving up
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "60"))
+# Seconds between checks for crashed worker processes
+WORKER_CHECK_INTERVAL = 1.0
+# Marks a worker with no job in its `running` entry
+IDLE = -1
+
+def _worker_main(worker_id, num_workers, model_path, num_threads, slots, jobs, results, running):
+    """Worker process: load the model once, then serve jobs from the queue"""
+    policy = get_thread_policy(num_workers=num_workers, worker_index=worker_id, intra_op_threads=num_threads)
+    model = load_model(model_path=model_path, thread_policy=policy)
+    logger.info(f"Inference worker {worker_id} ready with {num_threads} thread(s)")
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, slot, endpoint, request_id = job
+        # Lets the parent fail this job at once if the process dies on it
+        running[worker_id] = job_id
+        # Label this job's metrics and spans with the request it came from
+        current_endpoint.set(endpoint)
+        trace = start_trace(request_id)
+        try:
+            # The slot is a view into shared memory, so no pixel data was pickled
+            result = model.predict_tensor(slots[slot:slot + 1])
+        except Exception as e:
+            result = {"error": f"Inference error: {str(e)}"}
+        current_trace.set(None)
+        results.put((job_id, result, trace.spans))
+        running[worker_id] = IDLE
+
+class InferenceService:
+    """Pool of model-holding worker processes fed through shared-memory input slots.
+
+    Exposes the same predict(image_path) and class_labels interface as
+    PlantDiseaseModel, so the web handlers can use either.
+    """
+
+    def __init__(self, model_path=None, num_workers=INFERENCE_PROCESSES,
+                 threads_per_worker=INFERENCE_PROCESS_THREADS, num_slots=INFERENCE_QUEUE_SLOTS,
+                 timeout=INFERENCE_TIMEOUT):
+        self.model_path = model_path
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = threads_per_worker
+        self.num_slots = max(num_slots, self.num_workers)
+        self.timeout = timeout
+        self.class_labels = checkpoint_class_labels(model_path)
+        self.transform = build_inference_transform()
+
+        self.lock = threading.Lock()
+        self.started_pid = None
+        self.workers = []
+        self.pending = {}
+        self.job_ids = itertools.count()
+
+    def start(self):
+        """Start the worker processes; called lazily so it runs after a gunicorn fork"""
+        with self.lock:
+            if self.started_pid == os.getpid():
+                return
+
+            # spawn rather than fork: the children must not inherit the web
+            # worker's threads, sockets or OpenMP state
+            ctx = mp.get_context("spawn")
+            self.slots = torch.empty((self.num_slots, 3, IMAGE_SIZE, IMAGE_SIZE)).share_memory_()
+            self.free_slots = queue.Queue()
+            for slot in range(self.num_slots):
+                self.free_slots.put(slot)
+            self.jobs = ctx.Queue()
+            self.results = ctx.Queue()
+            # The job each worker is running, written by the worker itself
+            self.running = ctx.Array('q', [IDLE] * self.num_workers, lock=False)
+
+            self.workers = []
+            for worker_id in range(self.num_workers):
+                self.workers.append(self._spawn_worker(ctx, worker_id))
+            self.ctx = ctx
+
+            self.collector = threading.Thread(target=self._collect, name="inference-results", daemon=True)
+            self.collector.start()
+            self.started_pid = os.getpid()
+            atexit.register(self.close)
+            logger.info(f"Started {self.num_workers} inference worker(s), {self.num_slots} input slot(s)")
+
+    def _spawn_worker(self, ctx, worker_id):
+        process = ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.num_workers, self.model_path, self.threads_per_worker,
+                  self.slots, self.jobs, self.results, self.running),
+            name=f"inference-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        return process
+
+    def _collect(self):
+        """Resolve futures as results arrive and replace dead workers"""
+        next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+        while True:
+            try:
+                job_id, result, spans = self.results.get(timeout=WORKER_CHECK_INTERVAL)
+                self._resolve(job_id, result, spans)
+            except queue.Empty:
+                pass
+            except (EOFError, OSError):
+                return
+
+            # On a timer rather than only when the queue is idle, so a crash
+            # is noticed while the other workers keep results flowing
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+
+    def _resolve(self, job_id, result, spans=()):
+        with self.lock:
+            job = self.pending.pop(job_id, None)
+        # A missing job timed out (or its worker died) and already released its slot
+        if job is not None:
+            future, slot = job
+            self.free_slots.put(slot)
+            future.spans = list(spans)
+            future.set_result(result)
+
+    def _check_workers(self):
+        if self.started_pid != os.getpid():
+            return
+        for worker_id, process in enumerate(self.workers):
+            if not process.is_alive() and process.exitcode is not None:
+                logger.error(f"Inference worker {worker_id} exited with code {process.exitcode}, restarting")
+                job_id = self.running[worker_id]
+                self.running[worker_id] = IDLE
+                if job_id != IDLE:
+                    # Fail the job it held now instead of after the full timeout
+                    self._resolve(job_id, {"error": f"Inference error: worker exited with code {process.exitcode}"})
+                self.workers[worker_id] = self._spawn_worker(self.ctx, worker_id)
+
+    def submit(self, image_path):
+        """Preprocess an image into a free slot and queue it; returns a Future"""
+        self.start()
+        future = Future()
+
+        try:
+            with stage_timer('preprocess'):
+                img = Image.open(image_path).convert('RGB')
+                img_tensor = self.transform(img)
+        except Exception as e:
+            logger.error(f"Error preprocessing image (request {current_request_id()}): {e}")
+            future.set_result({"error": "Failed to process image"})
+            return future
+
+        try:
+            slot = self.free_slots.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("No free inference slot")
+
+        self.slots[slot].copy_(img_tensor)
+        job_id = next(self.job_ids)
+        with self.lock:
+            self.pending[job_id] = (future, slot)
+        future.queued = time.perf_counter()
+        self.jobs.put((job_id, slot, current_endpoint.get(), current_request_id()))
+        future.job_id = job_id
+        return future
+
+    @traced('model.predict')
+    def predict(self, image_path):
+        """Predict plant disease from image, blocking until a worker answers"""
+        future = self.submit(image_path)
+        try:
+            result = future.result(timeout=self.timeout)
+            # Worker-side spans are timed from the worker's own clock; place
+            # them at the moment the job was queued
+            merge_spans(getattr(future, 'spans', []), getattr(future, 'queued', time.perf_counter()))
+            return result
+        except FutureTimeoutError:
+            with self.lock:
+                job = self.pending.pop(future.job_id, None)
+            if job is not None:
+                self.free_slots.put(job[1])
+            raise TimeoutError(f"Inference did not finish within {self.timeout}s")
+
+    def close(self):
+        """Stop the worker processes"""
+        if self.started_pid != os.getpid():
+            return
+        # Cleared first, so the collector does not restart workers as they exit
+        self.started_pid = None
+        for _ in self.workers:
+            self.jobs.put(None)
+        for process in self.workers:
+            process.join(timeout=5)
+
+def create_predictor(model_path):
+    """Return an InferenceService when worker processes are configured, else an in-process model"""
+    if INFERENCE_PROCESSES > 0:
+        return InferenceService(model_path=model_path)
+    return load_model(model_path=model_path)
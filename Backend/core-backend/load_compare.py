@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import io
+import time
+import json
+import asyncio
+import argparse
+import aiohttp
+from PIL import Image
+
+def create_test_image():
+    """Create a JPEG test image in memory"""
+    img = Image.new('RGB', (640, 480), color=(73, 109, 137))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+async def send_request(session, base_url, endpoint, image_bytes, token):
+    """Send one request and return (ok, latency_seconds)"""
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    started = time.perf_counter()
+    try:
+        if endpoint in ('/api/detect', '/api/user/detect'):
+            form = aiohttp.FormData()
+            form.add_field('file', image_bytes, filename='load_test.jpg', content_type='image/jpeg')
+            async with session.post(base_url + endpoint, data=form, headers=headers) as response:
+                await response.read()
+                ok = response.status == 200
+        else:
+            async with session.get(base_url + endpoint, headers=headers) as response:
+                await response.read()
+                ok = response.status == 200
+    except Exception:
+        ok = False
+    return ok, time.perf_counter() - started
+
+async def run_load(base_url, endpoint, total_requests, concurrency, image_bytes, token):
+    """Fire total_requests at base_url with at most concurrency in flight"""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker():
+            nonlocal errors
+            async with semaphore:
+                ok, latency = await send_request(session, base_url, endpoint, image_bytes, token)
+                latencies.append(latency)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(total_requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'url': base_url,
+        'endpoint': endpoint,
+        'requests': total_requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(total_requests / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+    }
+
+def print_comparison(results):
+    """Print a side-by-side table of the runs"""
+    header = f"{'server':<8} {'concurrency':>11} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results:
+        print(f"{name:<8} {result['concurrency']:>11} {result['throughput_rps']:>9} {result['p50_ms']:>9} "
+              f"{result['p95_ms']:>9} {result['p99_ms']:>9} {result['errors']:>7}")
+
+async def main():
+    parser = argparse.ArgumentParser(description='Compare the Flask and ASGI servers under concurrent load')
+    parser.add_argument('--flask-url', default='http://localhost:5001', help='Base URL of the Flask app')
+    parser.add_argument('--asgi-url', default='http://localhost:5002', help='Base URL of the ASGI app')
+    parser.add_argument('--endpoint', default='/api/detect',
+                        help='Endpoint to load (/api/detect, /api/user/detect, /api/user/analyses, ...)')
+    parser.add_argument('--token', help='JWT for authenticated endpoints')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200],
+                        help='Concurrency levels to test')
+    parser.add_argument('--output', help='Write the raw results to this JSON file')
+    args = parser.parse_args()
+
+    image_bytes = create_test_image()
+    results = []
+    for concurrency in args.concurrency:
+        for name, url in (('flask', args.flask_url), ('asgi', args.asgi_url)):
+            print(f"Loading {name} at {url}{args.endpoint} with concurrency {concurrency}...")
+            result = await run_load(url, args.endpoint, args.requests, concurrency, image_bytes, args.token)
+            results.append((name, result))
+
+    print()
+    print_comparison(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump([dict(result, server=name) for name, result in results], f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import aiohttp
+from PIL import Image
+
+# Endpoint names usable in --mix, with (method, path, needs_token)
+ENDPOINTS = {
+    'detect': ('POST', '/api/detect', False),
+    'user_detect': ('POST', '/api/user/detect', True),
+    'analyses': ('GET', '/api/user/analyses', True),
+    'logs': ('POST', '/api/logs', False),
+}
+DEFAULT_MIX = 'detect=3,user_detect=3,analyses=3,logs=1'
+
+class InMemoryElasticsearch:
+    """Offline stand-in for the Elasticsearch client used by logger.py"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.documents = 0
+        self.lock = threading.Lock()
+
+    def index(self, index, document, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.documents += 1
+        return {'result': 'created', '_index': index}
+
+class StubPredictor:
+    """Fixed-latency model stand-in, for load-testing the web tier without inference cost"""
+
+    def __init__(self, class_labels, latency):
+        self.class_labels = class_labels
+        self.latency = latency
+
+    def predict(self, image_path):
+        time.sleep(self.latency)
+        disease = self.class_labels[0]
+        return {'disease': disease, 'confidence': 99.0,
+                'top_predictions': [{'disease': disease, 'confidence': 99.0}]}
+
+def parse_mix(spec):
+    """'detect=3,logs=1' -> {'detect': 3.0, 'logs': 1.0}"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def create_test_image():
+    """A leaf-sized JPEG in memory"""
+    img = Image.new('RGB', (256, 256), color=(73, 109, 137))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_app(args):
+    """Import the Flask app against the stand-ins and serve it on a local port"""
+    os.environ['MONGODB_DB'] = args.mongo_db
+    # Uploads go to a throwaway store; set before uploads.py is imported
+    upload_dir = tempfile.mkdtemp(prefix='plantg_load_test_')
+    os.environ['UPLOAD_FOLDER'] = upload_dir
+    if args.mongo_uri:
+        # A throwaway local mongod, e.g. `mongod --dbpath /tmp/loadtest`
+        os.environ['MONGODB_URI'] = args.mongo_uri
+    else:
+        import mongomock
+        import pymongo
+        # database.py imports MongoClient from pymongo, so patch it before that import
+        pymongo.MongoClient = mongomock.MongoClient
+    if args.stub_model:
+        # Keep inference in-process so no worker pool is left behind when the stub replaces it
+        os.environ['INFERENCE_PROCESSES'] = '0'
+
+    import logger
+    es = InMemoryElasticsearch(latency=args.es_latency_ms / 1000)
+    logger.es_client = es
+
+    import app as web
+    from database import db
+    from tokens import generate_token
+
+    if args.stub_model:
+        web.model = StubPredictor(web.model.class_labels, args.model_latency_ms / 1000)
+
+    # One user with some history, so the authenticated endpoints have work to do
+    email = f"load-test-{int(time.time())}@example.com"
+    user, error = db.register_user('Load Test', email, 'load-test-password')
+    if error:
+        raise RuntimeError(error)
+    for i in range(args.seed_analyses):
+        db.save_analysis(user['_id'], f"seed-{i}.jpg", web.model.class_labels[0], 95.0, [], [], [], '')
+    token = generate_token(user['_id'], user['email'], user['name'], user['role'])
+
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', args.port or free_port(), web.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='load-test-server', daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}", token, es, upload_dir
+
+async def send_request(session, base_url, name, image_bytes, token):
+    """Send one request of the given endpoint type; returns (ok, latency_seconds)"""
+    method, path, needs_token = ENDPOINTS[name]
+    headers = {'Authorization': f'Bearer {token}'} if needs_token else {}
+    started = time.perf_counter()
+    try:
+        if name in ('detect', 'user_detect'):
+            form = aiohttp.FormData()
+            form.add_field('file', image_bytes, filename='load_test.jpg', content_type='image/jpeg')
+            request = session.post(base_url + path, data=form, headers=headers)
+        elif name == 'logs':
+            payload = {'level': 'info', 'message': 'load test event', 'userId': 'load-test',
+                       'context': {'endpoint': '/dashboard', 'method': 'GET', 'status': 200}}
+            request = session.post(base_url + path, json=payload, headers=headers)
+        else:
+            request = session.get(base_url + path, params={'limit': 10}, headers=headers)
+        async with request as response:
+            await response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return ok, time.perf_counter() - started
+
+async def run_load(base_url, token, mix, args):
+    """Closed-loop load: concurrency workers each pick endpoints by weight until the deadline"""
+    image_bytes = create_test_image()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    stats = {name: {'latencies': [], 'errors': 0} for name in names}
+    rng = random.Random(args.seed)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        # Warm-up requests are not recorded
+        for name in names:
+            await send_request(session, base_url, name, image_bytes, token)
+
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                ok, latency = await send_request(session, base_url, name, image_bytes, token)
+                stats[name]['latencies'].append(latency)
+                if not ok:
+                    stats[name]['errors'] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    rows = []
+    for name in names:
+        latencies = stats[name]['latencies']
+        count = len(latencies)
+        rows.append({
+            'endpoint': ENDPOINTS[name][1],
+            'method': ENDPOINTS[name][0],
+            'requests': count,
+            'throughput_rps': round(count / elapsed, 2),
+            'error_rate': round(stats[name]['errors'] / count, 4) if count else 0.0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        })
+    return elapsed, rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline HTTP load test of the Flask app with stand-in Mongo and Elasticsearch')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Weighted endpoint mix (default: {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of measured load')
+    parser.add_argument('--request-timeout', type=float, default=120.0)
+    parser.add_argument('--mongo-uri', help='Local mongod to use instead of the in-process mongomock stand-in')
+    parser.add_argument('--mongo-db', default='plantg_load_test')
+    parser.add_argument('--es-latency-ms', type=float, default=0.0, help='Simulated Elasticsearch indexing latency')
+    parser.add_argument('--stub-model', action='store_true', help='Replace inference with a fixed-latency stub')
+    parser.add_argument('--model-latency-ms', type=float, default=50.0, help='Stub model latency')
+    parser.add_argument('--seed-analyses', type=int, default=50, help='Analyses stored for the test user up front')
+    parser.add_argument('--port', type=int, help='Port for the app (default: any free port)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the report to this JSON file')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server, base_url, token, es, upload_dir = start_app(args)
+    print(f"App serving on {base_url} ({'local mongod' if args.mongo_uri else 'mongomock'}, "
+          f"in-memory Elasticsearch, {'stub' if args.stub_model else 'real'} model)")
+    try:
+        print(f"Running {args.duration:.0f}s at concurrency {args.concurrency}, mix {args.mix}")
+        elapsed, rows = asyncio.run(run_load(base_url, token, mix, args))
+    finally:
+        server.shutdown()
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    total = sum(row['requests'] for row in rows)
+    print(f"\n{'endpoint':<22} {'requests':>8} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for row in rows:
+        print(f"{row['method'] + ' ' + row['endpoint']:<22} {row['requests']:>8} {row['throughput_rps']:>8} "
+              f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8} {row['error_rate']:>7.1%}")
+    print(f"\nTotal: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} rps), "
+          f"{es.documents} log events indexed")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'concurrency': args.concurrency, 'duration_s': round(elapsed, 2), 'mix': mix,
+                       'stub_model': args.stub_model, 'endpoints': rows}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    return 0 if all(row['error_rate'] == 0 for row in rows) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
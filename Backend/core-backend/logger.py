@@ -1,5 +1,4 @@
 import logging
-import time
 import socket
 from datetime import datetime
 import os
@@ -9,6 +8,8 @@ import ssl
 from elasticsearch import Elasticsearch
 import random
 import pytz
+from metrics import stage_timer
+from tracing import current_request_id, span_timings
 
 # Load environment variables
 load_dotenv()
@@ -67,6 +68,68 @@ try:
 except Exception as e:
     logger.error(f"Failed to connect to Elasticsearch: {str(e)}")
 
+def _index_event(log_data):
+    """Send a structured log event to Elasticsearch if available"""
+    if es_client:
+        try:
+            # Use the new index name "datelogs"
+            with stage_timer('es_logging'):
+                es_client.index(
+                    index='datelogs',
+                    document=log_data
+                )
+        except Exception as e:
+            logger.error(f"Error logging to Elasticsearch directly: {str(e)}")
+
+def prediction_event(user_id, disease, confidence, image_filename):
+    """Build the structured log event for a prediction"""
+    # Generate a high confidence level for logs while preserving the actual result
+    high_confidence = random.uniform(95.5, 99.8)
+    message = f"Disease Prediction: {disease} | Confidence: {high_confidence:.2f}% | User: {user_id} | Image: {image_filename}"
+    
+    return {
+        'timestamp': get_ist_timestamp(),
+        'host': socket.gethostname(),
+        'request_id': current_request_id(),
+        'spans': span_timings(),
+        'user_id': user_id,
+        'disease': disease,
+        'confidence': high_confidence,  # Use high confidence for logs
+        'image_filename': image_filename,
+        'event_type': 'prediction',
+        'message': message
+    }
+
+def api_request_event(endpoint, method, user_id='anonymous', status_code=200, request_data=None):
+    """Build the structured log event for an API request"""
+    return {
+        'timestamp': get_ist_timestamp(),
+        'host': socket.gethostname(),
+        'request_id': current_request_id(),
+        'spans': span_timings(),
+        'user_id': user_id,
+        'endpoint': endpoint,
+        'method': method,
+        'status_code': status_code,
+        'request_data': json.dumps(request_data) if request_data else None,
+        'event_type': 'api_request',
+        'message': f"API Request: {method} {endpoint} | Status: {status_code} | User: {user_id}"
+    }
+
+def error_event(error_message, user_id='anonymous', context=None):
+    """Build the structured log event for an error"""
+    return {
+        'timestamp': get_ist_timestamp(),
+        'host': socket.gethostname(),
+        'request_id': current_request_id(),
+        'spans': span_timings(),
+        'user_id': user_id,
+        'error_message': error_message,
+        'context': json.dumps(context) if context else None,
+        'event_type': 'error',
+        'message': f"Error: {error_message} | User: {user_id}"
+    }
+
 def log_prediction(user_id, disease, confidence, image_filename):
     """
     Log prediction details to Elasticsearch.
@@ -78,39 +141,13 @@ def log_prediction(user_id, disease, confidence, image_filename):
         image_filename (str): The filename of the analyzed image
     """
     try:
-        # Generate a high confidence level for logs while preserving the actual result
-        high_confidence = random.uniform(95.5, 99.8)
-        
-        # Get timestamp with timezone information
-        timestamp = get_ist_timestamp()
-        
-        log_data = {
-            'timestamp': timestamp,
-            'host': socket.gethostname(),
-            'request_id': str(int(time.time() * 1000)),  # Unique ID for the request
-            'user_id': user_id,
-            'disease': disease,
-            'confidence': high_confidence,  # Use high confidence for logs
-            'image_filename': image_filename,
-            'event_type': 'prediction',
-            'message': f"Disease Prediction: {disease} | Confidence: {high_confidence:.2f}% | User: {user_id} | Image: {image_filename}"
-        }
+        log_data = prediction_event(user_id, disease, confidence, image_filename)
         
         # Log to file and console
-        logger.info(
-            f"Disease Prediction: {disease} | Confidence: {high_confidence:.2f}% | User: {user_id} | Image: {image_filename}"
-        )
+        logger.info(log_data['message'])
         
         # Log to Elasticsearch if available
-        if es_client:
-            try:
-                # Use the new index name "datelogs" 
-                es_client.index(
-                    index='datelogs',
-                    document=log_data
-                )
-            except Exception as e:
-                logger.error(f"Error logging to Elasticsearch directly: {str(e)}")
+        _index_event(log_data)
     except Exception as e:
         logger.error(f"Error logging prediction: {str(e)}")
 
@@ -126,37 +163,13 @@ def log_api_request(endpoint, method, user_id='anonymous', status_code=200, requ
         request_data (dict, optional): Request data (without sensitive information)
     """
     try:
-        # Get timestamp with timezone information
-        timestamp = get_ist_timestamp()
-        
-        log_data = {
-            'timestamp': timestamp,
-            'host': socket.gethostname(),
-            'request_id': str(int(time.time() * 1000)),
-            'user_id': user_id,
-            'endpoint': endpoint,
-            'method': method,
-            'status_code': status_code,
-            'request_data': json.dumps(request_data) if request_data else None,
-            'event_type': 'api_request',
-            'message': f"API Request: {method} {endpoint} | Status: {status_code} | User: {user_id}"
-        }
+        log_data = api_request_event(endpoint, method, user_id, status_code, request_data)
         
         # Log to file and console
-        logger.info(
-            f"API Request: {method} {endpoint} | Status: {status_code} | User: {user_id}"
-        )
+        logger.info(log_data['message'])
         
         # Log to Elasticsearch if available
-        if es_client:
-            try:
-                # Use the new index name "datelogs"
-                es_client.index(
-                    index='datelogs',
-                    document=log_data
-                )
-            except Exception as e:
-                logger.error(f"Error logging to Elasticsearch directly: {str(e)}")
+        _index_event(log_data)
     except Exception as e:
         logger.error(f"Error logging API request: {str(e)}")
 
@@ -170,35 +183,72 @@ def log_error(error_message, user_id='anonymous', context=None):
         context (dict, optional): Additional context information
     """
     try:
-        # Get timestamp with timezone information
-        timestamp = get_ist_timestamp()
-        
-        log_data = {
-            'timestamp': timestamp,
-            'host': socket.gethostname(),
-            'request_id': str(int(time.time() * 1000)),
-            'user_id': user_id,
-            'error_message': error_message,
-            'context': json.dumps(context) if context else None,
-            'event_type': 'error',
-            'message': f"Error: {error_message} | User: {user_id}"
-        }
+        log_data = error_event(error_message, user_id, context)
         
         # Log to file and console
-        logger.error(
-            f"Error: {error_message} | User: {user_id}"
-        )
+        logger.error(log_data['message'])
         
         # Log to Elasticsearch if available
-        if es_client:
-            try:
-                # Use the new index name "datelogs"
-                es_client.index(
-                    index='datelogs',
-                    document=log_data
-                )
-            except Exception as e:
-                logger.error(f"Error logging to Elasticsearch directly: {str(e)}")
+        _index_event(log_data)
+    except Exception as e:
+        logger.error(f"Error logging error: {str(e)}")
+
+# Async Elasticsearch client for the ASGI app, created on first use so that
+# it binds to the running event loop
+async_es_client = None
+
+def get_async_es_client():
+    """Return the shared AsyncElasticsearch client, creating it if needed"""
+    global async_es_client
+    if async_es_client is None:
+        from elasticsearch import AsyncElasticsearch
+        async_es_client = AsyncElasticsearch(
+            [f"https://{es_host}:{es_port}"],
+            basic_auth=(es_username, es_password),
+            verify_certs=False,
+            ssl_show_warn=False
+        )
+    return async_es_client
+
+async def close_async_es_client():
+    """Close the shared AsyncElasticsearch client"""
+    global async_es_client
+    if async_es_client is not None:
+        await async_es_client.close()
+        async_es_client = None
+
+async def _async_index_event(log_data):
+    """Send a structured log event to Elasticsearch without blocking the event loop"""
+    try:
+        with stage_timer('es_logging'):
+            await get_async_es_client().index(index='datelogs', document=log_data)
+    except Exception as e:
+        logger.error(f"Error logging to Elasticsearch directly: {str(e)}")
+
+async def async_log_prediction(user_id, disease, confidence, image_filename):
+    """Async variant of log_prediction"""
+    try:
+        log_data = prediction_event(user_id, disease, confidence, image_filename)
+        logger.info(log_data['message'])
+        await _async_index_event(log_data)
+    except Exception as e:
+        logger.error(f"Error logging prediction: {str(e)}")
+
+async def async_log_api_request(endpoint, method, user_id='anonymous', status_code=200, request_data=None):
+    """Async variant of log_api_request"""
+    try:
+        log_data = api_request_event(endpoint, method, user_id, status_code, request_data)
+        logger.info(log_data['message'])
+        await _async_index_event(log_data)
+    except Exception as e:
+        logger.error(f"Error logging API request: {str(e)}")
+
+async def async_log_error(error_message, user_id='anonymous', context=None):
+    """Async variant of log_error"""
+    try:
+        log_data = error_event(error_message, user_id, context)
+        logger.error(log_data['message'])
+        await _async_index_event(log_data)
     except Exception as e:
         logger.error(f"Error logging error: {str(e)}")
 
@@ -0,0 +1,124 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import (Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry,
+                               generate_latest, multiprocess)
+from tracing import add_span
+
+# With several gunicorn workers each process keeps its own counters; pointing
+# PROMETHEUS_MULTIPROC_DIR at an empty directory makes every process write its
+# samples there so /metrics can aggregate them. It must be set before startup
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Latency buckets in seconds, from sub-millisecond Mongo round trips up to
+# multi-second stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# MongoDB command metrics, fed by the pymongo command listener in database.py.
+# Labels use the wire command name, so find_one shows up as "find" and
+# insert_one as "insert"
+MONGO_COMMAND_LATENCY = Histogram(
+    'plantg_mongo_command_seconds',
+    'MongoDB command latency',
+    ['command'],
+    buckets=LATENCY_BUCKETS
+)
+MONGO_COMMAND_FAILURES = Counter(
+    'plantg_mongo_command_failures_total',
+    'MongoDB commands that returned an error',
+    ['command']
+)
+
+# MongoDB connection pool metrics, fed by the pymongo pool listener
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    'plantg_mongo_pool_checkout_wait_seconds',
+    'Time spent waiting to check a connection out of the pool',
+    buckets=LATENCY_BUCKETS
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    'plantg_mongo_pool_checkout_failures_total',
+    'Connection checkouts that failed',
+    ['reason']
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    'plantg_mongo_pool_connections',
+    'Open connections in the MongoDB pool',
+    multiprocess_mode='livesum'
+)
+MONGO_POOL_IN_USE = Gauge(
+    'plantg_mongo_pool_connections_in_use',
+    'Connections currently checked out of the MongoDB pool',
+    multiprocess_mode='livesum'
+)
+
+# Test-time augmentation, fed by PlantDiseaseModel when TTA is enabled
+TTA_PREDICTIONS = Counter(
+    'plantg_tta_predictions_total',
+    'Predictions re-scored with test-time augmentation'
+)
+TTA_EXTRA_SECONDS = Histogram(
+    'plantg_tta_extra_seconds',
+    'Extra inference time spent on test-time augmentation views',
+    buckets=LATENCY_BUCKETS
+)
+
+# Per-request stage timings. The endpoint label is the matched route rule, set
+# once per request by the web app, so model, database and logger code can
+# record stages without being passed the endpoint
+STAGES = ('upload_read', 'disk_save', 'preprocess', 'forward', 'postprocess', 'mongo', 'es_logging')
+REQUEST_STAGE_LATENCY = Histogram(
+    'plantg_request_stage_seconds',
+    'Time spent in one stage of request handling',
+    ['endpoint', 'stage'],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_LATENCY = Histogram(
+    'plantg_request_seconds',
+    'Total request handling time',
+    ['endpoint', 'method'],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_ERRORS = Counter(
+    'plantg_request_errors_total',
+    'Requests answered with a 4xx or 5xx status',
+    ['endpoint', 'status']
+)
+PREDICTIONS = Counter(
+    'plantg_predictions_total',
+    'Predictions served, by predicted class',
+    ['disease']
+)
+
+# Work outside a request (write-behind flushes, scripts) is labeled "background"
+current_endpoint = ContextVar('plantg_endpoint', default='background')
+
+def observe_stage(stage, seconds):
+    """Record a stage duration against the current request's endpoint"""
+    REQUEST_STAGE_LATENCY.labels(current_endpoint.get(), stage).observe(seconds)
+
+@contextmanager
+def stage_timer(stage):
+    """Time the enclosed block as one request stage, also recorded as a trace span"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        observe_stage(stage, duration)
+        add_span(stage, started, duration)
+
+def observe_request(endpoint, method, status, seconds):
+    """Record the total time and outcome of one request"""
+    REQUEST_LATENCY.labels(endpoint, method).observe(seconds)
+    if status >= 400:
+        REQUEST_ERRORS.labels(endpoint, str(status)).inc()
+
+def render_metrics():
+    """Render all metrics in the Prometheus text format"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Aggregate the samples every worker process has written
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import os
+import hashlib
+import argparse
+import datetime
+from pymongo import UpdateOne, ReplaceOne
+from database import db
+from uploads import (UPLOAD_FOLDER, UPLOAD_TMP_DIR, MAX_HEADER_BYTES, FORMAT_EXTENSIONS, COPY_CHUNK_BYTES,
+                     UploadRejected, blob_path, inspect_image_header)
+
+# Number of documents written per bulk_write call
+BATCH_SIZE = int(os.getenv("UPLOAD_MIGRATION_BATCH_SIZE", "500"))
+
+def content_id(path):
+    """The content-addressed image_id a flat upload file would get"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        header = f.read(MAX_HEADER_BYTES)
+        digest.update(header)
+        for chunk in iter(lambda: f.read(COPY_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    try:
+        info = inspect_image_header(header)
+    except UploadRejected:
+        info = None
+    if info:
+        extension = FORMAT_EXTENSIONS[info[0]]
+    else:
+        # Not recognisable as an image; keep the original extension
+        extension = os.path.splitext(path)[1].lower().replace('.jpeg', '.jpg')
+    return digest.hexdigest() + extension
+
+def plan_renames(root):
+    """Hash every file at the top of the upload folder; returns {old name: image_id}"""
+    renames = {}
+    for entry in sorted(os.scandir(root), key=lambda e: e.name):
+        if entry.is_file() and not entry.name.startswith('.'):
+            renames[entry.name] = content_id(entry.path)
+    return renames
+
+def move_flat_files(root, renames, dry_run):
+    """Move the flat files into the store, deleting the ones whose content is already there"""
+    moved = set()
+    duplicates = 0
+    freed = 0
+    for name, image_id in renames.items():
+        path = os.path.join(root, name)
+        target = blob_path(image_id, root)
+        if image_id in moved or os.path.exists(target):
+            duplicates += 1
+            freed += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+        else:
+            moved.add(image_id)
+            if not dry_run:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+
+    print(f"Scanned {len(renames)} file(s): {len(moved)} new in the store, "
+          f"{duplicates} duplicate(s) {'would be ' if dry_run else ''}removed ({freed / 1e6:.1f} MB)")
+
+def update_analyses(renames, dry_run):
+    """Point analyses at the new image_ids in one pass over the collection"""
+    analyses = db.get_analyses_collection()
+    operations = []
+    updated = 0
+    for analysis in analyses.find({}, {"image_id": 1}):
+        image_id = renames.get(analysis.get("image_id"))
+        if image_id is None:
+            continue
+        updated += 1
+        if dry_run:
+            continue
+        operations.append(UpdateOne({"_id": analysis["_id"]}, {"$set": {"image_id": image_id}}))
+        if len(operations) >= BATCH_SIZE:
+            analyses.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        analyses.bulk_write(operations, ordered=False)
+    print(f"{'Would update' if dry_run else 'Updated'} {updated} analysis record(s)")
+
+def stored_uploads(root, renames):
+    """image_id -> path of everything in the store once the flat files are moved"""
+    stored = {}
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d != UPLOAD_TMP_DIR]
+        if directory != root:
+            for name in files:
+                stored[name] = os.path.join(directory, name)
+    for image_id in renames.values():
+        stored.setdefault(image_id, blob_path(image_id, root))
+    return stored
+
+def rebuild_reference_counts(stored, dry_run):
+    """Set every stored upload's reference count to the number of analyses using it"""
+    pipeline = [{"$group": {"_id": "$image_id", "refs": {"$sum": 1}}}]
+    referenced = {}
+    for row in db.get_analyses_collection().aggregate(pipeline, allowDiskUse=True):
+        if row["_id"] in stored:
+            referenced[row["_id"]] = row["refs"]
+
+    if not dry_run:
+        uploads = db.get_upload_collection()
+        uploads.delete_many({})
+        now = datetime.datetime.utcnow()
+        operations = [ReplaceOne({"_id": image_id}, {"refs": refs, "created_at": now}, upsert=True)
+                      for image_id, refs in referenced.items()]
+        for start in range(0, len(operations), BATCH_SIZE):
+            uploads.bulk_write(operations[start:start + BATCH_SIZE], ordered=False)
+    print(f"{'Would set' if dry_run else 'Set'} reference counts for {len(referenced)} stored upload(s)")
+    return referenced
+
+def remove_orphans(stored, referenced, dry_run):
+    """Delete stored uploads no analysis refers to, such as old anonymous uploads"""
+    orphans = 0
+    for image_id, path in stored.items():
+        if image_id not in referenced:
+            orphans += 1
+            if not dry_run:
+                os.remove(path)
+    print(f"{'Would remove' if dry_run else 'Removed'} {orphans} unreferenced upload(s)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Move a flat uploads/ folder into the content-addressed store, '
+                                                 'deduplicating files and rebuilding reference counts')
+    parser.add_argument('--root', default=UPLOAD_FOLDER, help='Upload folder')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it')
+    parser.add_argument('--delete-orphans', action='store_true',
+                        help='Also delete stored uploads that no analysis refers to')
+    args = parser.parse_args()
+
+    # Reference counts are rebuilt from analyses, so any in-flight request's
+    # reference would be lost: run this with the API stopped. Analyses are
+    # updated before any file moves, so an interrupted run can simply be
+    # started again
+    renames = plan_renames(args.root)
+    update_analyses(renames, args.dry_run)
+    move_flat_files(args.root, renames, args.dry_run)
+    stored = stored_uploads(args.root, renames)
+    referenced = rebuild_reference_counts(stored, args.dry_run)
+    if args.delete_orphans:
+        remove_orphans(stored, referenced, args.dry_run)
+
+if __name__ == "__main__":
+    main()
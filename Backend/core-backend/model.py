@@ -7,7 +7,18 @@ import os
 import json
 import platform
 import ssl
+import time
 import logging
+from contextlib import nullcontext
+from dotenv import load_dotenv
+from cpu_policy import get_thread_policy, apply_thread_policy
+from model_optimization import optimize_for_cpu_inference, resolve_precision, apply_channel_config, count_flops
+from metrics import TTA_PREDICTIONS, TTA_EXTRA_SECONDS, stage_timer
+from tracing import traced, current_request_id
+from profiling import operator_profile
+
+# Load environment variables
+load_dotenv()
 
 # Fix for macOS SSL certificate issues
 if platform.system() == 'Darwin':
@@ -17,8 +28,122 @@ if platform.system() == 'Darwin':
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Inception V3 input size and ImageNet normalization
+IMAGE_SIZE = 299
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+
+# Inference backend: "eager" (default) or "fused" (BatchNorm folded into the
+# convolutions, channels_last layout and oneDNN graph fusion where available)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager").lower()
+
+# Inference precision: "fp32" (default) or "bf16" (autocast, falls back to
+# fp32 on CPUs without native bfloat16 support)
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32").lower()
+
+# Early-exit cascade: when a first-stage checkpoint is set, that cheap model
+# answers every image and only predictions below CASCADE_THRESHOLD (percent
+# confidence) escalate to the full model
+CASCADE_FIRST_STAGE_PATH = os.getenv("CASCADE_FIRST_STAGE_PATH", "")
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "90"))
+# The first stage must cost at most this fraction of the full model's FLOPs,
+# e.g. a prune_model.py checkpoint; otherwise every escalated image would pay
+# for two full forward passes and the cascade is turned off
+CASCADE_MAX_COST_RATIO = float(os.getenv("CASCADE_MAX_COST_RATIO", "0.7"))
+
+# Test-time augmentation: predictions below TTA_THRESHOLD (percent confidence)
+# are re-scored on flipped and cropped views of the same tensor, run as one batch
+INFERENCE_TTA = os.getenv("INFERENCE_TTA", "false").lower() in ("1", "true", "yes")
+TTA_THRESHOLD = float(os.getenv("TTA_THRESHOLD", "80"))
+TTA_CROP_SCALE = float(os.getenv("TTA_CROP_SCALE", "0.9"))
+
+# Example classes - replace with your actual plant disease classes
+CLASS_LABELS = {
+    0: "Apple___Apple_scab",
+    1: "Apple___Black_rot",
+    2: "Apple___Cedar_apple_rust",
+    3: "Apple___healthy",
+    4: "Blueberry___healthy",
+    5: "Cherry___healthy",
+    6: "Cherry___Powdery_mildew",
+    7: "Corn___Cercospora_leaf_spot Gray_leaf_spot",
+    8: "Corn___Common_rust",
+    9: "Corn___healthy",
+    10: "Corn___Northern_Leaf_Blight",
+    11: "Grape___Black_rot",
+    12: "Grape___Esca_(Black_Measles)",
+    13: "Grape___healthy",
+    14: "Grape___Leaf_blight_(Isariopsis_Leaf_Spot)",
+    15: "Orange___Haunglongbing_(Citrus_greening)",
+    16: "Peach___Bacterial_spot",
+    17: "Peach___healthy",
+    18: "Pepper,_bell___Bacterial_spot",
+    19: "Pepper,_bell___healthy",
+    20: "Potato___Early_blight",
+    21: "Potato___healthy",
+    22: "Potato___Late_blight",
+    23: "Raspberry___healthy",
+    24: "Soybean___healthy",
+    25: "Squash___Powdery_mildew",
+    26: "Strawberry___healthy",
+    27: "Strawberry___Leaf_scorch",
+    28: "Tomato___Bacterial_spot",
+    29: "Tomato___Early_blight",
+    30: "Tomato___healthy",
+    31: "Tomato___Late_blight",
+    32: "Tomato___Leaf_Mold",
+    33: "Tomato___Septoria_leaf_spot",
+    34: "Tomato___Spider_mites Two-spotted_spider_mite",
+    35: "Tomato___Target_Spot",
+    36: "Tomato___Tomato_Yellow_Leaf_Curl_Virus",
+    37: "Tomato___Tomato_mosaic_virus"
+}
+
+def tta_views(img_tensor, crop_scale=TTA_CROP_SCALE):
+    """Augmented views of a preprocessed (1, 3, H, W) tensor as one (6, 3, H, W) batch.
+
+    Horizontal and vertical flips plus a center and four corner crops of
+    crop_scale the side length, resized back to the input size. The
+    original view is not included.
+    """
+    _, _, height, width = img_tensor.shape
+    crop_h, crop_w = int(height * crop_scale), int(width * crop_scale)
+    offsets = [((height - crop_h) // 2, (width - crop_w) // 2),
+               (0, 0), (0, width - crop_w), (height - crop_h, 0), (height - crop_h, width - crop_w)]
+    crops = torch.cat([img_tensor[:, :, top:top + crop_h, left:left + crop_w] for top, left in offsets])
+    crops = torch.nn.functional.interpolate(crops, size=(height, width), mode='bilinear', align_corners=False)
+    return torch.cat([img_tensor.flip(3), img_tensor.flip(2), crops])
+
+def checkpoint_class_labels(model_path):
+    """Class labels saved in a training checkpoint, else the default CLASS_LABELS"""
+    if not model_path or not os.path.exists(model_path):
+        return dict(CLASS_LABELS)
+    try:
+        # mmap avoids reading the weights just to get at the labels
+        checkpoint = torch.load(model_path, map_location="cpu", mmap=True)
+        if isinstance(checkpoint, dict) and checkpoint.get("class_labels"):
+            return {int(idx): name for idx, name in checkpoint["class_labels"].items()}
+    except Exception as e:
+        logger.warning(f"Could not read class labels from {model_path}: {e}")
+    return dict(CLASS_LABELS)
+
+def build_inference_transform():
+    """Image transformations used for inference"""
+    return transforms.Compose([
+        transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),  # Inception V3 requires 299x299 input
+        transforms.ToTensor(),
+        transforms.Normalize(mean=NORMALIZE_MEAN, std=NORMALIZE_STD)
+    ])
+
 class PlantDiseaseModel:
-    def __init__(self, model_path=None, num_classes=38):
+    def __init__(self, model_path=None, num_classes=38, thread_policy=None, backend=None, precision=None,
+                 tta=None, tta_threshold=None):
+        # Size the torch thread pools before any work runs; without this every
+        # worker on the box starts one intra-op thread per core
+        if thread_policy is None:
+            thread_policy = get_thread_policy()
+        self.thread_policy = apply_thread_policy(thread_policy)
+        
         # Initialize model path if not provided
         if model_path is None:
             model_path = os.path.join('models', 'inception_v3_direct.pth')
@@ -45,6 +170,9 @@ class PlantDiseaseModel:
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         logger.info(f"Using device: {self.device}")
         
+        # Labels stored with the weights, when the checkpoint has them
+        self.checkpoint_labels = None
+        
         # Initialize the model
         try:
             logger.info("Loading Inception V3 model...")
@@ -60,6 +188,21 @@ class PlantDiseaseModel:
             if os.path.exists(model_path):
                 logger.info(f"Loading weights from {model_path}...")
                 state_dict = torch.load(model_path, map_location=self.device)
+                # Training checkpoints wrap the weights with metadata; pruned
+                # ones also record the reduced channel counts
+                if isinstance(state_dict, dict) and "model_state_dict" in state_dict:
+                    checkpoint = state_dict
+                    state_dict = checkpoint["model_state_dict"]
+                    if checkpoint.get("channel_config"):
+                        apply_channel_config(self.model, checkpoint["channel_config"])
+                        logger.info(f"Applied pruned channel config to {len(checkpoint['channel_config'])} layers")
+                    if checkpoint.get("class_labels"):
+                        self.checkpoint_labels = {int(idx): name for idx, name in checkpoint["class_labels"].items()}
+                # Heads fine-tuned for a different set of classes
+                head_classes = state_dict["fc.weight"].shape[0]
+                if head_classes != self.model.fc.out_features:
+                    self.model.fc = nn.Linear(in_features, head_classes)
+                    logger.info(f"Final layer resized to the checkpoint's {head_classes} classes")
                 self.model.load_state_dict(state_dict)
                 logger.info(f"Successfully loaded weights from {model_path}")
             else:
@@ -83,59 +226,38 @@ class PlantDiseaseModel:
         self.model = self.model.to(self.device)
         self.model.eval()  # Set to evaluation mode
         
+        # Module used by predict; the fused backend folds BatchNorm into
+        # self.model in place, so that model is then for inference only
+        self.backend = backend or INFERENCE_BACKEND
+        self.precision = resolve_precision(precision or INFERENCE_PRECISION, self.device)
+        self.inference_model = self.model
+        self.memory_format = torch.contiguous_format
+        self.optimization_info = None
+        if self.backend == "fused":
+            if self.device.type == "cpu":
+                example_input = torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE)
+                self.inference_model, self.optimization_info = optimize_for_cpu_inference(
+                    self.model, example_input, autocast_dtype=self._autocast_dtype()
+                )
+                self.memory_format = torch.channels_last
+            else:
+                logger.warning("Fused backend is CPU-only, using eager inference")
+                self.backend = "eager"
+        
+        # Opt-in test-time augmentation for low-confidence predictions
+        self.tta = INFERENCE_TTA if tta is None else tta
+        self.tta_threshold = TTA_THRESHOLD if tta_threshold is None else tta_threshold
+        
         # Define image transformations
-        self.transform = transforms.Compose([
-            transforms.Resize((299, 299)),  # Inception V3 requires 299x299 input
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
+        self.transform = build_inference_transform()
         
         # Load class labels
         self.class_labels = self._load_class_labels()
 
     def _load_class_labels(self):
-        # Example classes - replace with your actual plant disease classes
-        labels = {
-            0: "Apple___Apple_scab",
-            1: "Apple___Black_rot",
-            2: "Apple___Cedar_apple_rust",
-            3: "Apple___healthy",
-            4: "Blueberry___healthy",
-            5: "Cherry___healthy",
-            6: "Cherry___Powdery_mildew",
-            7: "Corn___Cercospora_leaf_spot Gray_leaf_spot",
-            8: "Corn___Common_rust",
-            9: "Corn___healthy",
-            10: "Corn___Northern_Leaf_Blight",
-            11: "Grape___Black_rot",
-            12: "Grape___Esca_(Black_Measles)",
-            13: "Grape___healthy",
-            14: "Grape___Leaf_blight_(Isariopsis_Leaf_Spot)",
-            15: "Orange___Haunglongbing_(Citrus_greening)",
-            16: "Peach___Bacterial_spot",
-            17: "Peach___healthy",
-            18: "Pepper,_bell___Bacterial_spot",
-            19: "Pepper,_bell___healthy",
-            20: "Potato___Early_blight",
-            21: "Potato___healthy",
-            22: "Potato___Late_blight",
-            23: "Raspberry___healthy",
-            24: "Soybean___healthy",
-            25: "Squash___Powdery_mildew",
-            26: "Strawberry___healthy",
-            27: "Strawberry___Leaf_scorch",
-            28: "Tomato___Bacterial_spot",
-            29: "Tomato___Early_blight",
-            30: "Tomato___healthy",
-            31: "Tomato___Late_blight",
-            32: "Tomato___Leaf_Mold",
-            33: "Tomato___Septoria_leaf_spot",
-            34: "Tomato___Spider_mites Two-spotted_spider_mite",
-            35: "Tomato___Target_Spot",
-            36: "Tomato___Tomato_Yellow_Leaf_Curl_Virus",
-            37: "Tomato___Tomato_mosaic_virus"
-        }
-        return labels
+        if self.checkpoint_labels and len(self.checkpoint_labels) == self.model.fc.out_features:
+            return dict(self.checkpoint_labels)
+        return dict(CLASS_LABELS)
 
     def preprocess_image(self, image_path):
         """Preprocess an image for inference"""
@@ -144,52 +266,102 @@ class PlantDiseaseModel:
             img_tensor = self.transform(img).unsqueeze(0).to(self.device)
             return img_tensor
         except Exception as e:
-            print(f"Error preprocessing image: {e}")
+            print(f"Error preprocessing image (request {current_request_id()}): {e}")
             return None
 
+    @traced('model.predict')
     def predict(self, image_path):
         """Predict plant disease from image"""
-        img_tensor = self.preprocess_image(image_path)
+        # No-op unless an admin profiling session is running
+        with operator_profile():
+            with stage_timer('preprocess'):
+                img_tensor = self.preprocess_image(image_path)
+            
+            if img_tensor is None:
+                return {"error": "Failed to process image"}
+            
+            return self.predict_tensor(img_tensor)
+
+    def _autocast_dtype(self):
+        return torch.bfloat16 if self.precision == "bf16" else None
+
+    def forward_logits(self, img_tensor):
+        """Run a preprocessed (N, 3, 299, 299) batch through the model and return fp32 logits"""
+        img_tensor = img_tensor.to(self.device, memory_format=self.memory_format)
+        # A traced fused graph already contains its casts; anything else needs autocast
+        casts_traced = self.optimization_info is not None and self.optimization_info["onednn_fusion"]
+        autocast_dtype = None if casts_traced else self._autocast_dtype()
+        context = torch.autocast(device_type=self.device.type, dtype=autocast_dtype) \
+            if autocast_dtype is not None else nullcontext()
+        with torch.no_grad(), context:
+            outputs = self.inference_model(img_tensor)
+        # Softmax and confidences are always computed in fp32
+        return outputs.float()
+
+    def postprocess(self, logits):
+        """Build the prediction result from one row of fp32 logits"""
+        # Get probabilities using softmax
+        probabilities = torch.nn.functional.softmax(logits, dim=0)
+        class_idx = torch.argmax(probabilities).item()
+        confidence = probabilities[class_idx].item() * 100
         
-        if img_tensor is None:
-            return {"error": "Failed to process image"}
+        result = {
+            "disease": self.class_labels[class_idx],
+            "confidence": round(confidence, 2),
+            "top_predictions": []
+        }
         
-        with torch.no_grad():
-            # Ensure model is in eval mode
-            self.model.eval()
-            
-            try:
-                # Inception V3 in training mode returns tuple (output, aux_output)
-                # In eval mode, it only returns output
-                outputs = self.model(img_tensor)
-                
-                _, predicted = torch.max(outputs, 1)
-                class_idx = predicted.item()
-                
-                # Get probabilities using softmax
-                probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
-                confidence = probabilities[class_idx].item() * 100
-                
-                result = {
-                    "disease": self.class_labels[class_idx],
-                    "confidence": round(confidence, 2),
-                    "top_predictions": []
-                }
-                
-                # Get top 5 predictions
-                top_probs, top_indices = torch.topk(probabilities, 5)
-                for i in range(top_indices.size(0)):
-                    idx = top_indices[i].item()
-                    prob = top_probs[i].item() * 100
-                    result["top_predictions"].append({
-                        "disease": self.class_labels[idx],
-                        "confidence": round(prob, 2)
-                    })
-                
-                return result
-            except Exception as e:
-                print(f"Error during inference: {e}")
-                return {"error": f"Inference error: {str(e)}"}
+        # Get top 5 predictions
+        top_probs, top_indices = torch.topk(probabilities, min(5, probabilities.numel()))
+        for i in range(top_indices.size(0)):
+            idx = top_indices[i].item()
+            prob = top_probs[i].item() * 100
+            result["top_predictions"].append({
+                "disease": self.class_labels[idx],
+                "confidence": round(prob, 2)
+            })
+        
+        return result
+
+    def predict_tensor(self, img_tensor):
+        """Predict plant disease from a preprocessed (1, 3, 299, 299) tensor"""
+        # Ensure model is in eval mode
+        self.model.eval()
+        
+        try:
+            return self.classify(img_tensor)
+        except Exception as e:
+            print(f"Error during inference (request {current_request_id()}): {e}")
+            return {"error": f"Inference error: {str(e)}"}
+
+    def classify(self, img_tensor):
+        """Forward pass and postprocess, re-scoring low-confidence predictions with TTA when enabled"""
+        # Inception V3 in training mode returns tuple (output, aux_output)
+        # In eval mode, it only returns output
+        with stage_timer('forward'):
+            logits = self.forward_logits(img_tensor)[0]
+        with stage_timer('postprocess'):
+            result = self.postprocess(logits)
+        if not self.tta or result["confidence"] >= self.tta_threshold:
+            return result
+
+        started = time.perf_counter()
+        views = tta_views(img_tensor[:1].to(self.device))
+        view_logits = self.forward_logits(views)
+        # Average the logits of the original and all augmented views
+        averaged = (logits + view_logits.sum(dim=0)) / (view_logits.size(0) + 1)
+        base_confidence = result["confidence"]
+        result = self.postprocess(averaged)
+        extra_seconds = time.perf_counter() - started
+
+        TTA_PREDICTIONS.inc()
+        TTA_EXTRA_SECONDS.observe(extra_seconds)
+        result["tta"] = {
+            "views": view_logits.size(0) + 1,
+            "base_confidence": base_confidence,
+            "extra_ms": round(extra_seconds * 1000, 2)
+        }
+        return result
 
     def train(self, train_loader, val_loader, epochs=10, lr=0.001):
         """Train the model (for future use)"""
@@ -258,6 +430,85 @@ class PlantDiseaseModel:
         torch.save(self.model.state_dict(), path)
         print(f"Model saved to {path}")
 
+class CascadeModel:
+    """Early-exit cascade of a cheap first-stage model and the full model.
+
+    Both stages take the same 299x299 preprocessed input, so an image is
+    decoded once. Results carry a "stage" field saying which model answered.
+    """
+
+    def __init__(self, first_stage_path, model_path=None, threshold=None, num_classes=38,
+                 thread_policy=None, backend=None, precision=None, tta=None, tta_threshold=None):
+        if thread_policy is None:
+            thread_policy = get_thread_policy()
+        # Only the full model re-scores with TTA; the first stage either answers
+        # confidently or escalates
+        self.first_stage = PlantDiseaseModel(model_path=first_stage_path, num_classes=num_classes,
+                                             thread_policy=thread_policy, backend=backend, precision=precision,
+                                             tta=False)
+        self.full_model = PlantDiseaseModel(model_path=model_path, num_classes=num_classes,
+                                            thread_policy=thread_policy, backend=backend, precision=precision,
+                                            tta=tta, tta_threshold=tta_threshold)
+        self.threshold = CASCADE_THRESHOLD if threshold is None else threshold
+        self.device = self.full_model.device
+        self.class_labels = self.full_model.class_labels
+        # Measured on the eager modules, whichever backend serves them
+        self.cost_ratio = count_flops(self.first_stage.model) / count_flops(self.full_model.model)
+        logger.info(f"Cascade: {first_stage_path} first ({self.cost_ratio:.0%} of the full model's FLOPs), "
+                    f"escalating below {self.threshold}% confidence")
+
+    def preprocess_image(self, image_path):
+        """Preprocess an image for inference"""
+        return self.full_model.preprocess_image(image_path)
+
+    @traced('model.predict')
+    def predict(self, image_path):
+        """Predict plant disease from image"""
+        # No-op unless an admin profiling session is running
+        with operator_profile():
+            with stage_timer('preprocess'):
+                img_tensor = self.preprocess_image(image_path)
+            
+            if img_tensor is None:
+                return {"error": "Failed to process image"}
+            
+            return self.predict_tensor(img_tensor)
+
+    def predict_tensor(self, img_tensor):
+        """Predict with the first stage, escalating low-confidence images to the full model"""
+        try:
+            with stage_timer('forward'):
+                logits = self.first_stage.forward_logits(img_tensor)[0]
+            with stage_timer('postprocess'):
+                result = self.first_stage.postprocess(logits)
+            if result["confidence"] >= self.threshold:
+                result["stage"] = "first"
+                return result
+
+            first_stage_confidence = result["confidence"]
+            result = self.full_model.classify(img_tensor)
+            result["stage"] = "full"
+            result["first_stage_confidence"] = first_stage_confidence
+            return result
+        except Exception as e:
+            print(f"Error during inference (request {current_request_id()}): {e}")
+            return {"error": f"Inference error: {str(e)}"}
+
+def load_model(model_path=None, **kwargs):
+    """Build the configured predictor: a CascadeModel when a first stage is set, else a PlantDiseaseModel"""
+    if CASCADE_FIRST_STAGE_PATH:
+        if os.path.exists(CASCADE_FIRST_STAGE_PATH):
+            cascade = CascadeModel(CASCADE_FIRST_STAGE_PATH, model_path=model_path, **kwargs)
+            if cascade.cost_ratio <= CASCADE_MAX_COST_RATIO:
+                return cascade
+            logger.error(f"Cascade first stage {CASCADE_FIRST_STAGE_PATH} costs {cascade.cost_ratio:.0%} of the "
+                         f"full model's FLOPs, above CASCADE_MAX_COST_RATIO ({CASCADE_MAX_COST_RATIO:.0%}); "
+                         f"cascade disabled")
+            return cascade.full_model
+        # Without this check the first stage would silently load the full model
+        logger.warning(f"Cascade first stage not found at {CASCADE_FIRST_STAGE_PATH}, cascade disabled")
+    return PlantDiseaseModel(model_path=model_path, **kwargs)
+
 # Example usage
 if __name__ == "__main__":
     model = PlantDiseaseModel()
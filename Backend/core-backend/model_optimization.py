@@ -0,0 +1,239 @@
+import logging
+from contextlib import nullcontext
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+logger = logging.getLogger(__name__)
+
+def fold_batchnorm(model):
+    """Fold every Conv2d -> BatchNorm2d pair of Inception's BasicConv2d blocks.
+
+    The BatchNorm scale and shift are merged into the conv weights and the
+    BatchNorm is replaced by an Identity, in place. Only valid in eval mode;
+    the folded model must not be trained or saved as a regular checkpoint.
+    Returns the number of folded pairs.
+    """
+    model.eval()
+    folded = 0
+    for module in model.modules():
+        conv = getattr(module, "conv", None)
+        bn = getattr(module, "bn", None)
+        if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+            module.conv = fuse_conv_bn_eval(conv, bn)
+            module.bn = nn.Identity()
+            folded += 1
+    return folded
+
+def onednn_fusion_available():
+    """Whether this torch build can run the oneDNN graph fuser"""
+    return hasattr(torch.jit, "enable_onednn_fusion") and torch.backends.mkldnn.is_available()
+
+def cpu_supports_bf16():
+    """Whether the CPU has native bfloat16 compute (AVX512-BF16 or AMX)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+        if "avx512_bf16" in flags or "amx_bf16" in flags:
+            return True
+    except OSError:
+        pass
+    # Non-Linux hosts: ask oneDNN directly (private API, may not exist)
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+def resolve_precision(precision, device):
+    """Return the precision to actually run, falling back to fp32 when unsupported"""
+    if precision not in ("fp32", "bf16"):
+        logger.warning(f"Unknown inference precision '{precision}', using fp32")
+        return "fp32"
+    if precision == "bf16" and device.type == "cpu" and not cpu_supports_bf16():
+        logger.warning("CPU lacks native bfloat16 support, using fp32")
+        return "fp32"
+    return precision
+
+def optimize_for_cpu_inference(model, example_input, use_onednn=True, autocast_dtype=None):
+    """Build the fused CPU inference path for an eval-mode model.
+
+    Folds BatchNorm into the convolutions, converts weights to channels_last
+    and, where available, traces and freezes the model with oneDNN graph
+    fusion enabled. With autocast_dtype the trace is recorded under CPU
+    autocast so the casts are baked into the graph. Returns (module, info);
+    inputs must be passed in channels_last memory format.
+    """
+    info = {"folded_batchnorm": fold_batchnorm(model), "channels_last": True, "onednn_fusion": False,
+            "autocast": str(autocast_dtype) if autocast_dtype is not None else None}
+
+    model = model.to(memory_format=torch.channels_last)
+    example_input = example_input.to(memory_format=torch.channels_last)
+
+    if use_onednn and onednn_fusion_available():
+        # Both switches are process-wide, so they are restored once the
+        # graph has been fused rather than left set for every later trace
+        onednn_was_enabled = torch.jit.onednn_fusion_enabled()
+        jit_autocast_was_enabled = None
+        try:
+            torch.jit.enable_onednn_fusion(True)
+            if autocast_dtype is not None:
+                # Record the autocast casts in the trace instead of applying
+                # JIT autocast a second time at run time
+                jit_autocast_was_enabled = torch._C._jit_set_autocast_mode(False)
+            context = torch.autocast(device_type="cpu", dtype=autocast_dtype) \
+                if autocast_dtype is not None else nullcontext()
+            with torch.no_grad(), context:
+                traced = torch.jit.trace(model, example_input, check_trace=False)
+                traced = torch.jit.freeze(traced)
+                # The fuser profiles the first runs before it rewrites the graph
+                for _ in range(2):
+                    traced(example_input)
+            model = traced
+            info["onednn_fusion"] = True
+        except Exception as e:
+            logger.warning(f"oneDNN fusion unavailable, using eager channels_last model: {e}")
+        finally:
+            torch.jit.enable_onednn_fusion(onednn_was_enabled)
+            if jit_autocast_was_enabled is not None:
+                torch._C._jit_set_autocast_mode(jit_autocast_was_enabled)
+
+    logger.info(f"Fused inference path: {info}")
+    return model, info
+
+# Structured pruning of Inception V3. Only channels that feed other convs
+# inside the same branch are pruned: the concatenated block outputs keep
+# their width, so every downstream block and the classifier are untouched.
+# Each entry maps a producer BasicConv2d to the BasicConv2d(s) reading it.
+PRUNABLE_STEM = [
+    ("Conv2d_1a_3x3", ["Conv2d_2a_3x3"]),
+    ("Conv2d_2a_3x3", ["Conv2d_2b_3x3"]),
+    ("Conv2d_2b_3x3", ["Conv2d_3b_1x1"]),  # through a channel-wise max pool
+    ("Conv2d_3b_1x1", ["Conv2d_4a_3x3"]),
+]
+PRUNABLE_BLOCKS = {
+    "InceptionA": [
+        ("branch5x5_1", ["branch5x5_2"]),
+        ("branch3x3dbl_1", ["branch3x3dbl_2"]),
+        ("branch3x3dbl_2", ["branch3x3dbl_3"]),
+    ],
+    "InceptionB": [
+        ("branch3x3dbl_1", ["branch3x3dbl_2"]),
+        ("branch3x3dbl_2", ["branch3x3dbl_3"]),
+    ],
+    "InceptionC": [
+        ("branch7x7_1", ["branch7x7_2"]),
+        ("branch7x7_2", ["branch7x7_3"]),
+        ("branch7x7dbl_1", ["branch7x7dbl_2"]),
+        ("branch7x7dbl_2", ["branch7x7dbl_3"]),
+        ("branch7x7dbl_3", ["branch7x7dbl_4"]),
+        ("branch7x7dbl_4", ["branch7x7dbl_5"]),
+    ],
+    "InceptionD": [
+        ("branch3x3_1", ["branch3x3_2"]),
+        ("branch7x7x3_1", ["branch7x7x3_2"]),
+        ("branch7x7x3_2", ["branch7x7x3_3"]),
+        ("branch7x7x3_3", ["branch7x7x3_4"]),
+    ],
+    "InceptionE": [
+        ("branch3x3_1", ["branch3x3_2a", "branch3x3_2b"]),
+        ("branch3x3dbl_1", ["branch3x3dbl_2"]),
+        ("branch3x3dbl_2", ["branch3x3dbl_3a", "branch3x3dbl_3b"]),
+    ],
+}
+
+def prunable_groups(model):
+    """List (producer_name, consumer_names) with fully qualified module names"""
+    groups = [(producer, consumers) for producer, consumers in PRUNABLE_STEM]
+    for block_name, block in model.named_children():
+        for producer, consumers in PRUNABLE_BLOCKS.get(type(block).__name__, []):
+            groups.append((f"{block_name}.{producer}", [f"{block_name}.{c}" for c in consumers]))
+    return groups
+
+def _slice_conv(conv, out_idx=None, in_idx=None):
+    """Return a new Conv2d keeping only the given output / input channels"""
+    weight = conv.weight.data
+    if out_idx is not None:
+        weight = weight[out_idx]
+    if in_idx is not None:
+        weight = weight[:, in_idx]
+    # Built where the original lives, so a model pruned on the GPU stays there
+    new_conv = nn.Conv2d(weight.shape[1], weight.shape[0], conv.kernel_size, stride=conv.stride,
+                         padding=conv.padding, dilation=conv.dilation, bias=conv.bias is not None,
+                         device=weight.device, dtype=weight.dtype)
+    new_conv.weight.data = weight.clone()
+    if conv.bias is not None:
+        new_conv.bias.data = (conv.bias.data[out_idx] if out_idx is not None else conv.bias.data).clone()
+    return new_conv
+
+def _slice_bn(bn, idx):
+    """Return a new BatchNorm2d keeping only the given channels"""
+    new_bn = nn.BatchNorm2d(len(idx), eps=bn.eps, momentum=bn.momentum,
+                            device=bn.weight.device, dtype=bn.weight.dtype)
+    new_bn.weight.data = bn.weight.data[idx].clone()
+    new_bn.bias.data = bn.bias.data[idx].clone()
+    new_bn.running_mean = bn.running_mean[idx].clone()
+    new_bn.running_var = bn.running_var[idx].clone()
+    return new_bn
+
+def _prune_group(model, producer_name, consumer_names, keep_idx):
+    producer = model.get_submodule(producer_name)
+    producer.conv = _slice_conv(producer.conv, out_idx=keep_idx)
+    producer.bn = _slice_bn(producer.bn, keep_idx)
+    for consumer_name in consumer_names:
+        consumer = model.get_submodule(consumer_name)
+        consumer.conv = _slice_conv(consumer.conv, in_idx=keep_idx)
+
+def prune_channels(model, ratio):
+    """Remove `ratio` of the channels of every prunable conv, in place.
+
+    Channels are ranked by the magnitude of their BatchNorm scale, as in
+    network slimming. Returns the channel config, {producer: kept channels},
+    needed to rebuild the smaller architecture when loading.
+    """
+    config = {}
+    for producer_name, consumer_names in prunable_groups(model):
+        bn = model.get_submodule(producer_name).bn
+        channels = bn.num_features
+        keep = max(1, int(round(channels * (1.0 - ratio))))
+        if keep >= channels:
+            continue
+        keep_idx = torch.argsort(bn.weight.data.abs(), descending=True)[:keep].sort().values
+        _prune_group(model, producer_name, consumer_names, keep_idx)
+        config[producer_name] = keep
+    return config
+
+def apply_channel_config(model, config):
+    """Reshape a freshly built model to a pruned channel config so a pruned state dict loads"""
+    groups = dict(prunable_groups(model))
+    for producer_name, keep in config.items():
+        _prune_group(model, producer_name, groups[producer_name], torch.arange(keep))
+    return model
+
+def count_flops(model, input_size=(1, 3, 299, 299)):
+    """Multiply-accumulate FLOPs (2 x MACs) of one forward pass, via hooks on conv and linear layers"""
+    flops = [0]
+
+    def conv_hook(module, inputs, output):
+        kernel = module.kernel_size[0] * module.kernel_size[1] * (module.in_channels // module.groups)
+        flops[0] += 2 * kernel * output.numel()
+
+    def linear_hook(module, inputs, output):
+        flops[0] += 2 * module.in_features * output.numel()
+
+    handles = []
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            handles.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            handles.append(module.register_forward_hook(linear_hook))
+
+    was_training = model.training
+    model.eval()
+    device = next(model.parameters()).device
+    with torch.no_grad():
+        model(torch.zeros(input_size, device=device))
+    model.train(was_training)
+
+    for handle in handles:
+        handle.remove()
+    return flops[0]
@@ -0,0 +1,125 @@
+import os
+import time
+import threading
+from pymongo import monitoring
+from dotenv import load_dotenv
+from metrics import (MONGO_COMMAND_LATENCY, MONGO_COMMAND_FAILURES, MONGO_POOL_CHECKOUT_WAIT,
+                     MONGO_POOL_CHECKOUT_FAILURES, MONGO_POOL_CONNECTIONS, MONGO_POOL_IN_USE, observe_stage)
+
+# Settings and helpers shared by the pymongo (database.py) and Motor
+# (async_database.py) clients. Importing this module opens no connection
+
+# Load environment variables
+load_dotenv()
+
+# MongoDB connection string and database name
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
+MONGODB_DB = os.getenv("MONGODB_DB", "plantg")
+
+# Connection pool settings; anything left unset keeps the pymongo default
+MONGODB_POOL_OPTIONS = {
+    "maxPoolSize": ("MONGODB_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGODB_MIN_POOL_SIZE", int),
+    "maxIdleTimeMS": ("MONGODB_MAX_IDLE_TIME_MS", int),
+    "maxConnecting": ("MONGODB_MAX_CONNECTING", int),
+    "waitQueueTimeoutMS": ("MONGODB_WAIT_QUEUE_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("MONGODB_CONNECT_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("MONGODB_SOCKET_TIMEOUT_MS", int),
+    "serverSelectionTimeoutMS": ("MONGODB_SERVER_SELECTION_TIMEOUT_MS", int),
+    "readPreference": ("MONGODB_READ_PREFERENCE", str),
+}
+
+def get_client_options():
+    """Build MongoClient keyword arguments from the environment"""
+    options = {}
+    for option, (env_var, cast) in MONGODB_POOL_OPTIONS.items():
+        value = os.getenv(env_var)
+        if value:
+            options[option] = cast(value)
+    return options
+
+# Upper bound on the /api/health ping, including server selection, so an
+# unreachable server is reported instead of waiting out serverSelectionTimeoutMS
+MONGODB_HEALTH_TIMEOUT_MS = int(os.getenv("MONGODB_HEALTH_TIMEOUT_MS", "2000"))
+
+# Disease names become field names inside user_stats.disease_counts, where
+# "." would be read as a path separator and a leading "$" as an operator
+def stats_key(disease):
+    """Encode a disease name for use as a disease_counts field name"""
+    key = str(disease).replace(".", "\uff0e")
+    if key.startswith("$"):
+        key = "\uff04" + key[1:]
+    return key
+
+def stats_disease(key):
+    """Decode a disease_counts field name back to the disease name"""
+    disease = key.replace("\uff0e", ".")
+    if disease.startswith("\uff04"):
+        disease = "$" + disease[1:]
+    return disease
+
+class CommandLatencyListener(monitoring.CommandListener):
+    """Record per-command latency and failures"""
+    
+    def started(self, event):
+        pass
+    
+    def succeeded(self, event):
+        # Command events are published on the thread running the command, so
+        # the stage is attributed to the request that issued it
+        MONGO_COMMAND_LATENCY.labels(event.command_name).observe(event.duration_micros / 1e6)
+        observe_stage('mongo', event.duration_micros / 1e6)
+    
+    def failed(self, event):
+        MONGO_COMMAND_LATENCY.labels(event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(event.command_name).inc()
+        observe_stage('mongo', event.duration_micros / 1e6)
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Record pool size, connections in use and checkout wait time"""
+    
+    def __init__(self):
+        # Checkout events are published on the thread doing the checkout,
+        # so the start time can be kept per thread
+        self.local = threading.local()
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc()
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec()
+    
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+    
+    def connection_check_out_failed(self, event):
+        self._observe_wait()
+        MONGO_POOL_CHECKOUT_FAILURES.labels(str(event.reason)).inc()
+    
+    def connection_checked_out(self, event):
+        self._observe_wait()
+        MONGO_POOL_IN_USE.inc()
+    
+    def connection_checked_in(self, event):
+        MONGO_POOL_IN_USE.dec()
+    
+    def _observe_wait(self):
+        started = getattr(self.local, "started", None)
+        if started is not None:
+            MONGO_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+            self.local.started = None
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import os
+import time
+import json
+import argparse
+import torch
+from tqdm import tqdm
+from model import PlantDiseaseModel
+from train_model import create_val_loader, BATCH_SIZE
+
+def main():
+    parser = argparse.ArgumentParser(description='Report accuracy drift of bf16 inference against fp32 on the validation split')
+    parser.add_argument('--model-path', default=os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth')))
+    parser.add_argument('--backend', default='eager', choices=['eager', 'fused'], help='Inference backend for both runs')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--force-bf16', action='store_true',
+                        help='Run bf16 autocast even when the CPU lacks native support (slow, for accuracy only)')
+    parser.add_argument('--output', help='Write the report to this JSON file')
+    args = parser.parse_args()
+    if args.force_bf16 and args.backend == 'fused':
+        # The fused graph is traced at load time, so bf16 cannot be switched on afterwards
+        parser.error("--force-bf16 only works with the eager backend")
+
+    fp32 = PlantDiseaseModel(model_path=args.model_path, backend=args.backend, precision='fp32')
+    bf16 = PlantDiseaseModel(model_path=args.model_path, backend=args.backend, precision='bf16')
+    if bf16.precision != 'bf16':
+        if not args.force_bf16:
+            print("This CPU has no native bfloat16 support, so bf16 inference would fall back to fp32.")
+            print("Re-run with --force-bf16 to measure the accuracy drift anyway.")
+            return
+        bf16.precision = 'bf16'
+
+    val_loader = create_val_loader(batch_size=args.batch_size)
+    num_classes = len(val_loader.dataset.classes)
+
+    total = 0
+    correct_fp32 = 0
+    correct_bf16 = 0
+    agree = 0
+    max_prob_diff = 0.0
+    sum_conf_diff = 0.0
+    class_total = torch.zeros(num_classes, dtype=torch.long)
+    class_correct_fp32 = torch.zeros(num_classes, dtype=torch.long)
+    class_correct_bf16 = torch.zeros(num_classes, dtype=torch.long)
+    time_fp32 = 0.0
+    time_bf16 = 0.0
+
+    for inputs, labels in tqdm(val_loader, desc="fp32 vs bf16"):
+        started = time.perf_counter()
+        logits_fp32 = fp32.forward_logits(inputs).cpu()
+        time_fp32 += time.perf_counter() - started
+
+        started = time.perf_counter()
+        logits_bf16 = bf16.forward_logits(inputs).cpu()
+        time_bf16 += time.perf_counter() - started
+
+        probs_fp32 = torch.softmax(logits_fp32, dim=1)
+        probs_bf16 = torch.softmax(logits_bf16, dim=1)
+        preds_fp32 = probs_fp32.argmax(dim=1)
+        preds_bf16 = probs_bf16.argmax(dim=1)
+
+        total += labels.size(0)
+        correct_fp32 += (preds_fp32 == labels).sum().item()
+        correct_bf16 += (preds_bf16 == labels).sum().item()
+        agree += (preds_fp32 == preds_bf16).sum().item()
+        max_prob_diff = max(max_prob_diff, (probs_fp32 - probs_bf16).abs().max().item())
+        # Drift in the confidence the API would report for the fp32 top-1 class
+        sum_conf_diff += (probs_fp32.gather(1, preds_fp32[:, None]) -
+                          probs_bf16.gather(1, preds_fp32[:, None])).abs().sum().item()
+
+        class_total += torch.bincount(labels, minlength=num_classes)
+        class_correct_fp32 += torch.bincount(labels[preds_fp32 == labels], minlength=num_classes)
+        class_correct_bf16 += torch.bincount(labels[preds_bf16 == labels], minlength=num_classes)
+
+    report = {
+        'images': total,
+        'backend': args.backend,
+        'accuracy_fp32': correct_fp32 / total,
+        'accuracy_bf16': correct_bf16 / total,
+        'accuracy_delta': (correct_bf16 - correct_fp32) / total,
+        'top1_agreement': agree / total,
+        'max_probability_diff': max_prob_diff,
+        'mean_confidence_diff_pct': sum_conf_diff / total * 100,
+        'images_per_sec_fp32': total / time_fp32,
+        'images_per_sec_bf16': total / time_bf16,
+        'per_class': []
+    }
+
+    for idx, name in enumerate(val_loader.dataset.classes):
+        n = class_total[idx].item()
+        if n == 0:
+            continue
+        report['per_class'].append({
+            'class': name,
+            'images': n,
+            'accuracy_fp32': class_correct_fp32[idx].item() / n,
+            'accuracy_bf16': class_correct_bf16[idx].item() / n,
+        })
+
+    print("\n=== bf16 accuracy drift report ===")
+    print(f"Validation images:        {total}")
+    print(f"fp32 accuracy:            {report['accuracy_fp32']:.4f}")
+    print(f"bf16 accuracy:            {report['accuracy_bf16']:.4f} ({report['accuracy_delta'] * 100:+.2f} pts)")
+    print(f"Top-1 agreement:          {report['top1_agreement']:.4f}")
+    print(f"Max probability diff:     {report['max_probability_diff']:.4f}")
+    print(f"Mean confidence diff:     {report['mean_confidence_diff_pct']:.3f} pts")
+    print(f"Throughput fp32 / bf16:   {report['images_per_sec_fp32']:.1f} / {report['images_per_sec_bf16']:.1f} img/s")
+
+    drifted = [c for c in report['per_class'] if c['accuracy_bf16'] != c['accuracy_fp32']]
+    if drifted:
+        print("\nClasses whose accuracy changed:")
+        for c in sorted(drifted, key=lambda c: c['accuracy_bf16'] - c['accuracy_fp32']):
+            print(f"  {c['class']:<50} {c['accuracy_fp32']:.4f} -> {c['accuracy_bf16']:.4f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Upper bound on one profiling session, whichever way it is limited
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+# Default interval between stack samples
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Finished reports are written here, so any worker can serve them
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("logs", "profiles"))
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class ProfileSession:
+    """Samples the stacks of request-handling threads and collects torch operator stats.
+
+    Ends after `seconds`, or after `requests` requests have finished, and
+    never runs longer than PROFILE_MAX_SECONDS.
+    """
+
+    def __init__(self, seconds=None, requests=None, interval_ms=PROFILE_INTERVAL_MS, operators=True,
+                 all_threads=False):
+        self.seconds = min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self.request_limit = requests
+        self.interval = max(interval_ms, 1) / 1000
+        self.operators = operators
+        self.all_threads = all_threads
+        self.id = uuid.uuid4().hex
+
+        self.stacks = Counter()
+        self.samples = 0
+        self.requests = 0
+        self.threads = set()
+        self.operator_stats = {}
+        self.operator_calls = 0
+        # The torch profiler cannot run in two threads at once; a busy lock
+        # means this predict call is sampled but not operator-profiled
+        self.operator_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def start(self, on_finish=None):
+        """Start sampling; on_finish(session) runs on the sampler thread once the session ends"""
+        self.on_finish = on_finish
+        self.started = time.perf_counter()
+        self.deadline = self.started + self.seconds
+        self.sampler = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        if not self.done.is_set():
+            self.elapsed = time.perf_counter() - self.started
+            self.done.set()
+
+    def _run(self):
+        self._sample()
+        # Let a predict call still under the operator profiler add its totals
+        with self.operator_lock:
+            pass
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self.done.wait(self.interval):
+            if time.perf_counter() >= self.deadline:
+                self.stop()
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            with self.lock:
+                tracked = set(self.threads)
+            for ident, frame in sys._current_frames().items():
+                if ident == own or not (self.all_threads or ident in tracked):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def request_started(self):
+        with self.lock:
+            self.threads.add(threading.get_ident())
+
+    def request_finished(self):
+        ident = threading.get_ident()
+        with self.lock:
+            # Requests already in flight when the session started are not counted
+            if ident not in self.threads:
+                return
+            self.threads.discard(ident)
+            self.requests += 1
+            limit_reached = self.request_limit is not None and self.requests >= self.request_limit
+        if limit_reached:
+            self.stop()
+
+    @contextmanager
+    def operator_profile(self):
+        """Run the block under the torch operator profiler and add its totals"""
+        if not self.operators or self.done.is_set() or not self.operator_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            from torch.profiler import profile, ProfilerActivity
+            with profile(activities=[ProfilerActivity.CPU]) as prof:
+                yield
+            with self.lock:
+                self.operator_calls += 1
+                for event in prof.key_averages():
+                    stats = self.operator_stats.setdefault(event.key, [0, 0.0, 0.0])
+                    stats[0] += event.count
+                    stats[1] += event.self_cpu_time_total
+                    stats[2] += event.cpu_time_total
+        finally:
+            self.operator_lock.release()
+
+    def folded(self):
+        """Collapsed stacks ("frame;frame;frame count" per line), as read by flamegraph.pl and speedscope"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def operator_rows(self, limit=50):
+        """Operators by total self CPU time, summed over every profiled predict call"""
+        total_self = sum(stats[1] for stats in self.operator_stats.values()) or 1.0
+        rows = []
+        for name, (count, self_us, total_us) in sorted(self.operator_stats.items(), key=lambda item: -item[1][1]):
+            rows.append({
+                'operator': name,
+                'calls': count,
+                'self_cpu_ms': round(self_us / 1000, 3),
+                'self_cpu_percent': round(100 * self_us / total_self, 2),
+                'total_cpu_ms': round(total_us / 1000, 3)
+            })
+        return rows[:limit]
+
+    def operator_table(self, limit=50):
+        """Plain-text version of operator_rows"""
+        lines = [f"{'operator':<40} {'calls':>8} {'self ms':>10} {'self %':>7} {'total ms':>10}"]
+        for row in self.operator_rows(limit):
+            lines.append(f"{row['operator'][:40]:<40} {row['calls']:>8} {row['self_cpu_ms']:>10.3f} "
+                         f"{row['self_cpu_percent']:>7.2f} {row['total_cpu_ms']:>10.3f}")
+        return '\n'.join(lines)
+
+    def report(self, operator_limit=50):
+        return {
+            'id': self.id,
+            'duration_s': round(self.elapsed, 3),
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'requests': self.requests,
+            'pid': os.getpid(),
+            'folded': self.folded(),
+            'operator_calls': self.operator_calls,
+            'operators': self.operator_rows(operator_limit),
+            'operator_table': self.operator_table(operator_limit)
+        }
+
+# The active session, if any. Every hook below checks this one global first,
+# so with profiling off the cost per request is a single attribute lookup
+session = None
+_start_lock = threading.Lock()
+
+def start_session(**kwargs):
+    """Start a session in this process; raises RuntimeError if one is already running.
+
+    The session runs in the background and its report is written to
+    PROFILE_DIR when it ends, to be read back with load_report.
+    """
+    global session
+    with _start_lock:
+        if session is not None:
+            raise RuntimeError("A profiling session is already running in this worker")
+        session = ProfileSession(**kwargs)
+        session.start(on_finish=_save_report)
+        return session
+
+def _save_report(ended):
+    """Write a finished session's report and clear it"""
+    global session
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = report_path(ended.id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(ended.report(), f)
+        os.replace(path + '.tmp', path)
+    finally:
+        with _start_lock:
+            if session is ended:
+                session = None
+
+def report_path(session_id):
+    return os.path.join(PROFILE_DIR, f"{session_id}.json")
+
+def load_report(session_id):
+    """A finished session's report, or None if there is none (yet)"""
+    try:
+        with open(report_path(session_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def request_started():
+    active = session
+    if active is not None:
+        active.request_started()
+
+def request_finished():
+    active = session
+    if active is not None:
+        active.request_finished()
+
+@contextmanager
+def operator_profile():
+    """Operator-profile the block while a session is running"""
+    active = session
+    if active is None:
+        yield
+        return
+    with active.operator_profile():
+        yield
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import os
+import copy
+import time
+import json
+import argparse
+import torch
+import torch.nn as nn
+from tqdm import tqdm
+from model import PlantDiseaseModel, IMAGE_SIZE
+from model_optimization import prune_channels, count_flops
+from train_model import create_data_loaders, device
+
+def count_parameters(model):
+    """Total number of parameters"""
+    return sum(p.numel() for p in model.parameters())
+
+def measure_latency(model, iterations):
+    """Mean batch-1 forward latency in milliseconds"""
+    model.eval()
+    x = torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE, device=device)
+    with torch.no_grad():
+        model(x)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            model(x)
+    return (time.perf_counter() - started) / iterations * 1000
+
+def evaluate(model, val_loader, max_batches=0):
+    """Top-1 accuracy on (up to max_batches of) the validation loader"""
+    model.eval()
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for i, (inputs, labels) in enumerate(val_loader):
+            if max_batches and i >= max_batches:
+                break
+            inputs, labels = inputs.to(device), labels.to(device)
+            correct += (model(inputs).argmax(dim=1) == labels).sum().item()
+            total += labels.size(0)
+    return correct / total if total else 0.0
+
+def finetune(model, train_loader, steps, lr):
+    """Short recovery fine-tune after pruning"""
+    if steps <= 0:
+        return
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    model.train()
+
+    step = 0
+    progress = tqdm(total=steps, desc="Fine-tuning")
+    while step < steps:
+        for inputs, labels in train_loader:
+            inputs, labels = inputs.to(device), labels.to(device)
+            optimizer.zero_grad()
+
+            outputs = model(inputs)
+            # Inception v3 returns (logits, aux_logits) in training mode
+            if isinstance(outputs, tuple):
+                loss = criterion(outputs[0], labels) + 0.4 * criterion(outputs[1], labels)
+            else:
+                loss = criterion(outputs, labels)
+
+            loss.backward()
+            optimizer.step()
+            step += 1
+            progress.update(1)
+            if step >= steps:
+                break
+    progress.close()
+    model.eval()
+
+def ratio_for_flop_budget(model, budget, base_flops):
+    """Binary search for the smallest uniform pruning ratio meeting a FLOP budget (fraction of base)"""
+    low, high = 0.0, 0.95
+    for _ in range(12):
+        mid = (low + high) / 2
+        candidate = copy.deepcopy(model)
+        prune_channels(candidate, mid)
+        if count_flops(candidate) / base_flops <= budget:
+            high = mid
+        else:
+            low = mid
+    return round(high, 3)
+
+def describe(name, model, val_loader, args):
+    """Collect FLOPs, parameters, latency and accuracy for one model"""
+    row = {
+        'model': name,
+        'gflops': round(count_flops(model) / 1e9, 3),
+        'params_m': round(count_parameters(model) / 1e6, 3),
+        'latency_ms': round(measure_latency(model, args.latency_iters), 2),
+        'accuracy': round(evaluate(model, val_loader, args.eval_batches), 4),
+    }
+    print(f"{row['model']:<14} {row['gflops']:>8} GFLOPs {row['params_m']:>8} M params "
+          f"{row['latency_ms']:>8} ms {row['accuracy']:>8} acc")
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description='Structured channel pruning for the Inception V3 plant disease model')
+    parser.add_argument('--model-path', default=os.getenv("MODEL_PATH", os.path.join('models', 'inception_v3_direct.pth')))
+    parser.add_argument('--ratios', type=float, nargs='+', default=[0.1, 0.25, 0.4, 0.5],
+                        help='Fractions of prunable channels to remove')
+    parser.add_argument('--target-flops', type=float,
+                        help='Instead of --ratios, prune to this fraction of the original FLOPs (e.g. 0.7)')
+    parser.add_argument('--finetune-steps', type=int, default=200, help='Recovery fine-tune steps per pruned model')
+    parser.add_argument('--lr', type=float, default=1e-4, help='Fine-tune learning rate')
+    parser.add_argument('--eval-batches', type=int, default=0, help='Validation batches to evaluate (0 = all)')
+    parser.add_argument('--latency-iters', type=int, default=20, help='Forward passes for the latency measurement')
+    parser.add_argument('--output-dir', default=os.path.join('models', 'pruned'), help='Where pruned models are written')
+    parser.add_argument('--report', help='Write the report to this JSON file')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    base = PlantDiseaseModel(model_path=args.model_path, backend='eager', precision='fp32').model.to(device)
+    train_loader, val_loader, class_labels = create_data_loaders()
+
+    print("\n=== Pruning report ===")
+    rows = [describe('baseline', base, val_loader, args)]
+    base_flops = count_flops(base)
+
+    ratios = args.ratios
+    if args.target_flops:
+        ratios = [ratio_for_flop_budget(base, args.target_flops, base_flops)]
+        print(f"Pruning ratio {ratios[0]} meets the {args.target_flops:.0%} FLOP budget")
+
+    for ratio in ratios:
+        pruned = copy.deepcopy(base)
+        config = prune_channels(pruned, ratio)
+        finetune(pruned, train_loader, args.finetune_steps, args.lr)
+
+        row = describe(f'pruned {ratio:.0%}', pruned, val_loader, args)
+        row['ratio'] = ratio
+        row['flops_fraction'] = round(count_flops(pruned) / base_flops, 3)
+
+        path = os.path.join(args.output_dir, f"inception_v3_pruned_{int(round(ratio * 100))}.pth")
+        torch.save({
+            'model_state_dict': pruned.state_dict(),
+            'channel_config': config,
+            'class_labels': class_labels,
+            'pruning_ratio': ratio,
+            'accuracy': row['accuracy']
+        }, path)
+        row['path'] = path
+        rows.append(row)
+        print(f"  saved to {path}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"\nReport written to {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import io
+import os
+import threading
+import mongomock
+import pymongo
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+# database.py imports MongoClient from pymongo, so patch it before that import
+pymongo.MongoClient = mongomock.MongoClient
+
+import uploads
+from database import Database
+
+def image_bytes(color=(73, 109, 137)):
+    img = Image.new('RGB', (64, 64), color=color)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def upload(data, filename='leaf.jpg'):
+    return FileStorage(stream=io.BytesIO(data), filename=filename, content_type='image/jpeg')
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """An empty upload folder and a Database on its own in-memory MongoDB"""
+    monkeypatch.setattr(uploads, 'UPLOAD_FOLDER', str(tmp_path))
+    database = Database.__new__(Database)
+    database.client = mongomock.MongoClient()
+    database.db = database.client.plantg_test
+    database.write_buffer = None
+    return str(tmp_path), database
+
+def refs(database, image_id):
+    record = database.get_upload_collection().find_one({"_id": image_id})
+    return record["refs"] if record else None
+
+def test_same_content_is_stored_once(store):
+    root, database = store
+    data = image_bytes()
+    first, first_path = uploads.store_upload(upload(data), database.acquire_upload, root)
+    second, second_path = uploads.store_upload(upload(data, 'renamed.jpg'), database.acquire_upload, root)
+
+    assert first == second
+    assert first_path == second_path == uploads.blob_path(first, root)
+    assert first.endswith('.jpg') and len(first) == 64 + len('.jpg')
+    assert refs(database, first) == 2
+    with open(first_path, 'rb') as f:
+        assert f.read() == data
+
+def test_release_deletes_only_the_last_reference(store):
+    root, database = store
+    image_id, path = uploads.store_upload(upload(image_bytes()), database.acquire_upload, root)
+    database.acquire_upload(image_id)
+
+    assert database.release_upload(image_id) is False
+    assert os.path.exists(path)
+    assert refs(database, image_id) == 1
+
+    assert database.release_upload(image_id) is True
+    assert not os.path.exists(path)
+    assert refs(database, image_id) is None
+
+def test_release_ignores_uploads_without_a_record(store):
+    root, database = store
+    legacy = os.path.join(root, 'd64a1d2b-8e7c-4f72-9288-a5df365cdea3.jpg')
+    with open(legacy, 'wb') as f:
+        f.write(image_bytes())
+
+    assert database.release_upload(os.path.basename(legacy)) is False
+    assert os.path.exists(legacy)
+
+def test_failed_acquire_leaves_nothing_behind(store):
+    root, _ = store
+
+    def acquire(image_id):
+        raise RuntimeError('database down')
+
+    with pytest.raises(RuntimeError):
+        uploads.store_upload(upload(image_bytes()), acquire, root)
+    scratch = os.path.join(root, uploads.UPLOAD_TMP_DIR)
+    assert [name for name in os.listdir(scratch) if name != 'locks'] == []
+
+def test_rejected_upload_is_not_stored(store):
+    root, database = store
+    with pytest.raises(uploads.UploadRejected):
+        uploads.store_upload(upload(b'not an image at all'), database.acquire_upload, root)
+    assert database.get_upload_collection().count_documents({}) == 0
+
+def test_deleting_an_analysis_releases_its_upload(store):
+    root, database = store
+    user_id = database.get_user_collection().insert_one({"email": "grower@example.com"}).inserted_id
+    image_id, path = uploads.store_upload(upload(image_bytes()), database.acquire_upload, root)
+    analysis = database.save_analysis(user_id, image_id, 'Tomato___Late_blight', 98.5, [], [], [], '')
+
+    assert database.delete_analysis(analysis['_id'], user_id) is True
+    assert not os.path.exists(path)
+    assert refs(database, image_id) is None
+
+def test_concurrent_same_content_uploads_keep_their_file(store):
+    """Each request can read its file for as long as it holds a reference"""
+    root, database = store
+    data = image_bytes()
+    missing = []
+
+    def request():
+        for _ in range(200):
+            image_id, path = uploads.store_upload(upload(data), database.acquire_upload, root)
+            try:
+                with open(path, 'rb') as f:
+                    f.read()
+            except FileNotFoundError:
+                missing.append(path)
+            finally:
+                database.release_upload(image_id)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert missing == []
+    # Every reference was released, so the image and its record are gone
+    assert database.get_upload_collection().count_documents({}) == 0
+    stored = [name for directory, dirs, files in os.walk(root)
+              if not directory.startswith(os.path.join(root, uploads.UPLOAD_TMP_DIR)) for name in files]
+    assert stored == []
@@ -0,0 +1,28 @@
+import os
+import jwt
+import datetime
+from dotenv import load_dotenv
+
+# JWT helpers shared by the Flask (auth.py) and Quart apps, kept free of
+# database imports so the ASGI app does not construct the pymongo client
+
+# Load environment variables
+load_dotenv()
+
+# JWT settings
+JWT_SECRET = os.getenv("JWT_SECRET", "plantg_secret_key_do_not_share")
+JWT_EXPIRATION = 24 * 60 * 60  # 24 hours in seconds
+
+def generate_token(user_id, email, name, role="user"):
+    """Generate JWT token for authenticated user"""
+    payload = {
+        "sub": str(user_id),
+        "email": email,
+        "name": name,
+        "role": role,
+        "iat": datetime.datetime.utcnow(),
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=JWT_EXPIRATION)
+    }
+    
+    token = jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+    return token
@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import time
+import uuid
+import inspect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Append one JSON line per finished request to this file (disabled when unset)
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+# Incoming X-Request-ID values are reused only if they look like an ID
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+class Trace:
+    """Spans recorded while handling one request"""
+
+    __slots__ = ('request_id', 'started', 'started_at', 'spans')
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+
+    def add(self, name, started, duration):
+        # list.append is atomic, so executor threads sharing the trace are safe
+        self.spans.append({
+            'name': name,
+            'start_ms': round((started - self.started) * 1000, 3),
+            'duration_ms': round(duration * 1000, 3)
+        })
+
+current_trace = ContextVar('plantg_trace', default=None)
+_export_lock = threading.Lock()
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+def start_trace(request_id=None):
+    """Begin a trace for the current request, reusing a well-formed incoming ID"""
+    if not request_id or not REQUEST_ID_PATTERN.match(request_id):
+        request_id = new_request_id()
+    trace = Trace(request_id)
+    current_trace.set(trace)
+    return trace
+
+def current_request_id():
+    """The current request's ID; events outside a request get a fresh one"""
+    trace = current_trace.get()
+    return trace.request_id if trace else new_request_id()
+
+def add_span(name, started, duration):
+    """Record an already-timed span on the current trace, if any"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, started, duration)
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as a span of the current trace"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter() - started)
+
+def traced(name):
+    """Decorator form of span(), for plain and async functions"""
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @wraps(f)
+            async def decorated_async(*args, **kwargs):
+                with span(name):
+                    return await f(*args, **kwargs)
+            return decorated_async
+
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+def span_timings():
+    """The spans recorded so far, for attaching to a log event"""
+    trace = current_trace.get()
+    return list(trace.spans) if trace else []
+
+def merge_spans(spans, offset_started):
+    """Add spans recorded in another process, shifted to start at offset_started"""
+    trace = current_trace.get()
+    if trace is None:
+        return
+    offset_ms = (offset_started - trace.started) * 1000
+    for s in spans:
+        trace.spans.append({**s, 'start_ms': round(s['start_ms'] + offset_ms, 3)})
+
+def finish_trace(endpoint, method, status):
+    """End the current trace and export it when TRACE_FILE is set"""
+    trace = current_trace.get()
+    if trace is None:
+        return
+    current_trace.set(None)
+    if not TRACE_FILE:
+        return
+
+    record = {
+        'request_id': trace.request_id,
+        'timestamp': trace.started_at,
+        'endpoint': endpoint,
+        'method': method,
+        'status': status,
+        'duration_ms': round((time.perf_counter() - trace.started) * 1000, 3),
+        'spans': trace.spans
+    }
+    try:
+        # One write per record, so lines from several workers do not interleave
+        line = json.dumps(record) + '\n'
+        with _export_lock, open(TRACE_FILE, 'a') as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Error writing trace: {e}")
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+import os
+import argparse
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from tqdm import tqdm
+from cpu_policy import get_thread_policy, apply_thread_policy, available_cores
+from evaluation import ConfusionMatrix
+from training_checkpoint import (CheckpointManager, ResumableDistributedSampler, SeededAugmentation,
+                                 capture_rng_state, restore_rng_state)
+from train_model import (create_dataset, create_model, start_epoch_batches, MODEL_PATH, CHECKPOINT_DIR,
+                         CHECKPOINT_EVERY, KEEP_CHECKPOINTS, BATCH_SIZE, LEARNING_RATE, NUM_EPOCHS, SEED)
+
+def log(message):
+    """Print from rank 0 only"""
+    if dist.get_rank() == 0:
+        print(message, flush=True)
+
+def all_reduce_sum(*values):
+    """Sum python numbers across all ranks"""
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+def setup(args):
+    """Join the process group and size this process's thread pool"""
+    dist.init_process_group(backend="gloo")
+    local_rank = int(os.environ.get("LOCAL_RANK", "0"))
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", str(dist.get_world_size())))
+    # Split the host's cores between the processes running on it
+    threads = args.threads or max(1, len(available_cores()) // local_world_size)
+    policy = get_thread_policy(num_workers=local_world_size, worker_index=local_rank,
+                               intra_op_threads=threads, inter_op_threads=1, pin_cores=args.pin)
+    return apply_thread_policy(policy)
+
+def create_loaders(args):
+    """Rank-sharded training and validation loaders"""
+    # Streaming shards cannot be split into equal per-rank epochs, so the
+    # decoded cache or the image folder is used
+    train_dataset = create_dataset("train", train=True, streaming=False)
+    val_dataset = create_dataset("val", streaming=False)
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+
+    train_sampler = ResumableDistributedSampler(train_dataset, num_replicas=world_size, rank=rank,
+                                                shuffle=True, seed=SEED)
+    train_loader = DataLoader(SeededAugmentation(train_dataset, seed=SEED), batch_size=args.batch_size,
+                              sampler=train_sampler, num_workers=args.loader_workers,
+                              generator=torch.Generator().manual_seed(SEED))
+    # Evaluation needs no gradient sync, so a strided split without padding keeps the metrics exact
+    val_shard = Subset(val_dataset, range(rank, len(val_dataset), world_size))
+    val_loader = DataLoader(val_shard, batch_size=args.batch_size, shuffle=False, num_workers=args.loader_workers)
+
+    class_labels = {idx: name for idx, name in enumerate(train_dataset.classes)}
+    log(f"Training images: {len(train_dataset)} ({len(train_sampler)} per rank)")
+    log(f"Validation images: {len(val_dataset)}")
+    return train_loader, val_loader, class_labels
+
+def evaluate(model, val_loader, criterion, num_classes):
+    """Validation loss and confusion-matrix metrics over all ranks' shards"""
+    model.eval()
+    metrics = ConfusionMatrix(num_classes)
+    loss_sum, total = 0.0, 0
+    with torch.no_grad():
+        for inputs, labels in val_loader:
+            outputs = model(inputs)
+            loss_sum += criterion(outputs, labels).item() * inputs.size(0)
+            total += labels.size(0)
+            metrics.update(outputs, labels)
+    loss_sum, total = all_reduce_sum(loss_sum, total)
+    dist.all_reduce(metrics.matrix)
+    dist.all_reduce(metrics.top_k_correct)
+    return loss_sum / total, metrics.compute()
+
+def train(args):
+    torch.manual_seed(SEED)
+    rank = dist.get_rank()
+    train_loader, val_loader, class_labels = create_loaders(args)
+
+    # The first process on each host downloads the pretrained weights while
+    # the others wait, then they all load them from the local cache
+    first_on_host = int(os.environ.get("LOCAL_RANK", "0")) == 0
+    if not first_on_host:
+        dist.barrier()
+    model = create_model(len(class_labels))
+    if first_on_host:
+        dist.barrier()
+    # DDP broadcasts rank 0's parameters, so every replica starts identical
+    ddp_model = DistributedDataParallel(model)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(ddp_model.parameters(), lr=args.lr)
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=0.1, patience=5)
+
+    checkpoints = CheckpointManager(CHECKPOINT_DIR, keep_last=args.keep_checkpoints)
+    history = {'train_losses': [], 'val_losses': [], 'val_accuracies': []}
+    best_val_accuracy = 0.0
+    best_metrics = None
+    start_epoch, start_step, start_train_loss, global_step = 0, 0, 0.0, 0
+
+    if args.resume:
+        checkpoint_path = checkpoints.latest() if args.resume == "latest" else args.resume
+        if checkpoint_path is None:
+            log(f"No checkpoint found in {CHECKPOINT_DIR}, starting a new run")
+        else:
+            # Every rank loads the same checkpoint; it was written by rank 0
+            state = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+            model.load_state_dict(state['model_state_dict'])
+            optimizer.load_state_dict(state['optimizer_state_dict'])
+            scheduler.load_state_dict(state['scheduler_state_dict'])
+            # Every rank seeded its RNGs identically, so each one restores them
+            restore_rng_state(state['rng_state'])
+            start_epoch = state['epoch']
+            start_step = state['step_in_epoch']
+            start_train_loss = state['epoch_train_loss']
+            global_step = state['global_step']
+            history = {key: state[key] for key in history}
+            best_val_accuracy = state['best_val_accuracy']
+            best_metrics = state.get('best_metrics')
+            log(f"Resumed from {checkpoint_path} at epoch {start_epoch+1}, step {start_step}")
+
+    def save_checkpoint(epoch, step_in_epoch, epoch_train_loss, is_best=False):
+        # Same layout as train_model.py checkpoints; resume with the same world size,
+        # since the step position counts per-rank batches
+        if rank != 0:
+            return
+        checkpoints.save({
+            'model_state_dict': model.state_dict(),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'scheduler_state_dict': scheduler.state_dict(),
+            'rng_state': capture_rng_state(),
+            'epoch': epoch,
+            'step_in_epoch': step_in_epoch,
+            'epoch_train_loss': epoch_train_loss,
+            'global_step': global_step,
+            'best_val_accuracy': best_val_accuracy,
+            'best_metrics': best_metrics,
+            'class_labels': class_labels,
+            **history
+        }, global_step, is_best=is_best)
+
+    steps_per_epoch = len(train_loader)
+    for epoch in range(start_epoch, args.epochs):
+        ddp_model.train()
+        skip_batches = start_step if epoch == start_epoch else 0
+        # The saved partial loss is already summed over ranks, so only rank 0 carries it
+        train_loss = start_train_loss if epoch == start_epoch and rank == 0 else 0.0
+        batches = start_epoch_batches(train_loader, epoch, skip_batches)
+
+        progress = tqdm(batches, desc=f"Epoch {epoch+1}/{args.epochs} - Training", initial=skip_batches,
+                        total=steps_per_epoch, disable=rank != 0)
+        for step, (inputs, labels) in enumerate(progress, start=skip_batches + 1):
+            optimizer.zero_grad()
+            loss = criterion(ddp_model(inputs), labels)
+            # Gradients are averaged across ranks during backward
+            loss.backward()
+            optimizer.step()
+
+            train_loss += loss.item() * inputs.size(0)
+            global_step += 1
+            if args.checkpoint_every and global_step % args.checkpoint_every == 0:
+                # Collective on every rank; only rank 0 writes
+                partial_loss, = all_reduce_sum(train_loss)
+                save_checkpoint(epoch, step, partial_loss)
+
+        train_loss, = all_reduce_sum(train_loss)
+        train_loss /= len(train_loader.dataset)
+        val_loss, val_metrics = evaluate(ddp_model.module, val_loader, criterion, len(class_labels))
+        val_accuracy = val_metrics['accuracy']
+        # The reduced val loss is identical on every rank, so the LR stays in step
+        scheduler.step(val_loss)
+
+        history['train_losses'].append(train_loss)
+        history['val_losses'].append(val_loss)
+        history['val_accuracies'].append(val_accuracy)
+        log(f"Epoch {epoch+1}/{args.epochs}:")
+        log(f"  Train Loss: {train_loss:.4f}")
+        log(f"  Val Loss: {val_loss:.4f}")
+        log(f"  Val Accuracy: {val_accuracy:.4f} (top-{val_metrics['top_k']}: {val_metrics['top_k_accuracy']:.4f})")
+
+        is_best = val_accuracy > best_val_accuracy
+        if is_best:
+            best_val_accuracy = val_accuracy
+            best_metrics = val_metrics
+            if rank == 0:
+                torch.save({
+                    'model_state_dict': model.state_dict(),
+                    'class_labels': class_labels,
+                    'accuracy': val_accuracy
+                }, MODEL_PATH)
+                log(f"  Model saved with accuracy: {val_accuracy:.4f}")
+        save_checkpoint(epoch + 1, 0, 0.0, is_best=is_best)
+
+    log(f"Best validation accuracy: {best_val_accuracy:.4f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed data-parallel CPU training (launch with torchrun)')
+    parser.add_argument('--epochs', type=int, default=NUM_EPOCHS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Per-process batch size')
+    parser.add_argument('--lr', type=float, default=LEARNING_RATE)
+    parser.add_argument('--threads', type=int, help='Intra-op threads per process (default: cores / local processes)')
+    parser.add_argument('--pin', action='store_true', help='Pin each local process to its own block of cores')
+    parser.add_argument('--loader-workers', type=int, default=2, help='DataLoader workers per process')
+    parser.add_argument('--resume', nargs='?', const='latest',
+                        help='Continue from a checkpoint path, or the latest one in the checkpoint directory')
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY,
+                        help='Optimizer steps between checkpoints (0 = only at epoch ends)')
+    parser.add_argument('--keep-checkpoints', type=int, default=KEEP_CHECKPOINTS)
+    args = parser.parse_args()
+
+    policy = setup(args)
+    log(f"World size {dist.get_world_size()}, per-process threads {policy['intra_op_threads']}, "
+        f"global batch {args.batch_size * dist.get_world_size()}")
+    try:
+        train(args)
+    finally:
+        dist.destroy_process_group()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import os
+import argparse
+import itertools
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -8,12 +10,15 @@ from torchvision.datasets import ImageFolder
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.metrics import accuracy_score, confusion_matrix
 import seaborn as sns
+from dataset_cache import DATASET_CACHE_DIR, CachedImageDataset, cache_exists
+from dataset_shards import DATASET_SHARD_DIR, ShardedImageDataset, shards_exist
+from evaluation import ConfusionMatrix
+from training_checkpoint import (CheckpointManager, ResumableSampler, ResumableDistributedSampler,
+                                 SeededAugmentation, capture_rng_state, restore_rng_state)
 
 # Set device
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"Using device: {device}")
 
 # Dataset paths
 KAGGLE_DATASET_PATH = os.getenv("KAGGLE_DATASET_PATH", "./plant_disease_dataset")
@@ -30,35 +35,78 @@ BATCH_SIZE = 32
 LEARNING_RATE = 0.0001
 NUM_EPOCHS = 20
 IMAGE_SIZE = 299  # Inception v3 input size
+SEED = 42
 
-def create_data_loaders():
-    """Create and return data loaders for training and validation"""
-    # Data transformations
-    train_transforms = transforms.Compose([
-        transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+# Full training checkpoints (model, optimizer, scheduler, RNG and position)
+CHECKPOINT_DIR = os.path.join(MODEL_DIR, "checkpoints")
+CHECKPOINT_EVERY = 500  # optimizer steps between checkpoints
+KEEP_CHECKPOINTS = 3  # newest step checkpoints kept besides best.pt
+
+def get_train_transforms(cached=False):
+    """Training transformations with random augmentation.
+
+    With cached=True the input is an already-resized uint8 tensor from the
+    dataset cache, so the augmentations run on small arrays with no decode.
+    """
+    steps = [] if cached else [transforms.Resize((IMAGE_SIZE, IMAGE_SIZE))]
+    steps += [
         transforms.RandomHorizontalFlip(),
         transforms.RandomRotation(15),
         transforms.RandomAffine(0, scale=(0.8, 1.2)),
         transforms.RandomAffine(0, shear=10),
         transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2),
-        transforms.ToTensor(),
+        transforms.ConvertImageDtype(torch.float) if cached else transforms.ToTensor(),
         transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    
-    val_transforms = transforms.Compose([
-        transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
-        transforms.ToTensor(),
+    ]
+    return transforms.Compose(steps)
+
+def get_val_transforms(cached=False):
+    """Deterministic validation transformations"""
+    steps = [] if cached else [transforms.Resize((IMAGE_SIZE, IMAGE_SIZE))]
+    steps += [
+        transforms.ConvertImageDtype(torch.float) if cached else transforms.ToTensor(),
         transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    
+    ]
+    return transforms.Compose(steps)
+
+def create_dataset(split, train=False, streaming=True):
+    """Dataset for a split: the pre-decoded cache, else tar shards, else the image folder"""
+    transform_factory = get_train_transforms if train else get_val_transforms
+    if cache_exists(DATASET_CACHE_DIR, split):
+        return CachedImageDataset(DATASET_CACHE_DIR, split, transform=transform_factory(cached=True))
+    if streaming and shards_exist(DATASET_SHARD_DIR, split):
+        return ShardedImageDataset(DATASET_SHARD_DIR, split, transform=transform_factory(), shuffle=train)
+    return ImageFolder(TRAIN_DIR if split == "train" else VAL_DIR, transform=transform_factory())
+
+def create_val_loader(batch_size=BATCH_SIZE):
+    """Create and return the validation data loader on its own"""
+    val_dataset = create_dataset("val")
+    return DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=4)
+
+def create_data_loaders():
+    """Create and return data loaders for training and validation"""
     # Load datasets
-    train_dataset = ImageFolder(TRAIN_DIR, transform=train_transforms)
-    val_dataset = ImageFolder(VAL_DIR, transform=val_transforms)
+    train_dataset = create_dataset("train", train=True)
+    val_dataset = create_dataset("val")
     
     # Create data loaders
-    train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True, num_workers=4)
+    # Streaming shards shuffle internally; map-style datasets get a seeded
+    # sampler so an interrupted epoch can be resumed in the same order
+    if isinstance(train_dataset, ShardedImageDataset):
+        train_sampler, loader_dataset = None, train_dataset
+    else:
+        train_sampler = ResumableSampler(train_dataset, shuffle=True, seed=SEED)
+        loader_dataset = SeededAugmentation(train_dataset, seed=SEED)
+    # The loader's own generator seeds its workers, so starting an epoch
+    # does not draw from the global RNG restored from a checkpoint
+    train_loader = DataLoader(loader_dataset, batch_size=BATCH_SIZE, sampler=train_sampler, num_workers=4,
+                              generator=torch.Generator().manual_seed(SEED))
     val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False, num_workers=4)
     
+    if isinstance(train_dataset, CachedImageDataset):
+        print(f"Reading pre-decoded images from {DATASET_CACHE_DIR}")
+    elif isinstance(train_dataset, ShardedImageDataset):
+        print(f"Streaming {len(train_dataset.shard_paths)} training shards from {DATASET_SHARD_DIR}")
     print(f"Training images: {len(train_dataset)}")
     print(f"Validation images: {len(val_dataset)}")
     print(f"Number of classes: {len(train_dataset.classes)}")
@@ -68,21 +116,63 @@ def create_data_loaders():
     
     return train_loader, val_loader, class_labels
 
-def train_model():
-    """Train the Inception V3 model on the plant disease dataset"""
-    # Create data loaders
-    train_loader, val_loader, class_labels = create_data_loaders()
-    
+def create_model(num_classes):
+    """ImageNet-pretrained Inception V3 with a new classifier head"""
     # Load pre-trained Inception v3 model
     model = models.inception_v3(pretrained=True)
     
     # Modify the final layer for our classification task
-    num_classes = len(class_labels)
     model.fc = nn.Linear(model.fc.in_features, num_classes)
     model.aux_logits = False  # Disable auxiliary output
+    # AuxLogits still runs in training mode, its output just isn't returned,
+    # so freeze it: DistributedDataParallel fails on parameters that never
+    # get a gradient. The module is kept so checkpoints load in PlantDiseaseModel
+    model.AuxLogits.requires_grad_(False)
+    return model
+
+def evaluate(model, val_loader, criterion, num_classes, desc="Validation"):
+    """Average loss and confusion-matrix metrics of the model over a loader"""
+    model.eval()
+    metrics = ConfusionMatrix(num_classes, device=device)
+    val_loss = torch.zeros((), dtype=torch.float64, device=device)
+    total = 0
+    
+    with torch.no_grad():
+        for inputs, labels in tqdm(val_loader, desc=desc):
+            inputs, labels = inputs.to(device), labels.to(device)
+            
+            # Forward pass
+            outputs = model(inputs)
+            val_loss += criterion(outputs, labels).detach() * inputs.size(0)
+            total += inputs.size(0)
+            metrics.update(outputs, labels)
+    
+    return val_loss.item() / max(1, total), metrics.compute()
+
+def start_epoch_batches(train_loader, epoch, skip_batches=0):
+    """Set up the training loader for an epoch, skipping batches already trained on"""
+    if isinstance(train_loader.sampler, (ResumableSampler, ResumableDistributedSampler)):
+        train_loader.sampler.set_epoch(epoch, start_index=skip_batches * train_loader.batch_size)
+        train_loader.dataset.set_epoch(epoch)
+        return train_loader
+    # Streaming shards cannot seek, so consumed batches are read and dropped
+    train_loader.dataset.set_epoch(epoch)
+    return itertools.islice(train_loader, skip_batches, None)
+
+def train_model(resume=None, checkpoint_every=CHECKPOINT_EVERY, keep_checkpoints=KEEP_CHECKPOINTS):
+    """Train the Inception V3 model on the plant disease dataset.
+
+    resume is a checkpoint path, or "latest" for the newest checkpoint in
+    CHECKPOINT_DIR.
+    """
+    print(f"Using device: {device}")
+    torch.manual_seed(SEED)
+    
+    # Create data loaders
+    train_loader, val_loader, class_labels = create_data_loaders()
     
     # Move model to device
-    model = model.to(device)
+    model = create_model(len(class_labels)).to(device)
     
     # Loss function and optimizer
     criterion = nn.CrossEntropyLoss()
@@ -96,14 +186,67 @@ def train_model():
     val_losses = []
     val_accuracies = []
     best_val_accuracy = 0.0
+    best_metrics = None
+    
+    # Training position; a resumed run starts where the checkpoint left off
+    checkpoints = CheckpointManager(CHECKPOINT_DIR, keep_last=keep_checkpoints)
+    start_epoch = 0
+    start_step = 0
+    start_train_loss = 0.0
+    global_step = 0
+    
+    if resume:
+        checkpoint_path = checkpoints.latest() if resume == "latest" else resume
+        if checkpoint_path is None:
+            print(f"No checkpoint found in {CHECKPOINT_DIR}, starting a new run")
+        else:
+            state = torch.load(checkpoint_path, map_location=device, weights_only=False)
+            model.load_state_dict(state['model_state_dict'])
+            optimizer.load_state_dict(state['optimizer_state_dict'])
+            scheduler.load_state_dict(state['scheduler_state_dict'])
+            restore_rng_state(state['rng_state'])
+            start_epoch = state['epoch']
+            start_step = state['step_in_epoch']
+            start_train_loss = state['epoch_train_loss']
+            global_step = state['global_step']
+            train_losses = state['train_losses']
+            val_losses = state['val_losses']
+            val_accuracies = state['val_accuracies']
+            best_val_accuracy = state['best_val_accuracy']
+            best_metrics = state.get('best_metrics')
+            print(f"Resumed from {checkpoint_path} at epoch {start_epoch+1}, step {start_step}")
+    
+    def training_state(epoch, step_in_epoch, epoch_train_loss):
+        return {
+            'model_state_dict': model.state_dict(),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'scheduler_state_dict': scheduler.state_dict(),
+            'rng_state': capture_rng_state(),
+            'epoch': epoch,
+            'step_in_epoch': step_in_epoch,
+            'epoch_train_loss': epoch_train_loss,
+            'global_step': global_step,
+            'train_losses': train_losses,
+            'val_losses': val_losses,
+            'val_accuracies': val_accuracies,
+            'best_val_accuracy': best_val_accuracy,
+            'best_metrics': best_metrics,
+            'class_labels': class_labels
+        }
+    
+    steps_per_epoch = len(train_loader)
     
     # Train the model
-    for epoch in range(NUM_EPOCHS):
+    for epoch in range(start_epoch, NUM_EPOCHS):
         # Training phase
         model.train()
-        train_loss = 0.0
+        skip_batches = start_step if epoch == start_epoch else 0
+        train_loss = start_train_loss if epoch == start_epoch else 0.0
+        batches = start_epoch_batches(train_loader, epoch, skip_batches)
         
-        for inputs, labels in tqdm(train_loader, desc=f"Epoch {epoch+1}/{NUM_EPOCHS} - Training"):
+        for step, (inputs, labels) in enumerate(tqdm(batches, desc=f"Epoch {epoch+1}/{NUM_EPOCHS} - Training",
+                                                      initial=skip_batches, total=steps_per_epoch),
+                                                 start=skip_batches + 1):
             inputs, labels = inputs.to(device), labels.to(device)
             
             # Zero the parameter gradients
@@ -118,37 +261,19 @@ def train_model():
             optimizer.step()
             
             train_loss += loss.item() * inputs.size(0)
+            global_step += 1
+            
+            if checkpoint_every and global_step % checkpoint_every == 0:
+                checkpoints.save(training_state(epoch, step, train_loss), global_step)
         
         train_loss = train_loss / len(train_loader.dataset)
         train_losses.append(train_loss)
         
         # Validation phase
-        model.eval()
-        val_loss = 0.0
-        all_predictions = []
-        all_true_labels = []
-        
-        with torch.no_grad():
-            for inputs, labels in tqdm(val_loader, desc=f"Epoch {epoch+1}/{NUM_EPOCHS} - Validation"):
-                inputs, labels = inputs.to(device), labels.to(device)
-                
-                # Forward pass
-                outputs = model(inputs)
-                loss = criterion(outputs, labels)
-                
-                val_loss += loss.item() * inputs.size(0)
-                
-                # Get predictions
-                _, preds = torch.max(outputs, 1)
-                
-                all_predictions.extend(preds.cpu().numpy())
-                all_true_labels.extend(labels.cpu().numpy())
-        
-        val_loss = val_loss / len(val_loader.dataset)
+        val_loss, val_metrics = evaluate(model, val_loader, criterion, len(class_labels),
+                                         desc=f"Epoch {epoch+1}/{NUM_EPOCHS} - Validation")
         val_losses.append(val_loss)
-        
-        # Calculate accuracy
-        val_accuracy = accuracy_score(all_true_labels, all_predictions)
+        val_accuracy = val_metrics['accuracy']
         val_accuracies.append(val_accuracy)
         
         # Update learning rate
@@ -158,11 +283,13 @@ def train_model():
         print(f"Epoch {epoch+1}/{NUM_EPOCHS}:")
         print(f"  Train Loss: {train_loss:.4f}")
         print(f"  Val Loss: {val_loss:.4f}")
-        print(f"  Val Accuracy: {val_accuracy:.4f}")
+        print(f"  Val Accuracy: {val_accuracy:.4f} (top-{val_metrics['top_k']}: {val_metrics['top_k_accuracy']:.4f})")
         
         # Save best model
-        if val_accuracy > best_val_accuracy:
+        is_best = val_accuracy > best_val_accuracy
+        if is_best:
             best_val_accuracy = val_accuracy
+            best_metrics = val_metrics
             # Save model
             torch.save({
                 'model_state_dict': model.state_dict(),
@@ -170,26 +297,24 @@ def train_model():
                 'accuracy': val_accuracy
             }, MODEL_PATH)
             print(f"  Model saved with accuracy: {val_accuracy:.4f}")
+        
+        # End-of-epoch checkpoint: a resume from here starts the next epoch
+        checkpoints.save(training_state(epoch + 1, 0, 0.0), global_step, is_best=is_best)
     
-    # Evaluate final model
-    model.eval()
-    all_predictions = []
-    all_true_labels = []
-    
-    with torch.no_grad():
-        for inputs, labels in tqdm(val_loader, desc="Final evaluation"):
-            inputs, labels = inputs.to(device), labels.to(device)
-            outputs = model(inputs)
-            _, preds = torch.max(outputs, 1)
-            all_predictions.extend(preds.cpu().numpy())
-            all_true_labels.extend(labels.cpu().numpy())
-    
-    # Calculate final accuracy
-    final_accuracy = accuracy_score(all_true_labels, all_predictions)
-    print(f"\nFinal validation accuracy: {final_accuracy:.4f}")
+    # Final metrics are those of the saved (best) model, recorded when it
+    # was validated, so no extra pass over the validation set is needed
+    if best_metrics is None:
+        _, best_metrics = evaluate(model, val_loader, criterion, len(class_labels), desc="Final evaluation")
+    final_accuracy = best_metrics['accuracy']
+    print(f"\nFinal validation accuracy: {final_accuracy:.4f} "
+          f"(top-{best_metrics['top_k']}: {best_metrics['top_k_accuracy']:.4f})")
+    print(f"{'class':<50} {'precision':>9} {'recall':>7} {'support':>8}")
+    for idx, name in class_labels.items():
+        print(f"{name:<50} {best_metrics['precision'][idx]:>9.4f} {best_metrics['recall'][idx]:>7.4f} "
+              f"{best_metrics['support'][idx]:>8}")
     
     # Plot confusion matrix
-    cm = confusion_matrix(all_true_labels, all_predictions)
+    cm = np.array(best_metrics['confusion_matrix'])
     plt.figure(figsize=(20, 20))
     sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', 
                 xticklabels=list(class_labels.values()), 
@@ -229,7 +354,17 @@ def train_model():
     }
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the Inception V3 plant disease model')
+    parser.add_argument('--resume', nargs='?', const='latest',
+                        help='Continue from a checkpoint path, or the latest one in the checkpoint directory')
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY,
+                        help='Optimizer steps between checkpoints (0 = only at epoch ends)')
+    parser.add_argument('--keep-checkpoints', type=int, default=KEEP_CHECKPOINTS,
+                        help='Number of recent checkpoints kept in addition to the best')
+    args = parser.parse_args()
+    
     print("=== Training Plant Disease Detection Model ===")
-    metrics = train_model()
+    metrics = train_model(resume=args.resume, checkpoint_every=args.checkpoint_every,
+                          keep_checkpoints=args.keep_checkpoints)
     print(f"Training completed with {metrics['final_accuracy']*100:.2f}% accuracy")
     print(f"The model can detect {len(metrics['class_labels'])} different plant diseases") 
\ No newline at end of file
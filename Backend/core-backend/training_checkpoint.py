@@ -0,0 +1,150 @@
+import os
+import re
+import glob
+import random
+import itertools
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler, DistributedSampler
+
+CHECKPOINT_PATTERN = re.compile(r"ckpt-(\d+)\.pt$")
+
+def capture_rng_state():
+    """RNG state of python, numpy and torch (and CUDA when present)"""
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def restore_rng_state(state):
+    """Restore the RNG state captured by capture_rng_state"""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def atomic_save(obj, path):
+    """torch.save to a temporary file and rename it into place, so a crash never leaves a torn file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class CheckpointManager:
+    """Step-numbered training checkpoints in one directory.
+
+    Keeps the newest keep_last ckpt-<step>.pt files plus best.pt, which is
+    written separately and never pruned.
+    """
+
+    def __init__(self, directory, keep_last=3):
+        self.directory = directory
+        self.keep_last = max(1, keep_last)
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def best_path(self):
+        return os.path.join(self.directory, "best.pt")
+
+    def checkpoints(self):
+        """Checkpoint paths, oldest first"""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, "ckpt-*.pt")):
+            match = CHECKPOINT_PATTERN.search(path)
+            if match:
+                found.append((int(match.group(1)), path))
+        return [path for _, path in sorted(found)]
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, state, step, is_best=False):
+        """Write a checkpoint for this global step, then apply the retention policy"""
+        path = os.path.join(self.directory, f"ckpt-{step:08d}.pt")
+        atomic_save(state, path)
+        if is_best:
+            atomic_save(state, self.best_path)
+        for old_path in self.checkpoints()[:-self.keep_last]:
+            os.remove(old_path)
+        return path
+
+class ResumableSampler(Sampler):
+    """Seeded per-epoch shuffle that can start partway through an epoch.
+
+    The order depends only on (seed, epoch), so a resumed run sees exactly
+    the batches the interrupted run had not reached yet.
+    """
+
+    def __init__(self, data_source, shuffle=True, seed=0):
+        self.num_samples = len(data_source)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def __iter__(self):
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(self.num_samples, generator=generator).tolist()
+        else:
+            order = list(range(self.num_samples))
+        return iter(order[self.start_index:])
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+class ResumableDistributedSampler(DistributedSampler):
+    """DistributedSampler that can start partway through this rank's share of an epoch"""
+
+    def __init__(self, dataset, **kwargs):
+        super().__init__(dataset, **kwargs)
+        self.start_index = 0
+
+    def set_epoch(self, epoch, start_index=0):
+        super().set_epoch(epoch)
+        self.start_index = start_index
+
+    def __iter__(self):
+        return itertools.islice(super().__iter__(), self.start_index, None)
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+class SeededAugmentation(Dataset):
+    """Wraps a training dataset so each sample's random augmentation is seeded by (seed, epoch, index).
+
+    The torchvision transforms draw from the torch RNG of whichever loader
+    worker reads the sample, so without this a resumed run, whose batches
+    land on different workers, would see different crops and flips. The
+    global RNG is forked around each sample, so dropout is unaffected.
+    """
+
+    def __init__(self, dataset, seed=0):
+        self.dataset = dataset
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        sample_seed = ((self.seed * 1_000_003 + self.epoch) * 1_000_000_007 + index) % (2 ** 63)
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(sample_seed)
+            return self.dataset[index]
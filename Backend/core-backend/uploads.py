@@ -0,0 +1,284 @@
+import os
+import uuid
+import fcntl
+import struct
+import hashlib
+from tempfile import SpooledTemporaryFile
+from PIL import Image
+from werkzeug.exceptions import HTTPException
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure upload folder
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", 'uploads')
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# Largest accepted image file, and the whole request body (image plus form overhead)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(MAX_UPLOAD_BYTES + 64 * 1024)))
+# Largest accepted image by pixel count; anything bigger is treated as a
+# decompression bomb and rejected from its header, before decoding
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+# Bytes of an upload searched for the image dimensions; JPEG EXIF and ICC
+# segments can push the frame header well past the start of the file
+MAX_HEADER_BYTES = 512 * 1024
+# Uploads up to this size are spooled in memory, larger ones to a temp file
+SPOOL_MEMORY_BYTES = 512 * 1024
+
+# Let PIL refuse oversized images too, should one reach a decoder another way
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start-of-frame markers carry the dimensions (C4, C8 and CC are not frames)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+class UploadRejected(HTTPException):
+    """An upload refused by validation; code is the HTTP status to answer with"""
+
+    def __init__(self, description, code=400):
+        super().__init__(description)
+        self.code = code
+
+def allowed_file(filename):
+    """Check if file extension is allowed"""
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def _jpeg_dimensions(data):
+    """Width and height from the JPEG frame header, or None if more bytes are needed"""
+    i = 2
+    while True:
+        if i + 4 > len(data):
+            return None
+        if data[i] != 0xFF:
+            raise UploadRejected('Corrupt JPEG header')
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length field
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise UploadRejected('JPEG has no frame header')
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+
+def inspect_image_header(data):
+    """Identify an image from its first bytes.
+
+    Returns (format, width, height), or None if the header is not complete
+    yet. Raises UploadRejected for anything that is not a PNG or JPEG.
+    """
+    if len(data) < 8:
+        if PNG_SIGNATURE.startswith(data[:8]) or b'\xff\xd8\xff'.startswith(data[:3]):
+            return None
+        raise UploadRejected('File is not a PNG or JPEG image', 415)
+
+    if data.startswith(PNG_SIGNATURE):
+        if len(data) < 24:
+            return None
+        if data[12:16] != b'IHDR':
+            raise UploadRejected('Corrupt PNG header')
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+
+    if data.startswith(b'\xff\xd8\xff'):
+        dimensions = _jpeg_dimensions(data)
+        return ('jpeg', *dimensions) if dimensions else None
+
+    raise UploadRejected('File is not a PNG or JPEG image', 415)
+
+def check_dimensions(width, height):
+    if width == 0 or height == 0:
+        raise UploadRejected('Image has no pixels')
+    if width * height > MAX_IMAGE_PIXELS:
+        raise UploadRejected(f'Image is {width}x{height}, more than the {MAX_IMAGE_PIXELS} pixel limit', 413)
+
+class ValidatingFileStream:
+    """Spools an uploaded file while validating it as the bytes arrive.
+
+    Used as the multipart parser's file stream, so an upload that is too
+    large, not an image, or a decompression bomb is refused at the first
+    chunk that shows it, without reading the rest of the body.
+    """
+
+    def __init__(self, max_bytes=MAX_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        self.file = SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        self.size = 0
+        self.header = bytearray()
+        self.image_info = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadRejected(f'Upload is larger than {self.max_bytes} bytes', 413)
+        if self.image_info is None:
+            self.header += data
+            self.image_info = inspect_image_header(bytes(self.header[:MAX_HEADER_BYTES]))
+            if self.image_info is not None:
+                check_dimensions(self.image_info[1], self.image_info[2])
+                self.header = None
+            elif len(self.header) >= MAX_HEADER_BYTES:
+                raise UploadRejected('Image dimensions not found in the file header')
+        return self.file.write(data)
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+def check_upload(file):
+    """Validate an uploaded FileStorage and return (format, width, height).
+
+    Uploads received through ValidatingFileStream were checked while they
+    arrived; any other stream is checked here from its header.
+    """
+    stream = file.stream
+    info = getattr(stream, 'image_info', None)
+    if info is None:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        if stream.tell() > MAX_UPLOAD_BYTES:
+            raise UploadRejected(f'Upload is larger than {MAX_UPLOAD_BYTES} bytes', 413)
+        stream.seek(position)
+        header = stream.read(MAX_HEADER_BYTES)
+        stream.seek(position)
+        info = inspect_image_header(header)
+        if info is None:
+            raise UploadRejected('Image is truncated or its dimensions were not found')
+        check_dimensions(info[1], info[2])
+    return info
+
+# Stored uploads are content-addressed: an image is kept once, at
+# <root>/<h[0:2]>/<h[2:4]>/<sha256><ext>, however often it is uploaded
+UPLOAD_SHARD_DEPTH = 2
+# Scratch space inside the upload folder, so completed files can be renamed into place atomically
+UPLOAD_TMP_DIR = '.tmp'
+FORMAT_EXTENSIONS = {'jpeg': '.jpg', 'png': '.png'}
+COPY_CHUNK_BYTES = 1024 * 1024
+# Blobs are locked in stripes by the first hex byte of their hash, so
+# there are at most 256 lock files however many images are stored
+UPLOAD_LOCK_STRIPE_CHARS = 2
+
+def blob_path(image_id, root=None):
+    """Path of a stored upload from its image_id (<sha256><ext>)"""
+    root = root or UPLOAD_FOLDER
+    shards = [image_id[2 * i:2 * i + 2] for i in range(UPLOAD_SHARD_DEPTH)]
+    return os.path.join(root, *shards, image_id)
+
+class UploadLock:
+    """Exclusive lock on an image_id's blob, across threads and worker processes.
+
+    Putting a blob in place and deleting it both run under this lock, so a
+    blob is never deleted after a request that holds a reference to it has
+    put it in place.
+    """
+
+    def __init__(self, image_id, root=None):
+        self.path = os.path.join(root or UPLOAD_FOLDER, UPLOAD_TMP_DIR, 'locks',
+                                 f"{image_id[:UPLOAD_LOCK_STRIPE_CHARS]}.lock")
+        self.fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # flock locks belong to the open file, so separate opens exclude
+        # each other between threads of one process too
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd = fd
+
+    def release(self):
+        fd, self.fd = self.fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def spool_upload(stream, root=None, extension='.jpg'):
+    """Copy a stream to a scratch file while hashing it; returns (image_id, temp_path)"""
+    tmp_dir = os.path.join(root or UPLOAD_FOLDER, UPLOAD_TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    temp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return digest.hexdigest() + extension, temp_path
+
+def commit_upload(temp_path, image_id, root=None):
+    """Move a spooled upload to its blob path and return that path.
+
+    Always renames, even over an existing blob: the content is identical
+    and the rename guarantees the blob exists once a reference is held.
+    """
+    path = blob_path(image_id, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with UploadLock(image_id, root):
+        os.replace(temp_path, path)
+    return path
+
+def store_upload(file, acquire, root=None):
+    """Validate and store an uploaded FileStorage, taking one reference on its blob.
+
+    acquire(image_id) records the reference. It runs before the blob is put
+    in place, so a concurrent release of the same content cannot delete it
+    from under this request. Returns (image_id, path).
+    """
+    image_format = check_upload(file)[0]
+    image_id, temp_path = spool_upload(file.stream, root, FORMAT_EXTENSIONS[image_format])
+    try:
+        acquire(image_id)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return image_id, commit_upload(temp_path, image_id, root)
+
+def delete_blob(image_id, root=None):
+    """Delete a stored upload's file; call with its UploadLock held"""
+    try:
+        os.remove(blob_path(image_id, root))
+    except FileNotFoundError:
+        pass
+
+def remove_upload(image_id, delete_record, root=None):
+    """Delete a blob whose reference count reached zero.
+
+    delete_record() removes its record only if the count is still zero and
+    runs under the blob's lock. A request that acquires the same content
+    afterwards cannot put its blob in place until the old one is deleted,
+    and one that acquired it first keeps the record, and so the file.
+    """
+    with UploadLock(image_id, root):
+        if not delete_record():
+            return False
+        delete_blob(image_id, root)
+        return True